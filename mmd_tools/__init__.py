@@ -86,6 +86,17 @@ class MMDToolsAddonPreferences(bpy.types.AddonPreferences):
             soft_max=10,
             default=1.5,
             )
+    model_cache_folder = bpy.props.StringProperty(
+            name='Model Cache Folder',
+            description='Path for caching decoded and cleaned pmx/pmd models, which are imported again faster (leave empty to disable)',
+            subtype='DIR_PATH',
+            )
+    model_cache_size = bpy.props.IntProperty(
+            name='Model Cache Size (MB)',
+            description='The maximum size of the model cache, the least recently used models are removed',
+            min=1,
+            default=1024,
+            )
 
     def draw(self, context):
         layout = self.layout
@@ -93,6 +104,8 @@ class MMDToolsAddonPreferences(bpy.types.AddonPreferences):
         layout.prop(self, "base_texture_folder")
         layout.prop(self, "dictionary_folder")
         layout.prop(self, "non_collision_threshold")
+        layout.prop(self, "model_cache_folder")
+        layout.prop(self, "model_cache_size")
 
 
 def menu_func_import(self, context):
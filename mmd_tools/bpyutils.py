@@ -284,6 +284,47 @@ def makeCapsule(segment=8, ring_count=2, radius=1.0, height=1.0, target_object=N
     bm.free()
     return target_object
 
+def add_vertex_group_weights(vertex_groups, group_indices, vertex_indices, weights, type='ADD'):
+    """ Add weights to vertex groups by one VertexGroup.add() call per unique weight of each vertex group.
+
+    @param vertex_groups a list of vertex groups indexed by group_indices
+    @param group_indices, vertex_indices, weights arrays of the same length, one item per weight
+    """
+    import numpy as np
+    group_indices = np.asarray(group_indices)
+    vertex_indices = np.asarray(vertex_indices)
+    weights = np.asarray(weights)
+    if len(weights) < 1:
+        return
+    order = np.lexsort((weights, group_indices))
+    group_indices, vertex_indices, weights = group_indices[order], vertex_indices[order], weights[order]
+    starts = np.flatnonzero(np.concatenate(([True], (group_indices[1:] != group_indices[:-1]) | (weights[1:] != weights[:-1]))))
+    ends = np.append(starts[1:], len(weights))
+    vertex_indices = vertex_indices.tolist()
+    for group_index, weight, start, end in zip(group_indices[starts].tolist(), weights[starts].tolist(), starts.tolist(), ends.tolist()):
+        vertex_groups[group_index].add(index=vertex_indices[start:end], weight=weight, type=type)
+
+def set_vertex_group_weights(mesh, vertex_group_weights):
+    """ Set a weight of every vertex to vertex groups through a bmesh deform layer.
+
+    It is faster than VertexGroup.add() for the weights which are different for each vertex.
+
+    @param vertex_group_weights a list of (vertex group, an array of vertex weights)
+    """
+    import bmesh
+    import numpy as np
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    deform_layer = bm.verts.layers.deform.verify()
+    indices = [vg.index for vg, weights in vertex_group_weights]
+    weights = np.clip(np.column_stack([w for vg, w in vertex_group_weights]), 0, 1).tolist()
+    for v, vertex_weights in zip(bm.verts, weights):
+        dvert = v[deform_layer]
+        for index, weight in zip(indices, vertex_weights):
+            dvert[index] = weight
+    bm.to_mesh(mesh)
+    bm.free()
+
 
 class ObjectOp:
 
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Module for building a catalogue of the metadata of pmx/pmd files in a directory
+
+import os
+import sys
+import csv
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from mmd_tools.core import pmd
+from mmd_tools.core import pmx
+
+PROBE_FUNCTIONS = {
+    '.pmx': pmx.probe,
+    '.pmd': pmd.probe,
+    }
+
+CSV_FIELDS = (
+    'filepath', 'format', 'version', 'name', 'name_e', 'comment', 'comment_e',
+    'num_vertices', 'num_faces', 'num_textures', 'num_materials', 'num_bones',
+    'num_morphs', 'num_display', 'num_rigids', 'num_joints', 'textures', 'error',
+    )
+
+def probe(filepath):
+    """ Probe a pmx/pmd file. Errors are reported in the 'error' item instead of being raised.
+    """
+    try:
+        return PROBE_FUNCTIONS[os.path.splitext(filepath)[1].lower()](filepath)
+    except Exception as e:
+        return {'filepath':filepath, 'error':'%s: %s'%(e.__class__.__name__, e)}
+
+def find_files(directory, recursive=True):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in PROBE_FUNCTIONS:
+                yield os.path.join(root, name)
+        if not recursive:
+            break
+
+def _init_worker():
+    logging.getLogger().setLevel(logging.WARNING)
+
+def scan(directory, recursive=True, max_workers=None):
+    """ Probe all pmx/pmd files in a directory.
+
+    Files are probed by a pool of forked worker processes on Linux, since the add-on
+    can not be imported by a new interpreter outside of Blender, and forking the
+    multi-threaded Blender process is unsafe on macOS. Otherwise the files are
+    probed in this process.
+
+    @return a list of dicts returned by probe(), sorted by file path
+    """
+    filepaths = list(find_files(directory, recursive))
+    if len(filepaths) > 1 and max_workers != 1 and sys.platform.startswith('linux'):
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker) as executor:
+            return list(executor.map(probe, filepaths, chunksize=16))
+    return [probe(f) for f in filepaths]
+
+def save_json(entries, filepath):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+
+def save_csv(entries, filepath):
+    with open(filepath, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for entry in entries:
+            row = dict(entry)
+            row['textures'] = ';'.join(entry.get('textures', ()))
+            writer.writerow(row)
+
+def write_catalogue(directory, filepath, recursive=True, max_workers=None):
+    """ Scan a directory and write the catalogue to a .json or .csv file.
+
+    @return the number of catalogued files
+    """
+    entries = scan(directory, recursive, max_workers)
+    if filepath.lower().endswith('.csv'):
+        save_csv(entries, filepath)
+    else:
+        save_json(entries, filepath)
+    return len(entries)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Module for decoding pmx/pmd files in worker processes while the models are built in Blender
+
+import os
+import sys
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from mmd_tools.core import pmx
+from mmd_tools.core.model_cache import compact
+from mmd_tools.core.pmx.importer import PMXImporter, _PMXCleaner
+from mmd_tools.core.pmd.importer import import_pmd_to_pmx
+
+def load_model(filepath, sections=None):
+    """ Decode a pmx/pmd file to a pmx model. A pmd file is converted to pmx.
+    """
+    if os.path.splitext(filepath)[1].lower() == '.pmd':
+        return import_pmd_to_pmx(filepath)
+    return pmx.load(filepath, sections=sections)
+
+def load_import_args(filepath, types, clean_model=False, remove_doubles=False, cache=None):
+    """ Decode and clean a pmx/pmd file for PMXImporter through a ModelCache.
+
+    The decoded model is cleaned here as PMXImporter would do with the same
+    options, and stored in the cache. The cache is looked up first, so a file
+    imported before with the same options is neither decoded nor cleaned again.
+
+    @param cache a ModelCache, or None to always decode the file
+    @return a dict of the arguments 'pmx', 'pmx_cleaned' and 'vertex_map' of PMXImporter.execute()
+    """
+    sections = {x for t in types for x in PMXImporter.SECTIONS.get(t, ())}
+    clean = 'MESH' in types and (clean_model or remove_doubles)
+    mesh_only = 'MORPHS' not in types
+    key = None
+    if cache is not None:
+        options = {'sections':sections}
+        if clean:
+            options.update(clean_model=clean_model, remove_doubles=remove_doubles, mesh_only=mesh_only)
+        key = cache.key(filepath, **options)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    model = compact(load_model(filepath, sections))
+    vertex_map = None
+    if clean and clean_model:
+        _PMXCleaner.clean(model, mesh_only)
+    if clean and remove_doubles:
+        vertex_map = _PMXCleaner.remove_doubles(model, mesh_only)
+    data = {'pmx':model, 'pmx_cleaned':clean, 'vertex_map':vertex_map}
+    if key is not None:
+        cache.put(key, data)
+    return data
+
+def _init_worker(log_level):
+    logging.getLogger().setLevel(log_level)
+
+def _load_args(filepath, types, sections, clean_options, cache):
+    if cache is None:
+        return {'pmx':load_model(filepath, sections)}
+    return load_import_args(filepath, types, cache=cache, **clean_options)
+
+def load_models(filepaths, types, max_workers=None, log_level=logging.WARNING, cache=None, clean_model=False, remove_doubles=False):
+    """ Decode pmx/pmd files in a pool of worker processes.
+
+    The models are yielded in the order of filepaths as soon as each one is
+    decoded, so the caller can build the objects of a model while the others
+    are still decoding. The pool is only used for multiple files on Linux, since
+    the add-on can not be imported by a new interpreter outside of Blender and
+    forking the multi-threaded Blender process is unsafe on macOS. Otherwise the
+    files are loaded one by one, and without a cache the importer is expected to
+    load the file itself.
+
+    A file which fails to decode doesn't stop the others, its error is yielded instead.
+
+    @param types the import types of PMXImporter, which select the pmx sections to decode
+    @param cache a ModelCache of the decoded and cleaned models, see load_import_args()
+    @return an iterator of (filepath, a dict of the model arguments of PMXImporter.execute(), the exception or None)
+    """
+    filepaths = list(filepaths)
+    sections = {x for t in types for x in PMXImporter.SECTIONS.get(t, ())}
+    clean_options = {'clean_model':clean_model, 'remove_doubles':remove_doubles}
+    if len(filepaths) < 2 or max_workers == 1 or not sys.platform.startswith('linux'):
+        for f in filepaths:
+            if cache is None:
+                yield f, {}, None
+                continue
+            try:
+                args = _load_args(f, types, sections, clean_options, cache)
+            except Exception as e:
+                yield f, None, e
+            else:
+                yield f, args, None
+        return
+
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers, mp_context=context, initializer=_init_worker, initargs=(log_level,)) as executor:
+        futures = [executor.submit(_load_args, f, types, sections, clean_options, cache) for f in filepaths]
+        try:
+            for f, future in zip(filepaths, futures):
+                try:
+                    args = future.result()
+                except Exception as e:
+                    yield f, None, e
+                else:
+                    yield f, args, None
+        finally:
+            for future in futures:
+                future.cancel()
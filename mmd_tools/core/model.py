@@ -181,6 +181,7 @@ class Model:
          @param collision_group_mask list of boolean values. (length:16)
          @param name Object name (Optional)
          @param name_e English object name (Optional)
+         @param obj_name the name of the object if it differs from name (Optional)
          @param bone
         '''
 
@@ -193,6 +194,7 @@ class Model:
         collision_group_mask = kwargs.get('collision_group_mask')
         name = kwargs.get('name')
         name_e = kwargs.get('name_e')
+        obj_name = kwargs.get('obj_name', name)
         bone = kwargs.get('bone')
 
         friction = kwargs.get('friction')
@@ -216,8 +218,9 @@ class Model:
             obj.mmd_rigid.collision_group_number = collision_group_number
         if collision_group_mask is not None:
             obj.mmd_rigid.collision_group_mask = collision_group_mask
+        if obj_name is not None:
+            obj.name = obj_name
         if name is not None:
-            obj.name = name
             obj.mmd_rigid.name_j = name
         if name_e is not None:
             obj.mmd_rigid.name_e = name_e
@@ -284,6 +287,7 @@ class Model:
          @param collision_group_mask list of boolean values. (length:16)
          @param name Object name
          @param name_e English object name (Optional)
+         @param obj_name the name of the object if it differs from 'J.' + name (Optional)
          @param bone
         '''
 
@@ -307,7 +311,7 @@ class Model:
         if obj is None:
             obj, = self.createJointPool(1)
 
-        obj.name = 'J.' + name
+        obj.name = kwargs.get('obj_name', 'J.' + name)
         obj.mmd_joint.name_j = name
         if name_e is not None:
             obj.mmd_joint.name_e = name_e
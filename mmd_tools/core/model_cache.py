@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# Module for caching decoded pmx models in a directory
+
+import os
+import json
+import hashlib
+import logging
+import binascii
+
+import numpy as np
+
+from mmd_tools import bl_info
+from mmd_tools.core import pmx
+
+class ModelCache:
+    """ A directory of decoded pmx models keyed by the content hash of the source file and the load options.
+
+    Each entry is a npz file of the columnar data of a model (vertices, faces and
+    vertex/uv morph offsets) with the other pmx objects described as json, see
+    dump_model(). A hit only has to read a few arrays instead of parsing and
+    cleaning the file, and nothing but numpy arrays and pmx objects is created
+    from an entry, so a cache folder can be shared. The least recently used
+    entries are removed if the total size of the entries exceeds size_limit bytes.
+    """
+    MAGIC = 'MMDTCACHE'
+    VERSION = '.'.join(str(x) for x in bl_info['version']) # the entries of other versions are invalid
+    EXT = '.mmdcache'
+
+    def __init__(self, directory, size_limit=1024*1024*1024):
+        self.directory = directory
+        self.size_limit = size_limit
+
+    def __repr__(self):
+        return '<%s %s>'%(self.__class__.__name__, self.directory)
+
+    @staticmethod
+    def fileHash(filepath, chunk_size=1024*1024):
+        h = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def key(self, filepath, **options):
+        """ Get the cache key of a file loaded with options, which have to be plain values.
+        """
+        ext = os.path.splitext(filepath)[1].lower()
+        options = repr(sorted((k, sorted(v) if isinstance(v, (set, frozenset)) else v) for k, v in options.items()))
+        h = hashlib.sha1()
+        h.update(('%s:%s:%s:%s'%(self.VERSION, ext, self.fileHash(filepath), options)).encode('utf-8'))
+        return h.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + self.EXT)
+
+    def get(self, key):
+        """ Get the data stored with key, or None if there is no valid entry.
+
+        @return a dict of 'pmx', 'pmx_cleaned' and 'vertex_map', see put()
+        """
+        path = self.__path(key)
+        try:
+            with open(path, 'rb') as f:
+                with np.load(f, allow_pickle=False) as npz:
+                    arrays = {k:npz[k] for k in npz.files}
+            meta = json.loads(arrays.pop('meta').tobytes().decode('utf-8'))
+            if meta.get('magic') != self.MAGIC or meta.get('version') != self.VERSION or meta.get('key') != key:
+                raise ValueError('invalid header')
+            data = {
+                'pmx': load_model(arrays, meta['model']),
+                'pmx_cleaned': meta['pmx_cleaned'],
+                'vertex_map': arrays.get('vertex_map', None),
+                }
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning('Removing invalid model cache "%s": %s', path, e)
+            self.__remove(path)
+            return None
+        try:
+            os.utime(path) # mark as recently used
+        except OSError:
+            pass
+        logging.info('Loaded model cache "%s"', path)
+        return data
+
+    def put(self, key, data):
+        """ Store data with key and remove the least recently used entries over the size limit.
+
+        @param data a dict of a pmx model 'pmx', the flag 'pmx_cleaned' and the array 'vertex_map' or None
+        """
+        arrays, model_meta = dump_model(data['pmx'])
+        meta = {'magic':self.MAGIC, 'version':self.VERSION, 'key':key, 'pmx_cleaned':bool(data.get('pmx_cleaned', False)), 'model':model_meta}
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), np.uint8)
+        if data.get('vertex_map', None) is not None:
+            arrays['vertex_map'] = np.asarray(data['vertex_map'])
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.__path(key)
+        tmp_path = '%s.%d.tmp'%(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except:
+            self.__remove(tmp_path)
+            raise
+        logging.info('Stored model cache "%s"', path)
+        self.evict()
+
+    def entries(self):
+        """ Get a list of (mtime, size, path) of the entries, from the least recently used.
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(self.EXT):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError: # removed by another process
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(x[1] for x in entries)
+        for mtime, size, path in entries:
+            if total_size <= self.size_limit:
+                break
+            self.__remove(path)
+            total_size -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            self.__remove(path)
+
+    @staticmethod
+    def __remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def compact(model):
+    """ Convert the vertices, faces and morph offsets of a pmx model to columnar data,
+    which is stored as a few arrays instead of an object per item.
+    """
+    additional_uvs = model.header.additional_uvs if model.header else 0
+    model.vertices = pmx.from_arrays(pmx.columnar(model.vertices, pmx.VertexArrays.fromVertices, additional_uvs))
+    model.faces = pmx.from_arrays(pmx.columnar(model.faces, pmx.FaceArrays.fromFaces))
+    for m in model.morphs:
+        if isinstance(m, pmx.VertexMorph) or isinstance(m, pmx.UVMorph):
+            size = 3 if isinstance(m, pmx.VertexMorph) else 4
+            m.offsets = pmx.from_arrays(pmx.columnar(m.offsets, pmx.MorphOffsetArrays.fromOffsets, size))
+    return model
+
+def dump_model(model):
+    """ Split a pmx model into numpy arrays and a json value of the other data.
+
+    The arrays are the columnar vertices, faces and vertex/uv morph offsets.
+    The other pmx objects are described by their class names and attributes.
+
+    @return a tuple of (a dict of arrays, a json value), see load_model()
+    """
+    additional_uvs = model.header.additional_uvs if model.header else 0
+    vertices = pmx.columnar(model.vertices, pmx.VertexArrays.fromVertices, additional_uvs)
+    arrays = {'vertices.'+name:getattr(vertices, name) for name in pmx.VertexArrays._FIELDS}
+    arrays['faces'] = pmx.columnar(model.faces, pmx.FaceArrays.fromFaces).indices
+    morphs = []
+    for i, m in enumerate(model.morphs):
+        if isinstance(m, pmx.VertexMorph) or isinstance(m, pmx.UVMorph):
+            size = 3 if isinstance(m, pmx.VertexMorph) else 4
+            offsets = pmx.columnar(m.offsets, pmx.MorphOffsetArrays.fromOffsets, size)
+            arrays['morphs.%d.index'%i] = offsets.index
+            arrays['morphs.%d.offset'%i] = offsets.offset
+            morphs.append(_to_json(m, exclude=('offsets',)))
+        else:
+            morphs.append(_to_json(m))
+    return arrays, {'model':_to_json(model, exclude=('vertices', 'faces', 'morphs')), 'morphs':morphs}
+
+def load_model(arrays, value):
+    """ Create a pmx model from the arrays and the json value of dump_model().
+    """
+    model = _from_json(value['model'])
+    vertices = pmx.VertexArrays.__new__(pmx.VertexArrays)
+    for name in pmx.VertexArrays._FIELDS:
+        setattr(vertices, name, arrays['vertices.'+name])
+    model.vertices = pmx.from_arrays(vertices)
+    faces = pmx.FaceArrays.__new__(pmx.FaceArrays)
+    faces.indices = arrays['faces']
+    model.faces = pmx.from_arrays(faces)
+    model.morphs = [_from_json(x) for x in value['morphs']]
+    for i, m in enumerate(model.morphs):
+        if 'morphs.%d.index'%i in arrays:
+            offsets = pmx.MorphOffsetArrays.__new__(pmx.MorphOffsetArrays)
+            offsets.index = arrays['morphs.%d.index'%i]
+            offsets.offset = arrays['morphs.%d.offset'%i]
+            m.offsets = pmx.from_arrays(offsets)
+    return model
+
+def _to_json(value, exclude=()):
+    """ Convert pmx data to a json value. Each json object is tagged with the type of the converted value.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, tuple):
+        return {'tuple':[_to_json(x) for x in value]}
+    if isinstance(value, (list, pmx._LazyList, np.ndarray)):
+        return [_to_json(x) for x in value]
+    if isinstance(value, dict):
+        return {'dict':[[_to_json(k), _to_json(v)] for k, v in value.items()]}
+    if isinstance(value, bytes):
+        return {'bytes':binascii.hexlify(value).decode('ascii')}
+    if getattr(pmx, type(value).__name__, None) is type(value):
+        attrs = {k:_to_json(v) for k, v in vars(value).items() if k not in exclude}
+        return {'pmx':type(value).__name__, 'attrs':attrs}
+    raise TypeError('unsupported type of pmx data: %s'%type(value).__name__)
+
+def _from_json(value):
+    """ Convert a json value of _to_json() to pmx data. Only the classes of the pmx module are created.
+    """
+    if isinstance(value, list):
+        return [_from_json(x) for x in value]
+    if not isinstance(value, dict):
+        return value
+    if 'tuple' in value:
+        return tuple(_from_json(x) for x in value['tuple'])
+    if 'dict' in value:
+        return {_from_json(k):_from_json(v) for k, v in value['dict']}
+    if 'bytes' in value:
+        return binascii.unhexlify(value['bytes'].encode('ascii'))
+    cls = getattr(pmx, value['pmx'], None)
+    if not isinstance(cls, type) or cls.__module__ != pmx.__name__:
+        raise ValueError('invalid class of pmx data: %s'%value['pmx'])
+    obj = cls.__new__(cls)
+    obj.__dict__.update((k, _from_json(v)) for k, v in value['attrs'].items())
+    return obj
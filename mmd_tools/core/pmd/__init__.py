@@ -2,9 +2,14 @@
 import struct
 import os
 import re
+import mmap
 import logging
 import collections
 
+import numpy as np
+
+from mmd_tools.core.pmx import FaceArrays, from_arrays
+
 class InvalidFileError(Exception):
     pass
 class UnsupportedVersionError(Exception):
@@ -45,48 +50,109 @@ class  FileReadStream(FileStream):
         self.__fin = open(path, 'rb')
         FileStream.__init__(self, path, self.__fin)
 
+    def _unpack(self, fmt, size):
+        return struct.unpack(fmt, self.__fin.read(size))
+
 
     # READ / WRITE methods for general types
     def readInt(self):
-        v, = struct.unpack('<i', self.__fin.read(4))
+        v, = self._unpack('<i', 4)
         return v
 
     def readUnsignedInt(self):
-        v, = struct.unpack('<I', self.__fin.read(4))
+        v, = self._unpack('<I', 4)
         return v
 
     def readShort(self):
-        v, = struct.unpack('<h', self.__fin.read(2))
+        v, = self._unpack('<h', 2)
         return v
 
     def readUnsignedShort(self):
-        v, = struct.unpack('<H', self.__fin.read(2))
+        v, = self._unpack('<H', 2)
         return v
 
     def readStr(self, size):
-        buf = self.__fin.read(size)
+        buf = self.readBytes(size)
         if buf[0] == b'\xfd':
             return ''
         return buf.split(b'\x00')[0].decode('shift_jis', errors='replace')
 
     def readFloat(self):
-        v, = struct.unpack('<f', self.__fin.read(4))
+        v, = self._unpack('<f', 4)
         return v
 
     def readVector(self, size):
-        return struct.unpack('<'+'f'*size, self.__fin.read(4*size))
+        return self._unpack('<'+'f'*size, 4*size)
 
     def readByte(self):
-        v, = struct.unpack('<B', self.__fin.read(1))
+        v, = self._unpack('<B', 1)
         return v
 
     def readBytes(self, length):
         return self.__fin.read(length)
 
+    def skip(self, length):
+        self.__fin.seek(length, os.SEEK_CUR)
+
     def readSignedByte(self):
-        v, = struct.unpack('<b', self.__fin.read(1))
+        v, = self._unpack('<b', 1)
+        return v
+
+    def readArray(self, dtype, count):
+        """ Read count items of dtype into a numpy array.
+        """
+        dtype = np.dtype(dtype)
+        buf = self.readBytes(dtype.itemsize * count)
+        if len(buf) < dtype.itemsize * count:
+            raise struct.error('unpack requires a buffer of %d bytes'%(dtype.itemsize * count))
+        return np.frombuffer(buf, dtype, count)
+
+
+class MappedFileReadStream(FileReadStream):
+    """ A read stream over a memory-mapped file.
+
+    Values are unpacked at the current offset of the mapped buffer, and
+    readArray() returns views of the mapped file without copying.
+    """
+    def __init__(self, path, pmx_header=None):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.__buffer = b''
+        self.__pos = 0
+        FileStream.__init__(self, path, None)
+
+    def _unpack(self, fmt, size):
+        v = struct.unpack_from(fmt, self.__buffer, self.__pos)
+        self.__pos += size
         return v
 
+    def readBytes(self, length):
+        data = self.__buffer[self.__pos:self.__pos+length]
+        self.__pos += len(data)
+        return data
+
+    def skip(self, length):
+        self.__pos += length
+
+    def readArray(self, dtype, count):
+        dtype = np.dtype(dtype)
+        if self.__pos + dtype.itemsize * count > len(self.__buffer):
+            raise struct.error('unpack requires a buffer of %d bytes'%(dtype.itemsize * count))
+        data = np.frombuffer(self.__buffer, dtype, count, self.__pos)
+        self.__pos += dtype.itemsize * count
+        return data
+
+    def close(self):
+        if isinstance(self.__buffer, mmap.mmap):
+            logging.debug('close the file("%s")', self.path())
+            try:
+                self.__buffer.close()
+            except BufferError: # the mapping is released with the loaded arrays
+                pass
+            self.__buffer = b''
+
 
 class Header:
     PMD_SIGN = b'Pmd'
@@ -127,6 +193,64 @@ class Vertex:
         self.weight = fs.readByte()
         self.enable_edge = fs.readByte()
 
+class VertexArrays:
+    """ Columnar vertex data of a pmd model, stored in the record layout of the file.
+
+    Loaded records are a read-only view of the file data.
+    """
+    DTYPE = np.dtype([
+        ('position', '<f4', (3,)),
+        ('normal', '<f4', (3,)),
+        ('uv', '<f4', (2,)),
+        ('bones', '<u2', (2,)),
+        ('weight', '<u1'),
+        ('enable_edge', '<u1'),
+        ])
+
+    def __init__(self, count=0):
+        self.records = np.zeros(count, self.DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def copy(self):
+        data = VertexArrays.__new__(VertexArrays)
+        data.records = self.records.copy()
+        return data
+
+    def update(self, indices, vertices):
+        self.records[indices] = self.fromVertices(vertices).records
+
+    def item(self, index):
+        r = self.records[index]
+        v = Vertex()
+        v.position = tuple(r['position'].tolist())
+        v.normal = tuple(r['normal'].tolist())
+        v.uv = tuple(r['uv'].tolist())
+        v.bones = r['bones'].tolist()
+        v.weight = int(r['weight'])
+        v.enable_edge = int(r['enable_edge'])
+        return v
+
+    @classmethod
+    def fromVertices(cls, vertices):
+        data = cls(len(vertices))
+        if len(vertices):
+            records = data.records
+            records['position'] = [v.position for v in vertices]
+            records['normal'] = [v.normal for v in vertices]
+            records['uv'] = [v.uv for v in vertices]
+            records['bones'] = [v.bones for v in vertices]
+            records['weight'] = [v.weight for v in vertices]
+            records['enable_edge'] = [v.enable_edge for v in vertices]
+        return data
+
+    @classmethod
+    def load(cls, fs, count):
+        data = cls.__new__(cls)
+        data.records = fs.readArray(cls.DTYPE, count)
+        return data
+
 class Material:
     def __init__(self):
         self.diffuse = []
@@ -220,6 +344,53 @@ class MorphData:
         self.index = fs.readUnsignedInt()
         self.offset = fs.readVector(3)
 
+class MorphDataArrays:
+    """ Columnar data of a vertex morph. Loaded arrays are a read-only view of the file data.
+    """
+    DTYPE = np.dtype([('index', '<u4'), ('offset', '<f4', (3,))])
+
+    def __init__(self, count=0):
+        self.records = np.zeros(count, self.DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def index(self):
+        return self.records['index']
+
+    @property
+    def offset(self):
+        return self.records['offset']
+
+    def copy(self):
+        data = MorphDataArrays.__new__(MorphDataArrays)
+        data.records = self.records.copy()
+        return data
+
+    def update(self, indices, morph_data):
+        self.records[indices] = self.fromMorphData(morph_data).records
+
+    def item(self, index):
+        t = MorphData()
+        t.index = int(self.records['index'][index])
+        t.offset = tuple(self.records['offset'][index].tolist())
+        return t
+
+    @classmethod
+    def fromMorphData(cls, morph_data):
+        data = cls(len(morph_data))
+        if len(morph_data):
+            data.records['index'] = [x.index for x in morph_data]
+            data.records['offset'] = [x.offset for x in morph_data]
+        return data
+
+    @classmethod
+    def load(cls, fs, count):
+        data = cls.__new__(cls)
+        data.records = fs.readArray(cls.DTYPE, count)
+        return data
+
 class VertexMorph:
     def __init__(self):
         self.name = ''
@@ -231,10 +402,7 @@ class VertexMorph:
         self.name = fs.readStr(20)
         data_size = fs.readUnsignedInt()
         self.type = fs.readByte()
-        for i in range(data_size):
-            t = MorphData()
-            t.load(fs)
-            self.data.append(t)
+        self.data = from_arrays(MorphDataArrays.load(fs, data_size))
 
 class RigidBody:
     def __init__(self):
@@ -354,12 +522,8 @@ class Model:
         logging.info('------------------------------')
         logging.info('Load Vertices')
         logging.info('------------------------------')
-        self.vertices = []
         vert_count = fs.readUnsignedInt()
-        for i in range(vert_count):
-            v = Vertex()
-            v.load(fs)
-            self.vertices.append(v)
+        self.vertices = from_arrays(VertexArrays.load(fs, vert_count))
         logging.info('the number of vetices: %d', len(self.vertices))
         logging.info('finished importing vertices.')
 
@@ -367,13 +531,10 @@ class Model:
         logging.info('------------------------------')
         logging.info(' Load Faces')
         logging.info('------------------------------')
-        self.faces = []
         face_vert_count = fs.readUnsignedInt()
-        for i in range(int(face_vert_count/3)):
-            f1 = fs.readUnsignedShort()
-            f2 = fs.readUnsignedShort()
-            f3 = fs.readUnsignedShort()
-            self.faces.append((f3, f2, f1))
+        faces = FaceArrays.__new__(FaceArrays)
+        faces.indices = fs.readArray('<u2', int(face_vert_count/3)*3).reshape(-1, 3)[:, ::-1]
+        self.faces = from_arrays(faces)
         logging.info('the number of faces: %d', len(self.faces))
         logging.info('finished importing faces.')
 
@@ -593,8 +754,9 @@ class Model:
 
         logging.info('finished importing the model.')
 
-def load(path):
-    with FileReadStream(path) as fs:
+def load(path, use_mmap=False):
+    stream_class = MappedFileReadStream if use_mmap else FileReadStream
+    with stream_class(path) as fs:
         logging.info('****************************************')
         logging.info(' mmd_tools.pmd module')
         logging.info('----------------------------------------')
@@ -614,3 +776,84 @@ def load(path):
         logging.info(' mmd_tools.pmd module')
         logging.info('****************************************')
         return model
+
+def probe(path):
+    """ Read the metadata of a pmd file without loading vertices, faces, bones and morphs.
+
+    @return a dict of the model names/comments, the item count of each section
+        and the texture paths.
+    """
+    with MappedFileReadStream(path) as fs:
+        header = Header()
+        header.load(fs)
+        info = {
+            'filepath': path,
+            'format': 'pmd',
+            'version': header.version,
+            'name': header.model_name,
+            'name_e': '',
+            'comment': header.comment,
+            'comment_e': '',
+            'textures': [],
+            }
+
+        try:
+            info['num_vertices'] = num_vertices = fs.readUnsignedInt()
+            fs.skip(38 * num_vertices)
+            num_faces = fs.readUnsignedInt()
+            info['num_faces'] = int(num_faces/3)
+            fs.skip(2 * num_faces)
+
+            num_materials = fs.readUnsignedInt()
+            info['num_materials'] = num_materials
+            textures = info['textures']
+            for i in range(num_materials):
+                mat = Material()
+                mat.load(fs)
+                for t in (mat.texture_path, mat.sphere_path):
+                    if t and t not in textures:
+                        textures.append(t)
+
+            info['num_bones'] = num_bones = fs.readUnsignedShort()
+            fs.skip(39 * num_bones)
+            for i in range(fs.readUnsignedShort()):
+                fs.skip(4) # bone, target bone
+                ik_chain = fs.readByte()
+                fs.skip(6 + 2 * ik_chain) # iterations, weight, chain bones
+
+            info['num_morphs'] = num_morphs = fs.readUnsignedShort()
+            for i in range(num_morphs):
+                fs.skip(20)
+                fs.skip(1 + 16 * fs.readUnsignedInt())
+
+            fs.skip(2 * fs.readByte()) # facial display items
+            num_bone_disps = fs.readByte()
+            fs.skip(50 * num_bone_disps)
+            fs.skip(3 * fs.readUnsignedInt()) # bone display items
+            # the root and facial frames are added when converted to pmx
+            info['num_display'] = num_bone_disps + 2
+        except struct.error as e:
+            raise InvalidFileError('Corrupted file: %s'%e)
+
+        # the extended data sections are optional like Model.load()
+        info['num_rigids'] = info['num_joints'] = 0
+        try:
+            eng_flag = fs.readByte()
+        except struct.error:
+            return info
+        try:
+            if eng_flag:
+                info['name_e'] = fs.readStr(20)
+                info['comment_e'] = fs.readStr(256)
+                fs.skip(20 * num_bones + 20 * max(0, num_morphs-1) + 50 * num_bone_disps)
+            fs.skip(100 * 10) # toon textures
+            try:
+                num_rigids = fs.readUnsignedInt()
+            except struct.error:
+                return info # no physics data
+            info['num_rigids'] = num_rigids
+            fs.skip(83 * num_rigids)
+            info['num_joints'] = fs.readUnsignedInt()
+        except struct.error as e:
+            raise InvalidFileError('Corrupted file: %s'%e)
+        return info
@@ -7,6 +7,7 @@ import copy
 import logging
 
 import mathutils
+import numpy as np
 
 import mmd_tools.core.pmx.importer as import_pmx
 import mmd_tools.core.pmd as pmd
@@ -20,6 +21,38 @@ class PMDImporter:
         importer = import_pmx.PMXImporter()
         importer.execute(**args)
 
+def convert_vertex_arrays(vertices):
+    """ Convert pmd.VertexArrays to pmx.VertexArrays.
+
+    A vertex is BDEF2 with the weight (0-100) of the first bone, or BDEF1 if both bones are the same.
+    """
+    records = vertices.records
+    data = pmx.VertexArrays(len(records))
+    data.co[:] = records['position']
+    data.normal[:] = records['normal']
+    data.uv[:] = records['uv']
+    data.edge_scale[:] = records['enable_edge'] == 0
+
+    bones = records['bones']
+    bdef2 = bones[:, 0] != bones[:, 1]
+    weight = records['weight'] / 100.0
+    data.weight_type[:] = np.where(bdef2, pmx.BoneWeight.BDEF2, pmx.BoneWeight.BDEF1)
+    data.bones[:, 0] = bones[:, 0]
+    data.bones[bdef2, 1] = bones[bdef2, 1]
+    data.weights[:, 0] = np.where(bdef2, weight, 1.0)
+    data.weights[bdef2, 1] = 1.0 - weight[bdef2]
+    return data
+
+def convert_morph_data_arrays(morph_data, vertex_map):
+    """ Convert pmd.MorphDataArrays of a skin morph to pmx.MorphOffsetArrays.
+
+    @param vertex_map the vertex indices of the base morph, which the indices of morph_data refer to
+    """
+    data = pmx.MorphOffsetArrays(len(morph_data))
+    data.index[:] = vertex_map[morph_data.index]
+    data.offset[:] = morph_data.offset
+    return data
+
 def import_pmd_to_pmx(filepath):
     """ Import pmd file
     """
@@ -43,42 +76,19 @@ def import_pmd_to_pmx(filepath):
     pmx_model.comment = pmd_model.comment
     pmx_model.comment_e = pmd_model.comment_e
 
-    pmx_model.vertices = []
-
     # convert vertices
     logging.info('')
     logging.info('------------------------------')
     logging.info(' Convert Vertices')
     logging.info('------------------------------')
-    for v in pmd_model.vertices:
-        pmx_v = pmx.Vertex()
-        pmx_v.co = v.position
-        pmx_v.normal = v.normal
-        pmx_v.uv = v.uv
-        pmx_v.additional_uvs= []
-        pmx_v.edge_scale = 1 if v.enable_edge == 0 else 0
-
-        weight = pmx.BoneWeight()
-        if v.bones[0] != v.bones[1]:
-            weight.type = pmx.BoneWeight.BDEF2
-            weight.bones = v.bones
-            weight.weights = [float(v.weight)/100.0]
-        else:
-            weight.type = pmx.BoneWeight.BDEF1
-            weight.bones = [v.bones[0]]
-            weight.weights = [float(v.weight)/100.0]
-
-        pmx_v.weight = weight
-
-        pmx_model.vertices.append(pmx_v)
+    pmx_model.vertices = pmx.from_arrays(convert_vertex_arrays(pmx.columnar(pmd_model.vertices, pmd.VertexArrays.fromVertices)))
     logging.info('----- Converted %d vertices', len(pmx_model.vertices))
 
     logging.info('')
     logging.info('------------------------------')
     logging.info(' Convert Faces')
     logging.info('------------------------------')
-    for f in pmd_model.faces:
-        pmx_model.faces.append(f)
+    pmx_model.faces = pmx.from_arrays(pmx.columnar(pmd_model.faces, pmx.FaceArrays.fromFaces))
     logging.info('----- Converted %d faces', len(pmx_model.faces))
 
     knee_bones = []
@@ -252,9 +262,7 @@ def import_pmd_to_pmx(filepath):
     else:
         if len(t) > 1:
             logging.warning('Found two or more base morphs.')
-        vertex_map = []
-        for i in t[0].data:
-            vertex_map.append(i.index)
+        vertex_map = pmx.columnar(t[0].data, pmd.MorphDataArrays.fromMorphData).index
 
         for morph in pmd_model.morphs:
             logging.debug('Vertex Morph: %s', morph.name)
@@ -262,11 +270,7 @@ def import_pmd_to_pmx(filepath):
                 morph_index_map.append(-1)
                 continue
             pmx_morph = pmx.VertexMorph(morph.name, morph.name_e, morph.type)
-            for i in morph.data:
-                mo = pmx.VertexMorphOffset()
-                mo.index = vertex_map[i.index]
-                mo.offset = i.offset
-                pmx_morph.offsets.append(mo)
+            pmx_morph.offsets = pmx.from_arrays(convert_morph_data_arrays(pmx.columnar(morph.data, pmd.MorphDataArrays.fromMorphData), vertex_map))
             morph_index_map.append(len(pmx_model.morphs))
             pmx_model.morphs.append(pmx_morph)
     logging.info('----- Converted %d morphs', len(pmx_model.morphs))
@@ -316,7 +320,7 @@ def import_pmd_to_pmx(filepath):
             t = 0
         else:
             t = rigid.bone
-        pmx_rigid.location = mathutils.Vector(pmx_model.bones[t].location) + mathutils.Vector(rigid.location)
+        pmx_rigid.location = tuple(mathutils.Vector(pmx_model.bones[t].location) + mathutils.Vector(rigid.location))
         pmx_rigid.rotation = rigid.rotation
 
         pmx_rigid.mass = rigid.mass
@@ -1,18 +1,81 @@
 # -*- coding: utf-8 -*-
 import struct
 import os
+import mmap
 import logging
+import collections.abc
+
+import numpy as np
 
 class InvalidFileError(Exception):
     pass
 class UnsupportedVersionError(Exception):
     pass
 
+_INDEX_FORMATS = {
+    False: {1:'B', 2:'H', 4:'I'},
+    True: {1:'b', 2:'h', 4:'i'},
+    }
+
+def _index_format(size, signed):
+    formats = _INDEX_FORMATS[signed]
+    if size not in formats:
+        raise ValueError('invalid data size %s'%str(size))
+    return formats[size]
+
+_INT = struct.Struct('<i')
+_SHORT = struct.Struct('<h')
+_USHORT = struct.Struct('<H')
+_FLOAT = struct.Struct('<f')
+_BYTE = struct.Struct('<B')
+_SBYTE = struct.Struct('<b')
+_VECTORS = {}
+
+def _vector_codec(size):
+    codec = _VECTORS.get(size, None)
+    if codec is None:
+        codec = _VECTORS[size] = struct.Struct('<%df'%size)
+    return codec
+
+class Codecs:
+    """ Precompiled struct codecs for the index sizes of a pmx header.
+
+    - *_index: an index of each kind
+    - ik_link: target bone index, limits flag
+    - material_morph_offset: material index, offset type, 28 offset values
+    - rigid: bone index, collision group number, collision group mask, shape type,
+        size(3), location(3), rotation(3), mass, velocity attenuation,
+        rotation attenuation, bounce, friction, mode
+    - joint: mode, source rigid index, destination rigid index, location(3),
+        rotation(3), minimum location(3), maximum location(3),
+        minimum rotation(3), maximum rotation(3), spring constant(3),
+        spring rotation constant(3)
+    """
+    def __init__(self, pmx_header):
+        vertex = _index_format(pmx_header.vertex_index_size, False)
+        texture = _index_format(pmx_header.texture_index_size, True)
+        material = _index_format(pmx_header.material_index_size, True)
+        bone = _index_format(pmx_header.bone_index_size, True)
+        morph = _index_format(pmx_header.morph_index_size, True)
+        rigid = _index_format(pmx_header.rigid_index_size, True)
+
+        self.vertex_index = struct.Struct('<'+vertex)
+        self.texture_index = struct.Struct('<'+texture)
+        self.material_index = struct.Struct('<'+material)
+        self.bone_index = struct.Struct('<'+bone)
+        self.morph_index = struct.Struct('<'+morph)
+        self.rigid_index = struct.Struct('<'+rigid)
+
+        self.ik_link = struct.Struct('<%sB'%bone)
+        self.material_morph_offset = struct.Struct('<%sb28f'%material)
+        self.rigid = struct.Struct('<%sbHb14fb'%bone)
+        self.joint = struct.Struct('<b%s%s24f'%(rigid, rigid))
+
 class FileStream:
     def __init__(self, path, file_obj, pmx_header):
         self.__path = path
         self.__file_obj = file_obj
-        self.__header = pmx_header
+        self.setHeader(pmx_header)
 
     def __enter__(self):
         return self
@@ -28,8 +91,14 @@ class FileStream:
             raise Exception
         return self.__header
 
+    def codecs(self):
+        if self.__codecs is None:
+            raise Exception
+        return self.__codecs
+
     def setHeader(self, pmx_header):
         self.__header = pmx_header
+        self.__codecs = None if pmx_header is None else Codecs(pmx_header)
 
     def close(self):
         if self.__file_obj is not None:
@@ -42,122 +111,222 @@ class FileReadStream(FileStream):
         self.__fin = open(path, 'rb')
         FileStream.__init__(self, path, self.__fin, pmx_header)
 
-    def __readIndex(self, size, typedict):
-        index = None
-        if size in typedict :
-            index, = struct.unpack(typedict[size], self.__fin.read(size))
-        else:
-            raise ValueError('invalid data size %s'%str(size))
-        return index
-
-    def __readSignedIndex(self, size):
-        return self.__readIndex(size, { 1 :"<b", 2 :"<h", 4 :"<i"})
-
-    def __readUnsignedIndex(self, size):
-        return self.__readIndex(size, { 1 :"<B", 2 :"<H", 4 :"<I"})
-
+    def setHeader(self, pmx_header):
+        """ Set the header and bind the index readers specialized for its index sizes.
+        """
+        FileStream.setHeader(self, pmx_header)
+        if pmx_header is not None:
+            codecs = self.codecs()
+            self.readVertexIndex = self.__indexReader(codecs.vertex_index)
+            self.readBoneIndex = self.__indexReader(codecs.bone_index)
+            self.readTextureIndex = self.__indexReader(codecs.texture_index)
+            self.readMorphIndex = self.__indexReader(codecs.morph_index)
+            self.readRigidIndex = self.__indexReader(codecs.rigid_index)
+            self.readMaterialIndex = self.__indexReader(codecs.material_index)
+
+    def __indexReader(self, codec):
+        read = self._read
+        def readIndex():
+            return read(codec)[0]
+        return readIndex
+
+    def _read(self, codec):
+        return codec.unpack(self.__fin.read(codec.size))
+
+    def readStruct(self, codec):
+        """ Read the values of a struct.Struct record, such as the record codecs of codecs().
+        """
+        return self._read(codec)
 
     # READ methods for indexes
     def readVertexIndex(self):
-        return self.__readUnsignedIndex(self.header().vertex_index_size)
+        return self._read(self.codecs().vertex_index)[0]
 
     def readBoneIndex(self):
-        return self.__readSignedIndex(self.header().bone_index_size)
+        return self._read(self.codecs().bone_index)[0]
 
     def readTextureIndex(self):
-        return self.__readSignedIndex(self.header().texture_index_size)
+        return self._read(self.codecs().texture_index)[0]
 
     def readMorphIndex(self):
-        return self.__readSignedIndex(self.header().morph_index_size)
+        return self._read(self.codecs().morph_index)[0]
 
     def readRigidIndex(self):
-        return self.__readSignedIndex(self.header().rigid_index_size)
+        return self._read(self.codecs().rigid_index)[0]
 
     def readMaterialIndex(self):
-        return self.__readSignedIndex(self.header().material_index_size)
+        return self._read(self.codecs().material_index)[0]
 
     # READ / WRITE methods for general types
     def readInt(self):
-        v, = struct.unpack('<i', self.__fin.read(4))
-        return v
+        return self._read(_INT)[0]
 
     def readShort(self):
-        v, = struct.unpack('<h', self.__fin.read(2))
-        return v
+        return self._read(_SHORT)[0]
 
     def readUnsignedShort(self):
-        v, = struct.unpack('<H', self.__fin.read(2))
-        return v
+        return self._read(_USHORT)[0]
 
     def readStr(self):
         length = self.readInt()
-        buf, = struct.unpack('<%ds'%length, self.__fin.read(length))
+        buf = self.readBytes(length)
+        if len(buf) != length:
+            raise struct.error('unpack requires a buffer of %d bytes'%length)
         return str(buf, self.header().encoding.charset, errors='replace')
 
     def readFloat(self):
-        v, = struct.unpack('<f', self.__fin.read(4))
-        return v
+        return self._read(_FLOAT)[0]
 
     def readVector(self, size):
-        return struct.unpack('<'+'f'*size, self.__fin.read(4*size))
+        return self._read(_vector_codec(size))
 
     def readByte(self):
-        v, = struct.unpack('<B', self.__fin.read(1))
-        return v
+        return self._read(_BYTE)[0]
 
     def readBytes(self, length):
         return self.__fin.read(length)
 
+    def peekBytes(self, length):
+        """ Read up to length bytes without moving the file position.
+        """
+        pos = self.__fin.tell()
+        data = self.__fin.read(length)
+        self.__fin.seek(pos)
+        return data
+
     def readSignedByte(self):
-        v, = struct.unpack('<b', self.__fin.read(1))
+        return self._read(_SBYTE)[0]
+
+    def readArray(self, dtype, count):
+        """ Read count items of dtype into a numpy array.
+        """
+        dtype = np.dtype(dtype)
+        buf = self.readBytes(dtype.itemsize * count)
+        if len(buf) < dtype.itemsize * count:
+            raise struct.error('unpack requires a buffer of %d bytes'%(dtype.itemsize * count))
+        return np.frombuffer(buf, dtype, count)
+
+    def skip(self, length):
+        self.__fin.seek(length, os.SEEK_CUR)
+
+    def tell(self):
+        return self.__fin.tell()
+
+    def seek(self, offset):
+        self.__fin.seek(offset)
+
+class MappedFileReadStream(FileReadStream):
+    """ A read stream over a memory-mapped file.
+
+    Values are unpacked at the current offset of the mapped buffer, and peekBytes()
+    and readArray() return views of the mapped file without copying.
+    The mapping is kept alive by those views after the stream is closed.
+    """
+    def __init__(self, path, pmx_header=None):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.__buffer = b''
+        self.__pos = 0
+        FileStream.__init__(self, path, None, pmx_header)
+
+    def _read(self, codec):
+        v = codec.unpack_from(self.__buffer, self.__pos)
+        self.__pos += codec.size
         return v
 
+    def readBytes(self, length):
+        data = self.__buffer[self.__pos:self.__pos+length]
+        self.__pos += len(data)
+        return data
+
+    def peekBytes(self, length):
+        return memoryview(self.__buffer)[self.__pos:self.__pos+length]
+
+    def readArray(self, dtype, count):
+        dtype = np.dtype(dtype)
+        if self.__pos + dtype.itemsize * count > len(self.__buffer):
+            raise struct.error('unpack requires a buffer of %d bytes'%(dtype.itemsize * count))
+        data = np.frombuffer(self.__buffer, dtype, count, self.__pos)
+        self.__pos += dtype.itemsize * count
+        return data
+
+    def skip(self, length):
+        self.__pos += length
+
+    def tell(self):
+        return self.__pos
+
+    def seek(self, offset):
+        self.__pos = offset
+
+    def close(self):
+        if isinstance(self.__buffer, mmap.mmap):
+            logging.debug('close the file("%s")', self.path())
+            try:
+                self.__buffer.close()
+            except BufferError: # the mapping is released with the loaded arrays
+                pass
+            self.__buffer = b''
+
 class FileWriteStream(FileStream):
     def __init__(self, path, pmx_header=None):
         self.__fout = open(path, 'wb')
         FileStream.__init__(self, path, self.__fout, pmx_header)
 
-    def __writeIndex(self, index, size, typedict):
-        if size in typedict :
-            self.__fout.write(struct.pack(typedict[size], int(index)))
-        else:
-            raise ValueError('invalid data size %s'%str(size))
-        return
-
-    def __writeSignedIndex(self, index, size):
-        return self.__writeIndex(index, size, { 1 :"<b", 2 :"<h", 4 :"<i"})
-
-    def __writeUnsignedIndex(self, index, size):
-        return self.__writeIndex(index, size, { 1 :"<B", 2 :"<H", 4 :"<I"})
+    def setHeader(self, pmx_header):
+        """ Set the header and bind the index writers specialized for its index sizes.
+        """
+        FileStream.setHeader(self, pmx_header)
+        if pmx_header is not None:
+            codecs = self.codecs()
+            self.writeVertexIndex = self.__indexWriter(codecs.vertex_index)
+            self.writeBoneIndex = self.__indexWriter(codecs.bone_index)
+            self.writeTextureIndex = self.__indexWriter(codecs.texture_index)
+            self.writeMorphIndex = self.__indexWriter(codecs.morph_index)
+            self.writeRigidIndex = self.__indexWriter(codecs.rigid_index)
+            self.writeMaterialIndex = self.__indexWriter(codecs.material_index)
+
+    def __indexWriter(self, codec):
+        write, pack = self.__fout.write, codec.pack
+        def writeIndex(index):
+            write(pack(int(index)))
+        return writeIndex
+
+    def writeStruct(self, codec, *values):
+        """ Write the values of a struct.Struct record, such as the record codecs of codecs().
+        """
+        self.__fout.write(codec.pack(*values))
 
     # WRITE methods for indexes
     def writeVertexIndex(self, index):
-        return self.__writeUnsignedIndex(index, self.header().vertex_index_size)
+        self.__fout.write(self.codecs().vertex_index.pack(int(index)))
 
     def writeBoneIndex(self, index):
-        return self.__writeSignedIndex(index, self.header().bone_index_size)
+        self.__fout.write(self.codecs().bone_index.pack(int(index)))
 
     def writeTextureIndex(self, index):
-        return self.__writeSignedIndex(index, self.header().texture_index_size)
+        self.__fout.write(self.codecs().texture_index.pack(int(index)))
 
     def writeMorphIndex(self, index):
-        return self.__writeSignedIndex(index, self.header().morph_index_size)
+        self.__fout.write(self.codecs().morph_index.pack(int(index)))
 
     def writeRigidIndex(self, index):
-        return self.__writeSignedIndex(index, self.header().rigid_index_size)
+        self.__fout.write(self.codecs().rigid_index.pack(int(index)))
 
     def writeMaterialIndex(self, index):
-        return self.__writeSignedIndex(index, self.header().material_index_size)
+        self.__fout.write(self.codecs().material_index.pack(int(index)))
 
 
     def writeInt(self, v):
-        self.__fout.write(struct.pack('<i', int(v)))
+        self.__fout.write(_INT.pack(int(v)))
 
     def writeShort(self, v):
-        self.__fout.write(struct.pack('<h', int(v)))
+        self.__fout.write(_SHORT.pack(int(v)))
 
     def writeUnsignedShort(self, v):
-        self.__fout.write(struct.pack('<H', int(v)))
+        self.__fout.write(_USHORT.pack(int(v)))
 
     def writeStr(self, v):
         data = v.encode(self.header().encoding.charset)
@@ -165,19 +334,24 @@ class FileWriteStream(FileStream):
         self.__fout.write(data)
 
     def writeFloat(self, v):
-        self.__fout.write(struct.pack('<f', float(v)))
+        self.__fout.write(_FLOAT.pack(float(v)))
 
     def writeVector(self, v):
-        self.__fout.write(struct.pack('<'+'f'*len(v), *v))
+        self.__fout.write(_vector_codec(len(v)).pack(*v))
 
     def writeByte(self, v):
-        self.__fout.write(struct.pack('<B', int(v)))
+        self.__fout.write(_BYTE.pack(int(v)))
 
     def writeBytes(self, v):
         self.__fout.write(v)
 
     def writeSignedByte(self, v):
-        self.__fout.write(struct.pack('<b', int(v)))
+        self.__fout.write(_SBYTE.pack(int(v)))
+
+    def writeArray(self, array):
+        """ Write the raw bytes of a numpy array.
+        """
+        self.__fout.write(np.ascontiguousarray(array).data)
 
 class Encoding:
     _MAP = [
@@ -232,13 +406,20 @@ class Header:
         if model is not None:
             self.updateIndexSizes(model)
 
+    INDEXED_SECTIONS = ('vertices', 'textures', 'materials', 'bones', 'morphs', 'rigids')
+
     def updateIndexSizes(self, model):
-        self.vertex_index_size = self.__getIndexSize(len(model.vertices), False)
-        self.texture_index_size = self.__getIndexSize(len(model.textures), True)
-        self.material_index_size = self.__getIndexSize(len(model.materials), True)
-        self.bone_index_size = self.__getIndexSize(len(model.bones), True)
-        self.morph_index_size = self.__getIndexSize(len(model.morphs), True)
-        self.rigid_index_size = self.__getIndexSize(len(model.rigids), True)
+        self.updateIndexSizesByCounts({name:len(getattr(model, name)) for name in self.INDEXED_SECTIONS})
+
+    def updateIndexSizesByCounts(self, counts):
+        """ Update the index sizes by the item count (or an upper bound of it) of each section of INDEXED_SECTIONS.
+        """
+        self.vertex_index_size = self.__getIndexSize(counts['vertices'], False)
+        self.texture_index_size = self.__getIndexSize(counts['textures'], True)
+        self.material_index_size = self.__getIndexSize(counts['materials'], True)
+        self.bone_index_size = self.__getIndexSize(counts['bones'], True)
+        self.morph_index_size = self.__getIndexSize(counts['morphs'], True)
+        self.rigid_index_size = self.__getIndexSize(counts['rigids'], True)
 
     @staticmethod
     def __getIndexSize(num, signed):
@@ -347,7 +528,17 @@ class Model:
         self.rigids = []
         self.joints = []
 
-    def load(self, fs):
+    SECTIONS = ('vertices', 'faces', 'textures', 'materials', 'bones', 'morphs', 'display', 'rigids', 'joints')
+
+    def load(self, fs, sections=None, count_all=False):
+        """ Load model data from a pmx file stream.
+
+        @param sections the names of sections (see Model.SECTIONS) to load, or None to load all sections.
+            The other sections are skipped without creating any objects and are left empty.
+            Reading stops after the last requested section.
+        @param count_all skip the sections after the last requested section too, so section_counts
+            has the item counts of all sections.
+        """
         self.filepath = fs.path()
         self.header = fs.header()
 
@@ -362,36 +553,64 @@ class Model:
         logging.info('Comment:%s', self.comment)
         logging.info('Comment(english):%s', self.comment_e)
 
+        loaders = {
+            'vertices': (self.__loadVertices, self.__skipVertices),
+            'faces': (self.__loadFaces, self.__skipFaces),
+            'textures': (self.__loadTextures, self.__skipTextures),
+            'materials': (self.__loadMaterials, self.__skipMaterials),
+            'bones': (self.__loadBones, self.__skipBones),
+            'morphs': (self.__loadMorphs, self.__skipMorphs),
+            'display': (self.__loadDisplay, self.__skipDisplay),
+            'rigids': (self.__loadRigids, self.__skipRigids),
+            'joints': (self.__loadJoints, self.__skipJoints),
+            }
+        if sections is None:
+            sections = self.SECTIONS
+        for name in self.SECTIONS:
+            if name not in sections:
+                setattr(self, name, [])
+        self.section_offsets = {}
+        self.section_counts = {}
+        self.__num_textures = 0
+        last_index = max([self.SECTIONS.index(x) for x in sections], default=-1)
+        if count_all:
+            last_index = len(self.SECTIONS) - 1
+        for name in self.SECTIONS[:last_index+1]:
+            self.section_offsets[name] = fs.tell()
+            load, skip = loaders[name]
+            if name in sections:
+                load(fs)
+                self.section_counts[name] = len(getattr(self, name))
+            else:
+                logging.info('')
+                logging.info(' Skip %s', name)
+                self.section_counts[name] = skip(fs)
+
+    def __loadVertices(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info('Load Vertices')
         logging.info('------------------------------')
         num_vertices = fs.readInt()
-        self.vertices = []
-        for i in range(num_vertices):
-            v = Vertex()
-            v.load(fs)
-            self.vertices.append(v)
+        self.vertices = _LazyList(VertexArrays.load(fs, num_vertices))
         logging.info('----- Loaded %d vertices', len(self.vertices))
 
+    def __loadFaces(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Faces')
         logging.info('------------------------------')
         num_faces = fs.readInt()
-        self.faces = []
-        for i in range(int(num_faces/3)):
-            f1 = fs.readVertexIndex()
-            f2 = fs.readVertexIndex()
-            f3 = fs.readVertexIndex()
-            self.faces.append((f3, f2, f1))
+        self.faces = _LazyList(FaceArrays.load(fs, int(num_faces/3)))
         logging.info(' Load %d faces', len(self.faces))
 
+    def __loadTextures(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Textures')
         logging.info('------------------------------')
         num_textures = fs.readInt()
+        self.__num_textures = num_textures
         self.textures = []
         for i in range(num_textures):
             t = Texture()
@@ -400,6 +619,7 @@ class Model:
             logging.info('Texture %d: %s', i, t.path)
         logging.info(' ----- Loaded %d textures', len(self.textures))
 
+    def __loadMaterials(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Materials')
@@ -408,7 +628,7 @@ class Model:
         self.materials = []
         for i in range(num_materials):
             m = Material()
-            m.load(fs, num_textures)
+            m.load(fs, self.__num_textures)
             self.materials.append(m)
 
             logging.info('Material %d: %s', i, m.name)
@@ -439,6 +659,7 @@ class Model:
 
         logging.info('----- Loaded %d  materials.', len(self.materials))
 
+    def __loadBones(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Bones')
@@ -473,6 +694,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d bones.', len(self.bones))
 
+    def __loadMorphs(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Morphs')
@@ -490,6 +712,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d morphs.', len(self.morphs))
 
+    def __loadDisplay(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Display Items')
@@ -506,6 +729,7 @@ class Model:
             logging.debug('')
         logging.info('----- Loaded %d display items.', len(self.display))
 
+    def __loadRigids(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Rigid Bodies')
@@ -535,6 +759,7 @@ class Model:
 
         logging.info('----- Loaded %d rigid bodies.', len(self.rigids))
 
+    def __loadJoints(self, fs):
         logging.info('')
         logging.info('------------------------------')
         logging.info(' Load Joints')
@@ -560,78 +785,49 @@ class Model:
 
         logging.info('----- Loaded %d joints.', len(self.joints))
 
-    def save(self, fs):
-        fs.writeStr(self.name)
-        fs.writeStr(self.name_e)
+    # skip methods return the number of skipped items
+    def __skipVertices(self, fs):
+        num_vertices = fs.readInt()
+        VertexArrays.skip(fs, num_vertices)
+        return num_vertices
 
-        fs.writeStr(self.comment)
-        fs.writeStr(self.comment_e)
+    def __skipFaces(self, fs):
+        num_faces = fs.readInt()
+        fs.skip(fs.header().vertex_index_size * num_faces)
+        return int(num_faces/3)
 
-        logging.info('''exportings pmx model data...
-name: %s
-name(english): %s
-comment:
-%s
-comment(english):
-%s
-''', self.name, self.name_e, self.comment, self.comment_e)
+    def __skipTextures(self, fs):
+        self.__num_textures = fs.readInt()
+        for i in range(self.__num_textures):
+            Texture.skip(fs)
+        return self.__num_textures
 
-        logging.info('exporting vertices... %d', len(self.vertices))
-        fs.writeInt(len(self.vertices))
-        for i in self.vertices:
-            i.save(fs)
-        logging.info('finished exporting vertices.')
-
-        logging.info('exporting faces... %d', len(self.faces))
-        fs.writeInt(len(self.faces)*3)
-        for f3, f2, f1 in self.faces:
-            fs.writeVertexIndex(f1)
-            fs.writeVertexIndex(f2)
-            fs.writeVertexIndex(f3)
-        logging.info('finished exporting faces.')
-
-        logging.info('exporting textures... %d', len(self.textures))
-        fs.writeInt(len(self.textures))
-        for i in self.textures:
-            i.save(fs)
-        logging.info('finished exporting textures.')
+    def __skipItems(self, fs, skip_func):
+        num = fs.readInt()
+        for i in range(num):
+            skip_func(fs)
+        return num
 
-        logging.info('exporting materials... %d', len(self.materials))
-        fs.writeInt(len(self.materials))
-        for i in self.materials:
-            i.save(fs)
-        logging.info('finished exporting materials.')
+    def __skipMaterials(self, fs):
+        return self.__skipItems(fs, Material.skip)
 
-        logging.info('exporting bones... %d', len(self.bones))
-        fs.writeInt(len(self.bones))
-        for i in self.bones:
-            i.save(fs)
-        logging.info('finished exporting bones.')
+    def __skipBones(self, fs):
+        return self.__skipItems(fs, Bone.skip)
 
-        logging.info('exporting morphs... %d', len(self.morphs))
-        fs.writeInt(len(self.morphs))
-        for i in self.morphs:
-            i.save(fs)
-        logging.info('finished exporting morphs.')
+    def __skipMorphs(self, fs):
+        return self.__skipItems(fs, Morph.skip)
 
-        logging.info('exporting display items... %d', len(self.display))
-        fs.writeInt(len(self.display))
-        for i in self.display:
-            i.save(fs)
-        logging.info('finished exporting display items.')
+    def __skipDisplay(self, fs):
+        return self.__skipItems(fs, Display.skip)
 
-        logging.info('exporting rigid bodies... %d', len(self.rigids))
-        fs.writeInt(len(self.rigids))
-        for i in self.rigids:
-            i.save(fs)
-        logging.info('finished exporting rigid bodies.')
+    def __skipRigids(self, fs):
+        return self.__skipItems(fs, Rigid.skip)
 
-        logging.info('exporting joints... %d', len(self.joints))
-        fs.writeInt(len(self.joints))
-        for i in self.joints:
-            i.save(fs)
-        logging.info('finished exporting joints.')
-        logging.info('finished exporting the model.')
+    def __skipJoints(self, fs):
+        return self.__skipItems(fs, Joint.skip)
+
+    def save(self, fs):
+        ModelWriter(fs).writeModel(self)
 
 
     def __repr__(self):
@@ -643,6 +839,139 @@ comment(english):
             str(self.textures),
             )
 
+class ModelWriter:
+    """ Write a pmx model section by section, so the data of each section can be released as soon as it is written.
+
+    The sections are written in the order of Model.SECTIONS, and the items of a section can be written in
+    several parts between beginSection() and endSection(). Since the index sizes are fixed by the header,
+    the item counts of the sections of Header.INDEXED_SECTIONS have to be known before writing any section.
+    """
+    LABELS = {
+        'vertices': 'vertices',
+        'faces': 'faces',
+        'textures': 'textures',
+        'materials': 'materials',
+        'bones': 'bones',
+        'morphs': 'morphs',
+        'display': 'display items',
+        'rigids': 'rigid bodies',
+        'joints': 'joints',
+        }
+
+    def __init__(self, fs):
+        self.__fs = fs
+        self.__info_written = False
+        self.__next_section = 0 # the index of the next section of Model.SECTIONS
+        self.__section = None # [name, count, written count]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(remove=(exc_type is not None))
+
+    def close(self, remove=False):
+        """ Close the file stream. The file is removed if remove is True, e.g. on errors.
+
+        Closing the file before all sections are written also removes the file and raises an exception.
+        """
+        if self.__fs is None:
+            return
+        fs, self.__fs = self.__fs, None
+        fs.close()
+        incomplete = self.__next_section < len(Model.SECTIONS)
+        if (remove or incomplete) and os.path.exists(fs.path()):
+            os.remove(fs.path())
+        if incomplete and not remove:
+            raise ValueError('incomplete pmx file, the sections from "%s" are not written'%Model.SECTIONS[self.__next_section])
+
+    def writeInfo(self, name, name_e, comment, comment_e):
+        if self.__info_written or self.__next_section > 0:
+            raise ValueError('the model info is already written')
+        fs = self.__fs
+        fs.writeStr(name)
+        fs.writeStr(name_e)
+
+        fs.writeStr(comment)
+        fs.writeStr(comment_e)
+        self.__info_written = True
+
+        logging.info('''exportings pmx model data...
+name: %s
+name(english): %s
+comment:
+%s
+comment(english):
+%s
+''', name, name_e, comment, comment_e)
+
+    def beginSection(self, name, count):
+        if not self.__info_written:
+            raise ValueError('the model info is not written')
+        if self.__section is not None:
+            raise ValueError('the section "%s" is not finished'%self.__section[0])
+        if self.__next_section >= len(Model.SECTIONS) or Model.SECTIONS[self.__next_section] != name:
+            raise ValueError('invalid section order: %s'%name)
+        self.__checkIndexSize(name, count)
+
+        logging.info('exporting %s... %d', self.LABELS[name], count)
+        self.__fs.writeInt(count*3 if name == 'faces' else count)
+        self.__section = [name, count, 0]
+
+    def write(self, items):
+        """ Write a part of the items of the current section.
+        """
+        if self.__section is None:
+            raise ValueError('no section is begun')
+        name, count, written = self.__section
+        if written + len(items) > count:
+            raise ValueError('too many items of the section "%s": %d > %d'%(name, written + len(items), count))
+        fs = self.__fs
+        if name == 'vertices':
+            columnar(items, VertexArrays.fromVertices, fs.header().additional_uvs).save(fs)
+        elif name == 'faces':
+            columnar(items, FaceArrays.fromFaces).save(fs)
+        else:
+            for i in items:
+                i.save(fs)
+        self.__section[2] += len(items)
+
+    def endSection(self):
+        if self.__section is None:
+            raise ValueError('no section is begun')
+        name, count, written = self.__section
+        if written != count:
+            raise ValueError('missing items of the section "%s": %d < %d'%(name, written, count))
+        logging.info('finished exporting %s.', self.LABELS[name])
+        self.__section = None
+        self.__next_section += 1
+
+    def writeSection(self, name, items):
+        self.beginSection(name, len(items))
+        self.write(items)
+        self.endSection()
+
+    def writeModel(self, model):
+        self.writeInfo(model.name, model.name_e, model.comment, model.comment_e)
+        for name in Model.SECTIONS:
+            self.writeSection(name, getattr(model, name))
+        logging.info('finished exporting the model.')
+
+    def __checkIndexSize(self, name, count):
+        header = self.__fs.header()
+        sizes = {
+            'vertices': (header.vertex_index_size, False),
+            'textures': (header.texture_index_size, True),
+            'materials': (header.material_index_size, True),
+            'bones': (header.bone_index_size, True),
+            'morphs': (header.morph_index_size, True),
+            'rigids': (header.rigid_index_size, True),
+            }
+        if name in sizes:
+            size, signed = sizes[name]
+            if size < 4 and count > (1<<(size*8))/(2 if signed else 1):
+                raise ValueError('too many items of the section "%s" for the index size %d: %d'%(name, size, count))
+
 class Vertex:
     def __init__(self):
         self.co = [0.0, 0.0, 0.0]
@@ -777,6 +1106,554 @@ class BoneWeight:
             raise ValueError('invalid weight type %s'%str(self.type))
 
 
+def _gather_records(buf, offsets, size):
+    """ Copy the records of the given byte size starting at offsets into a (len(offsets), size) uint8 array.
+    """
+    windows = np.lib.stride_tricks.as_strided(buf, shape=(len(buf)-size+1, size), strides=(1, 1), writeable=False)
+    return windows[offsets]
+
+class _LazyList(collections.abc.MutableSequence):
+    """ A list of pmx objects which are created from columnar data on first access.
+
+    The columnar data has to provide __len__(), item(index), copy() and update(indices, items).
+    Resizing the list creates all remaining items and drops the columnar data.
+    """
+    def __init__(self, data):
+        self.__data = data
+        self.__items = [None] * len(data)
+
+    def __repr__(self):
+        return '<%s %d items>'%(self.__class__.__name__, len(self.__items))
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, _LazyList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __getstate__(self):
+        # pickle the columnar data instead of the created items
+        data = self.data()
+        return (data, None) if data is not None else (None, self.__items)
+
+    def __setstate__(self, state):
+        data, items = state
+        if data is not None:
+            self.__init__(data)
+        else:
+            self.__data, self.__items = None, items
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.__items)))]
+        item = self.__items[index]
+        if item is None:
+            index %= len(self.__items)
+            item = self.__items[index] = self.__data.item(index)
+        return item
+
+    def __iter__(self):
+        for i in range(len(self.__items)):
+            yield self[i]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.__materialize()
+        self.__items[index] = value
+
+    def __delitem__(self, index):
+        self.__materialize()
+        del self.__items[index]
+
+    def insert(self, index, value):
+        self.__materialize()
+        self.__items.insert(index, value)
+
+    def __materialize(self):
+        if self.__data is not None:
+            self.__items = list(self)
+            self.__data = None
+
+    def data(self):
+        """ Get the columnar data including the changes of created items.
+
+        Returns None if the list was resized.
+        """
+        data = self.__data
+        if data is None:
+            return None
+        indices = [i for i, x in enumerate(self.__items) if x is not None]
+        if indices:
+            data = data.copy()
+            data.update(indices, [self.__items[i] for i in indices])
+        return data
+
+class VertexArrays:
+    """ Columnar vertex data of a pmx model.
+
+    Unused bone slots are -1 and the weights of BDEF1/BDEF2/SDEF vertices are
+    expanded to the effective weight of each bone slot.
+    """
+    _FIELDS = ('co', 'normal', 'uv', 'additional_uvs', 'weight_type', 'bones', 'weights',
+               'sdef_c', 'sdef_r0', 'sdef_r1', 'edge_scale')
+
+    def __init__(self, count=0, additional_uvs=0):
+        self.co = np.zeros((count, 3), np.float32)
+        self.normal = np.zeros((count, 3), np.float32)
+        self.uv = np.zeros((count, 2), np.float32)
+        self.additional_uvs = np.zeros((count, additional_uvs, 4), np.float32)
+        self.weight_type = np.zeros(count, np.uint8)
+        self.bones = np.full((count, 4), -1, np.int32)
+        self.weights = np.zeros((count, 4), np.float32)
+        self.sdef_c = np.zeros((count, 3), np.float32)
+        self.sdef_r0 = np.zeros((count, 3), np.float32)
+        self.sdef_r1 = np.zeros((count, 3), np.float32)
+        self.edge_scale = np.ones(count, np.float32)
+
+    def __len__(self):
+        return len(self.co)
+
+    def __repr__(self):
+        return '<VertexArrays count %d, additional_uvs %d>'%(len(self), self.additional_uvs.shape[1])
+
+    def take(self, indices):
+        data = VertexArrays.__new__(VertexArrays)
+        for name in self._FIELDS:
+            setattr(data, name, getattr(self, name)[indices])
+        return data
+
+    def copy(self):
+        data = VertexArrays.__new__(VertexArrays)
+        for name in self._FIELDS:
+            setattr(data, name, getattr(self, name).copy())
+        return data
+
+    @classmethod
+    def concatenate(cls, arrays, additional_uvs=None):
+        """ Concatenate a list of VertexArrays.
+
+        The additional uvs are padded with zeros, or truncated to additional_uvs if it is given.
+        """
+        if additional_uvs is None:
+            additional_uvs = max([a.additional_uvs.shape[1] for a in arrays] or [0])
+        data = cls(sum(len(a) for a in arrays), additional_uvs)
+        start = 0
+        for a in arrays:
+            end = start + len(a)
+            for name in cls._FIELDS:
+                if name == 'additional_uvs':
+                    n = min(additional_uvs, a.additional_uvs.shape[1])
+                    data.additional_uvs[start:end, :n] = a.additional_uvs[:, :n]
+                else:
+                    getattr(data, name)[start:end] = getattr(a, name)
+            start = end
+        return data
+
+    def update(self, indices, vertices):
+        part = self.fromVertices(vertices, self.additional_uvs.shape[1])
+        for name in self._FIELDS:
+            getattr(self, name)[indices] = getattr(part, name)
+
+    def item(self, index):
+        v = Vertex()
+        v.co = tuple(self.co[index].tolist())
+        v.normal = tuple(self.normal[index].tolist())
+        v.uv = tuple(self.uv[index].tolist())
+        v.additional_uvs = [tuple(i) for i in self.additional_uvs[index].tolist()]
+        v.edge_scale = float(self.edge_scale[index])
+
+        weight = v.weight = BoneWeight()
+        weight.type = int(self.weight_type[index])
+        bones, weights = self.bones[index].tolist(), self.weights[index].tolist()
+        if weight.type == BoneWeight.BDEF1:
+            weight.bones = bones[:1]
+        elif weight.type == BoneWeight.BDEF2:
+            weight.bones = bones[:2]
+            weight.weights = weights[:1]
+        elif weight.type == BoneWeight.BDEF4:
+            weight.bones = bones
+            weight.weights = tuple(weights)
+        elif weight.type == BoneWeight.SDEF:
+            weight.bones = bones[:2]
+            weight.weights = BoneWeightSDEF(weights[0],
+                tuple(self.sdef_c[index].tolist()),
+                tuple(self.sdef_r0[index].tolist()),
+                tuple(self.sdef_r1[index].tolist()),
+                )
+        return v
+
+    @classmethod
+    def fromVertices(cls, vertices, additional_uvs=0):
+        data = cls(len(vertices), additional_uvs)
+        if len(vertices) < 1:
+            return data
+        data.co[:] = [v.co for v in vertices]
+        data.normal[:] = [v.normal for v in vertices]
+        data.uv[:] = [v.uv for v in vertices]
+        data.edge_scale[:] = [v.edge_scale for v in vertices]
+        if additional_uvs:
+            padding = [(0, 0, 0, 0)] * additional_uvs
+            data.additional_uvs[:] = [(list(v.additional_uvs) + padding)[:additional_uvs] for v in vertices]
+
+        weight_types, bones, weights, sdef_data = [], [], [], []
+        for i, v in enumerate(vertices):
+            w = v.weight
+            if w.type == BoneWeight.BDEF1:
+                bones.append((w.bones[0], -1, -1, -1))
+                weights.append((1, 0, 0, 0))
+            elif w.type == BoneWeight.BDEF2:
+                bones.append((w.bones[0], w.bones[1], -1, -1))
+                weights.append((w.weights[0], 1.0-w.weights[0], 0, 0))
+            elif w.type == BoneWeight.BDEF4:
+                bones.append(tuple(w.bones[:4]))
+                weights.append(tuple(w.weights[:4]))
+            elif w.type == BoneWeight.SDEF:
+                if not isinstance(w.weights, BoneWeightSDEF):
+                    raise ValueError
+                bones.append((w.bones[0], w.bones[1], -1, -1))
+                weights.append((w.weights.weight, 1.0-w.weights.weight, 0, 0))
+                sdef_data.append((i, w.weights.c, w.weights.r0, w.weights.r1))
+            else:
+                raise ValueError('invalid weight type %s'%str(w.type))
+            weight_types.append(w.type)
+        data.weight_type[:] = weight_types
+        data.bones[:] = bones
+        data.weights[:] = weights
+        if sdef_data:
+            indices, c, r0, r1 = zip(*sdef_data)
+            indices = list(indices)
+            data.sdef_c[indices] = c
+            data.sdef_r0[indices] = r0
+            data.sdef_r1[indices] = r1
+        return data
+
+    @staticmethod
+    def recordTypes(additional_uvs, bone_index_size):
+        """ Get the numpy dtypes of vertex records, indexed by weight type.
+        """
+        bone = {1:'<i1', 2:'<i2', 4:'<i4'}.get(bone_index_size, None)
+        if bone is None:
+            raise ValueError('invalid data size %s'%str(bone_index_size))
+        head = [('co', '<f4', (3,)), ('normal', '<f4', (3,)), ('uv', '<f4', (2,)),
+                ('additional_uvs', '<f4', (additional_uvs, 4)), ('weight_type', 'u1')]
+        tail = [('edge_scale', '<f4')]
+        return (
+            np.dtype(head + [('bones', bone, (1,))] + tail), # BDEF1
+            np.dtype(head + [('bones', bone, (2,)), ('weight', '<f4')] + tail), # BDEF2
+            np.dtype(head + [('bones', bone, (4,)), ('weights', '<f4', (4,))] + tail), # BDEF4
+            np.dtype(head + [('bones', bone, (2,)), ('weight', '<f4'),
+                             ('sdef_c', '<f4', (3,)), ('sdef_r0', '<f4', (3,)), ('sdef_r1', '<f4', (3,))] + tail), # SDEF
+            )
+
+    @staticmethod
+    def __scanRecords(buf, count, type_offset, sizes):
+        """ Find the offset and the weight type of each vertex record.
+
+        Returns (offsets, weight_types, end), offsets and weight_types are None if all records share the same weight type.
+        """
+        if len(buf) > type_offset and buf[type_offset] < len(sizes):
+            t = buf[type_offset]
+            end = sizes[t] * count
+            if len(buf) >= end and np.all(np.frombuffer(buf, np.uint8, end)[type_offset::sizes[t]] == t):
+                return None, t, end
+
+        offsets, weight_types, pos = [0] * count, bytearray(count), 0
+        try:
+            for i in range(count):
+                t = buf[pos + type_offset]
+                offsets[i] = pos
+                weight_types[i] = t
+                pos += sizes[t]
+        except IndexError:
+            if pos + type_offset < len(buf):
+                raise ValueError('invalid weight type %s'%str(buf[pos + type_offset]))
+            raise struct.error('vertex data is truncated')
+        if pos > len(buf):
+            raise struct.error('vertex data is truncated')
+        return np.array(offsets, np.int64), np.frombuffer(weight_types, np.uint8), pos
+
+    @classmethod
+    def skip(cls, fs, count):
+        header = fs.header()
+        record_types = cls.recordTypes(header.additional_uvs, header.bone_index_size)
+        sizes = [t.itemsize for t in record_types]
+        type_offset = record_types[0].fields['weight_type'][1]
+        buf = fs.peekBytes(max(sizes) * count)
+        fs.skip(cls.__scanRecords(buf, count, type_offset, sizes)[2])
+
+    @classmethod
+    def load(cls, fs, count):
+        """ Load vertex data of the given count from a pmx file stream.
+        """
+        header = fs.header()
+        data = cls(count, header.additional_uvs)
+        if count < 1:
+            return data
+
+        record_types = cls.recordTypes(header.additional_uvs, header.bone_index_size)
+        sizes = [t.itemsize for t in record_types]
+        type_offset = record_types[0].fields['weight_type'][1]
+
+        start = fs.tell()
+        buf = fs.peekBytes(max(sizes) * count)
+        offsets, weight_types, end = cls.__scanRecords(buf, count, type_offset, sizes)
+        if offsets is None:
+            # all records share the same layout, the geometry columns are views of the records
+            buf = None
+            records = fs.readArray(record_types[weight_types], count)
+            for name in ('co', 'normal', 'uv', 'additional_uvs', 'edge_scale'):
+                setattr(data, name, records[name])
+            groups = [(weight_types, slice(None), records)]
+        else:
+            u8 = np.frombuffer(buf, np.uint8)
+            groups = []
+            for t in np.unique(weight_types).tolist():
+                indices = np.flatnonzero(weight_types == t)
+                records = _gather_records(u8, offsets[indices], sizes[t]).view(record_types[t]).reshape(-1)
+                groups.append((t, indices, records))
+                data.co[indices] = records['co']
+                data.normal[indices] = records['normal']
+                data.uv[indices] = records['uv']
+                data.additional_uvs[indices] = records['additional_uvs']
+                data.edge_scale[indices] = records['edge_scale']
+            fs.seek(start + end)
+
+        for t, indices, records in groups:
+            data.weight_type[indices] = t
+            bones = records['bones']
+            data.bones[indices, :bones.shape[1]] = bones
+            if t == BoneWeight.BDEF1:
+                data.weights[indices, 0] = 1
+            elif t == BoneWeight.BDEF4:
+                data.weights[indices] = records['weights']
+            else:
+                weights = records['weight']
+                data.weights[indices, 0] = weights
+                data.weights[indices, 1] = 1 - weights
+            if t == BoneWeight.SDEF:
+                data.sdef_c[indices] = records['sdef_c']
+                data.sdef_r0[indices] = records['sdef_r0']
+                data.sdef_r1[indices] = records['sdef_r1']
+        return data
+
+    def save(self, fs):
+        """ Save vertex data to a pmx file stream.
+
+        The records of each weight type are packed together and scattered into
+        a single buffer, which is written at once.
+        """
+        count = len(self)
+        if count < 1:
+            return
+        header = fs.header()
+        additional_uvs = header.additional_uvs
+        record_types = self.recordTypes(additional_uvs, header.bone_index_size)
+        sizes = np.array([t.itemsize for t in record_types], np.int64)
+
+        weight_types = np.asarray(self.weight_type)
+        if weight_types.min() < 0 or weight_types.max() >= len(record_types):
+            invalid = weight_types[(weight_types < 0) | (weight_types >= len(record_types))]
+            raise ValueError('invalid weight type %s'%str(invalid[0]))
+        types = np.unique(weight_types).tolist()
+        if len(types) == 1:
+            groups = [(types[0], slice(None))]
+            offsets = None
+            buf = None
+        else:
+            groups = [(t, np.flatnonzero(weight_types == t)) for t in types]
+            offsets = np.zeros(count, np.int64)
+            np.cumsum(sizes[weight_types[:-1]], out=offsets[1:])
+            buf = np.empty(offsets[-1] + sizes[weight_types[-1]], np.uint8)
+
+        uvs = self.additional_uvs[:, :additional_uvs]
+        for t, indices in groups:
+            records = np.zeros(count if offsets is None else len(indices), record_types[t])
+            records['co'] = self.co[indices]
+            records['normal'] = self.normal[indices]
+            records['uv'] = self.uv[indices]
+            records['additional_uvs'][:, :uvs.shape[1]] = uvs[indices]
+            records['weight_type'] = t
+            records['edge_scale'] = self.edge_scale[indices]
+            bones = records['bones']
+            bones[:] = self.bones[indices, :bones.shape[1]]
+            if t == BoneWeight.BDEF4:
+                records['weights'] = self.weights[indices]
+            elif t != BoneWeight.BDEF1:
+                records['weight'] = self.weights[indices, 0]
+            if t == BoneWeight.SDEF:
+                records['sdef_c'] = self.sdef_c[indices]
+                records['sdef_r0'] = self.sdef_r0[indices]
+                records['sdef_r1'] = self.sdef_r1[indices]
+            if offsets is None:
+                fs.writeArray(records)
+                return
+            size = int(sizes[t])
+            windows = np.lib.stride_tricks.as_strided(buf, shape=(len(buf)-size+1, size), strides=(1, 1))
+            windows[offsets[indices]] = records.view(np.uint8).reshape(-1, size)
+        fs.writeArray(buf)
+
+
+def _index_type(size, signed):
+    types = {1:'<i1', 2:'<i2', 4:'<i4'} if signed else {1:'<u1', 2:'<u2', 4:'<u4'}
+    if size not in types:
+        raise ValueError('invalid data size %s'%str(size))
+    return types[size]
+
+def columnar(items, builder, *args):
+    """ Get the columnar data of a list of pmx objects, e.g. columnar(model.faces, FaceArrays.fromFaces).
+
+    The data of a lazy list is returned as is and must not be modified.
+    Otherwise the data is created by builder(items, *args).
+    """
+    data = items.data() if isinstance(items, _LazyList) else None
+    if data is None:
+        data = builder(items, *args)
+    return data
+
+def from_arrays(data):
+    """ Create a list of pmx objects which are created from the columnar data on first access.
+    """
+    return _LazyList(data)
+
+def take_items(items, indices):
+    """ Get a list of the pmx objects at indices. The columnar data of a lazy list is kept.
+    """
+    data = items.data() if isinstance(items, _LazyList) else None
+    if data is None:
+        return [items[i] for i in np.asarray(indices).tolist()]
+    return _LazyList(data.take(indices))
+
+class FaceArrays:
+    """ Columnar face data of a pmx model.
+
+    The vertex indices are stored in the order of Model.faces, which is reversed from the file.
+    Loaded indices are a read-only view of the file data with its integer type.
+    """
+    def __init__(self, count=0):
+        self.indices = np.zeros((count, 3), np.int32)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def copy(self):
+        data = FaceArrays.__new__(FaceArrays)
+        data.indices = self.indices.copy()
+        return data
+
+    def take(self, indices):
+        data = FaceArrays.__new__(FaceArrays)
+        data.indices = self.indices[indices]
+        return data
+
+    def update(self, indices, faces):
+        self.indices[indices] = faces
+
+    def item(self, index):
+        return tuple(self.indices[index].tolist())
+
+    @classmethod
+    def fromFaces(cls, faces):
+        data = cls(len(faces))
+        if len(faces):
+            data.indices[:] = faces
+        return data
+
+    @classmethod
+    def load(cls, fs, count):
+        data = cls.__new__(cls)
+        indices = fs.readArray(_index_type(fs.header().vertex_index_size, False), count*3)
+        data.indices = indices.reshape(count, 3)[:, ::-1]
+        return data
+
+    def save(self, fs):
+        indices = np.asarray(self.indices)[:, ::-1]
+        fs.writeArray(indices.astype(_index_type(fs.header().vertex_index_size, False)))
+
+class MorphOffsetArrays:
+    """ Columnar offset data of a vertex morph (size 3) or an uv morph (size 4).
+    """
+    def __init__(self, count=0, size=3):
+        self.index = np.zeros(count, np.int32)
+        self.offset = np.zeros((count, size), np.float32)
+
+    def __len__(self):
+        return len(self.index)
+
+    def copy(self):
+        data = MorphOffsetArrays.__new__(MorphOffsetArrays)
+        data.index = self.index.copy()
+        data.offset = self.offset.copy()
+        return data
+
+    def take(self, indices):
+        data = MorphOffsetArrays.__new__(MorphOffsetArrays)
+        data.index = self.index[indices]
+        data.offset = self.offset[indices]
+        return data
+
+    def update(self, indices, offsets):
+        part = self.fromOffsets(offsets, self.offset.shape[1])
+        self.index[indices] = part.index
+        self.offset[indices] = part.offset
+
+    def item(self, index):
+        t = VertexMorphOffset() if self.offset.shape[1] == 3 else UVMorphOffset()
+        t.index = int(self.index[index])
+        t.offset = tuple(self.offset[index].tolist())
+        return t
+
+    @classmethod
+    def fromOffsets(cls, offsets, size=3):
+        data = cls(len(offsets), size)
+        if len(offsets):
+            data.index[:] = [x.index for x in offsets]
+            data.offset[:] = [x.offset for x in offsets]
+        return data
+
+    @classmethod
+    def load(cls, fs, count, size):
+        data = cls.__new__(cls)
+        records = fs.readArray([('index', _index_type(fs.header().vertex_index_size, False)), ('offset', '<f4', (size,))], count)
+        data.index = records['index']
+        data.offset = records['offset']
+        return data
+
+    def save(self, fs):
+        size = self.offset.shape[1]
+        records = np.empty(len(self), [('index', _index_type(fs.header().vertex_index_size, False)), ('offset', '<f4', (size,))])
+        records['index'] = self.index
+        records['offset'] = self.offset
+        fs.writeArray(records)
+
+class ModelArrays:
+    """ Columnar view of the mesh data of a pmx model.
+
+    The arrays loaded by pmx.load() are shared if the model is not resized,
+    otherwise they are built from the pmx objects.
+
+    - vertices: VertexArrays
+    - faces: (face count, 3) array of vertex indices
+    - morphs: MorphOffsetArrays of each vertex/uv morph, or None for other morphs
+    """
+    def __init__(self, model):
+        if model.header:
+            additional_uvs = model.header.additional_uvs
+        else:
+            additional_uvs = max((len(v.additional_uvs) for v in model.vertices), default=0)
+        self.vertices = columnar(model.vertices, VertexArrays.fromVertices, additional_uvs)
+        self.faces = columnar(model.faces, FaceArrays.fromFaces).indices
+        self.morphs = []
+        for m in model.morphs:
+            if isinstance(m, VertexMorph):
+                self.morphs.append(columnar(m.offsets, MorphOffsetArrays.fromOffsets, 3))
+            elif isinstance(m, UVMorph):
+                self.morphs.append(columnar(m.offsets, MorphOffsetArrays.fromOffsets, 4))
+            else:
+                self.morphs.append(None)
+
+
 class Texture:
     def __init__(self):
         self.path = ''
@@ -784,6 +1661,10 @@ class Texture:
     def __repr__(self):
         return '<Texture path %s>'%str(self.path)
 
+    @staticmethod
+    def skip(fs):
+        fs.skip(fs.readInt())
+
     def load(self, fs):
         self.path = fs.readStr()
         self.path = self.path.replace('\\', os.path.sep)
@@ -857,6 +1738,19 @@ class Material:
             str(self.toon_texture),
             str(self.comment),)
 
+    @staticmethod
+    def skip(fs):
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(4*(4+3+1+3) + 1 + 4*(4+1)) # diffuse, specular, shininess, ambient, flags, edge
+        fs.skip(fs.header().texture_index_size * 2 + 1) # texture, sphere texture and mode
+        if fs.readSignedByte() == 1:
+            fs.skip(1)
+        else:
+            fs.skip(fs.header().texture_index_size)
+        fs.skip(fs.readInt()) # comment
+        fs.skip(4) # vertex count
+
     def load(self, fs, num_textures):
         def __tex_index(index):
             return index if 0 <= index < num_textures else -1
@@ -983,6 +1877,29 @@ class Bone:
             self.name,
             self.name_e,)
 
+    @staticmethod
+    def skip(fs):
+        bone_index_size = fs.header().bone_index_size
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(12 + bone_index_size + 4) # location, parent, transform order
+        flags = fs.readShort()
+        fs.skip(bone_index_size if flags & 0x0001 else 12)
+        if flags & 0x0300:
+            fs.skip(bone_index_size + 4)
+        if flags & 0x0400:
+            fs.skip(12)
+        if flags & 0x0800:
+            fs.skip(24)
+        if flags & 0x2000:
+            fs.skip(4)
+        if flags & 0x0020:
+            fs.skip(bone_index_size + 8)
+            for i in range(fs.readInt()):
+                fs.skip(bone_index_size)
+                if fs.readByte() == 1:
+                    fs.skip(24)
+
     def load(self, fs):
         self.name = fs.readStr()
         self.name_e = fs.readStr()
@@ -1110,23 +2027,21 @@ class IKLink:
         return '<IKLink target %s>'%(str(self.target))
 
     def load(self, fs):
-        self.target = fs.readBoneIndex()
-        flag = fs.readByte()
+        self.target, flag = fs.readStruct(fs.codecs().ik_link)
         if flag == 1:
-            self.minimumAngle = fs.readVector(3)
-            self.maximumAngle = fs.readVector(3)
+            limits = fs.readVector(6)
+            self.minimumAngle = limits[:3]
+            self.maximumAngle = limits[3:]
         else:
             self.minimumAngle = None
             self.maximumAngle = None
 
     def save(self, fs):
-        fs.writeBoneIndex(self.target)
         if isinstance(self.minimumAngle, (tuple, list)) and isinstance(self.maximumAngle, (tuple, list)):
-            fs.writeByte(1)
-            fs.writeVector(self.minimumAngle)
-            fs.writeVector(self.maximumAngle)
+            fs.writeStruct(fs.codecs().ik_link, int(self.target), 1)
+            fs.writeVector(tuple(self.minimumAngle) + tuple(self.maximumAngle))
         else:
-            fs.writeByte(0)
+            fs.writeStruct(fs.codecs().ik_link, int(self.target), 0)
 
 class Morph:
     CATEGORY_SYSTEM = 0
@@ -1147,6 +2062,26 @@ class Morph:
     def type_index(self):
         raise NotImplementedError
 
+    @staticmethod
+    def skip(fs):
+        header = fs.header()
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(1) # category
+        offset_sizes = {
+            0: header.morph_index_size + 4,
+            1: header.vertex_index_size + 12,
+            2: header.bone_index_size + 28,
+            3: header.vertex_index_size + 16,
+            4: header.vertex_index_size + 16,
+            5: header.vertex_index_size + 16,
+            6: header.vertex_index_size + 16,
+            7: header.vertex_index_size + 16,
+            8: header.material_index_size + 1 + 4*28,
+            }
+        size = offset_sizes[fs.readSignedByte()]
+        fs.skip(size * fs.readInt())
+
     @staticmethod
     def create(fs):
         _CLASSES = {
@@ -1181,6 +2116,9 @@ class Morph:
         fs.writeSignedByte(self.category)
         fs.writeSignedByte(self.type_index())
         fs.writeInt(len(self.offsets))
+        self.saveOffsets(fs)
+
+    def saveOffsets(self, fs):
         for i in self.offsets:
             i.save(fs)
 
@@ -1193,10 +2131,10 @@ class VertexMorph(Morph):
 
     def load(self, fs):
         num = fs.readInt()
-        for i in range(num):
-            t = VertexMorphOffset()
-            t.load(fs)
-            self.offsets.append(t)
+        self.offsets = _LazyList(MorphOffsetArrays.load(fs, num, 3))
+
+    def saveOffsets(self, fs):
+        columnar(self.offsets, MorphOffsetArrays.fromOffsets, 3).save(fs)
 
 class VertexMorphOffset:
     def __init__(self):
@@ -1220,12 +2158,11 @@ class UVMorph(Morph):
         return self.uv_index + 3
 
     def load(self, fs):
-        self.offsets = []
         num = fs.readInt()
-        for i in range(num):
-            t = UVMorphOffset()
-            t.load(fs)
-            self.offsets.append(t)
+        self.offsets = _LazyList(MorphOffsetArrays.load(fs, num, 4))
+
+    def saveOffsets(self, fs):
+        columnar(self.offsets, MorphOffsetArrays.fromOffsets, 4).save(fs)
 
 class UVMorphOffset:
     def __init__(self):
@@ -1306,30 +2243,31 @@ class MaterialMorphOffset:
         self.toon_texture_factor = []
 
     def load(self, fs):
-        self.index = fs.readMaterialIndex()
-        self.offset_type = fs.readSignedByte()
-        self.diffuse_offset = fs.readVector(4)
-        self.specular_offset = fs.readVector(3)
-        self.shininess_offset = fs.readFloat()
-        self.ambient_offset = fs.readVector(3)
-        self.edge_color_offset = fs.readVector(4)
-        self.edge_size_offset = fs.readFloat()
-        self.texture_factor = fs.readVector(4)
-        self.sphere_texture_factor = fs.readVector(4)
-        self.toon_texture_factor = fs.readVector(4)
+        values = fs.readStruct(fs.codecs().material_morph_offset)
+        self.index = values[0]
+        self.offset_type = values[1]
+        self.diffuse_offset = values[2:6]
+        self.specular_offset = values[6:9]
+        self.shininess_offset = values[9]
+        self.ambient_offset = values[10:13]
+        self.edge_color_offset = values[13:17]
+        self.edge_size_offset = values[17]
+        self.texture_factor = values[18:22]
+        self.sphere_texture_factor = values[22:26]
+        self.toon_texture_factor = values[26:30]
 
     def save(self, fs):
-        fs.writeMaterialIndex(self.index)
-        fs.writeSignedByte(self.offset_type)
-        fs.writeVector(self.diffuse_offset)
-        fs.writeVector(self.specular_offset)
-        fs.writeFloat(self.shininess_offset)
-        fs.writeVector(self.ambient_offset)
-        fs.writeVector(self.edge_color_offset)
-        fs.writeFloat(self.edge_size_offset)
-        fs.writeVector(self.texture_factor)
-        fs.writeVector(self.sphere_texture_factor)
-        fs.writeVector(self.toon_texture_factor)
+        values = (int(self.index), int(self.offset_type)) + \
+            tuple(self.diffuse_offset) + \
+            tuple(self.specular_offset) + \
+            (self.shininess_offset,) + \
+            tuple(self.ambient_offset) + \
+            tuple(self.edge_color_offset) + \
+            (self.edge_size_offset,) + \
+            tuple(self.texture_factor) + \
+            tuple(self.sphere_texture_factor) + \
+            tuple(self.toon_texture_factor)
+        fs.writeStruct(fs.codecs().material_morph_offset, *values)
 
 class GroupMorph(Morph):
     def __init__(self, *args, **kwargs):
@@ -1375,6 +2313,18 @@ class Display:
             self.name_e,
             )
 
+    @staticmethod
+    def skip(fs):
+        header = fs.header()
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(1) # isSpecial
+        for i in range(fs.readInt()):
+            if fs.readByte() == 0:
+                fs.skip(header.bone_index_size)
+            else:
+                fs.skip(header.morph_index_size)
+
     def load(self, fs):
         self.name = fs.readStr()
         self.name_e = fs.readStr()
@@ -1446,58 +2396,58 @@ class Rigid:
             self.name_e,
             )
 
+    @staticmethod
+    def skip(fs):
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(fs.codecs().rigid.size)
+
     def load(self, fs):
         self.name = fs.readStr()
         self.name_e = fs.readStr()
 
-        boneIndex = fs.readBoneIndex()
+        values = fs.readStruct(fs.codecs().rigid)
+        boneIndex = values[0]
         if boneIndex != -1:
             self.bone = boneIndex
         else:
             self.bone = None
 
-        self.collision_group_number = fs.readSignedByte()
-        self.collision_group_mask = fs.readUnsignedShort()
+        self.collision_group_number = values[1]
+        self.collision_group_mask = values[2]
 
-        self.type = fs.readSignedByte()
-        self.size = fs.readVector(3)
+        self.type = values[3]
+        self.size = values[4:7]
 
-        self.location = fs.readVector(3)
-        self.rotation = fs.readVector(3)
+        self.location = values[7:10]
+        self.rotation = values[10:13]
 
-        self.mass = fs.readFloat()
-        self.velocity_attenuation = fs.readFloat()
-        self.rotation_attenuation = fs.readFloat()
-        self.bounce = fs.readFloat()
-        self.friction = fs.readFloat()
+        self.mass = values[13]
+        self.velocity_attenuation = values[14]
+        self.rotation_attenuation = values[15]
+        self.bounce = values[16]
+        self.friction = values[17]
 
-        self.mode = fs.readSignedByte()
+        self.mode = values[18]
 
     def save(self, fs):
         fs.writeStr(self.name)
         fs.writeStr(self.name_e)
 
-        if self.bone is None:
-            fs.writeBoneIndex(-1)
-        else:
-            fs.writeBoneIndex(self.bone)
-
-        fs.writeSignedByte(self.collision_group_number)
-        fs.writeUnsignedShort(self.collision_group_mask)
-
-        fs.writeSignedByte(self.type)
-        fs.writeVector(self.size)
-
-        fs.writeVector(self.location)
-        fs.writeVector(self.rotation)
-
-        fs.writeFloat(self.mass)
-        fs.writeFloat(self.velocity_attenuation)
-        fs.writeFloat(self.rotation_attenuation)
-        fs.writeFloat(self.bounce)
-        fs.writeFloat(self.friction)
-
-        fs.writeSignedByte(self.mode)
+        values = (-1 if self.bone is None else int(self.bone),
+                  int(self.collision_group_number),
+                  int(self.collision_group_mask),
+                  int(self.type)) + \
+            tuple(self.size) + \
+            tuple(self.location) + \
+            tuple(self.rotation) + \
+            (self.mass,
+             self.velocity_attenuation,
+             self.rotation_attenuation,
+             self.bounce,
+             self.friction,
+             int(self.mode))
+        fs.writeStruct(fs.codecs().rigid, *values)
 
 class Joint:
     MODE_SPRING6DOF = 0
@@ -1521,6 +2471,12 @@ class Joint:
         self.spring_constant = []
         self.spring_rotation_constant = []
 
+    @staticmethod
+    def skip(fs):
+        fs.skip(fs.readInt()) # name
+        fs.skip(fs.readInt()) # name_e
+        fs.skip(fs.codecs().joint.size)
+
     def load(self, fs):
         try: self._load(fs)
         except struct.error: # possibly contains truncated data
@@ -1538,6 +2494,29 @@ class Joint:
         self.name = fs.readStr()
         self.name_e = fs.readStr()
 
+        pos = fs.tell()
+        try:
+            values = fs.readStruct(fs.codecs().joint)
+        except struct.error: # read each value to keep the values before the truncated data
+            fs.seek(pos)
+            return self._loadValues(fs)
+
+        self.mode = values[0]
+        self.src_rigid = values[1] if values[1] != -1 else None
+        self.dest_rigid = values[2] if values[2] != -1 else None
+
+        self.location = values[3:6]
+        self.rotation = values[6:9]
+
+        self.minimum_location = values[9:12]
+        self.maximum_location = values[12:15]
+        self.minimum_rotation = values[15:18]
+        self.maximum_rotation = values[18:21]
+
+        self.spring_constant = values[21:24]
+        self.spring_rotation_constant = values[24:27]
+
+    def _loadValues(self, fs):
         self.mode = fs.readSignedByte()
 
         self.src_rigid = fs.readRigidIndex()
@@ -1562,32 +2541,30 @@ class Joint:
         fs.writeStr(self.name)
         fs.writeStr(self.name_e)
 
-        fs.writeSignedByte(self.mode)
-
-        if self.src_rigid is not None:
-            fs.writeRigidIndex(self.src_rigid)
-        else:
-            fs.writeRigidIndex(-1)
-        if self.dest_rigid is not None:
-            fs.writeRigidIndex(self.dest_rigid)
-        else:
-            fs.writeRigidIndex(-1)
-
-        fs.writeVector(self.location)
-        fs.writeVector(self.rotation)
-
-        fs.writeVector(self.minimum_location)
-        fs.writeVector(self.maximum_location)
-        fs.writeVector(self.minimum_rotation)
-        fs.writeVector(self.maximum_rotation)
-
-        fs.writeVector(self.spring_constant)
-        fs.writeVector(self.spring_rotation_constant)
-
-
-
-def load(path):
-    with FileReadStream(path) as fs:
+        values = (int(self.mode),
+                  -1 if self.src_rigid is None else int(self.src_rigid),
+                  -1 if self.dest_rigid is None else int(self.dest_rigid)) + \
+            tuple(self.location) + \
+            tuple(self.rotation) + \
+            tuple(self.minimum_location) + \
+            tuple(self.maximum_location) + \
+            tuple(self.minimum_rotation) + \
+            tuple(self.maximum_rotation) + \
+            tuple(self.spring_constant) + \
+            tuple(self.spring_rotation_constant)
+        fs.writeStruct(fs.codecs().joint, *values)
+
+
+
+def load(path, use_mmap=False, sections=None):
+    """ Load a pmx file.
+
+    If use_mmap is True, the file is memory-mapped and the vertex, face and
+    morph arrays of the model are views of the mapped file where possible.
+    See Model.load() for sections.
+    """
+    stream_class = MappedFileReadStream if use_mmap else FileReadStream
+    with stream_class(path) as fs:
         logging.info('****************************************')
         logging.info(' mmd_tools.pmx module')
         logging.info('----------------------------------------')
@@ -1599,7 +2576,7 @@ def load(path):
         fs.setHeader(header)
         model = Model()
         try:
-            model.load(fs)
+            model.load(fs, sections)
         except struct.error as e:
             logging.error(' * Corrupted file: %s', e)
             #raise
@@ -1609,10 +2586,51 @@ def load(path):
         logging.info('****************************************')
         return model
 
-def save(path, model, add_uv_count=0):
-    with FileWriteStream(path) as fs:
-        header = Header(model)
+def probe(path):
+    """ Read the metadata of a pmx file without loading vertices, faces, materials, bones and morphs.
+
+    @return a dict of the model names/comments, the item count of each section
+        and the texture paths.
+    """
+    with MappedFileReadStream(path) as fs:
+        header = Header()
+        header.load(fs)
+        fs.setHeader(header)
+        model = Model()
+        model.load(fs, sections=('textures',), count_all=True)
+        info = {
+            'filepath': path,
+            'format': 'pmx',
+            'version': header.version,
+            'name': model.name,
+            'name_e': model.name_e,
+            'comment': model.comment,
+            'comment_e': model.comment_e,
+            'textures': [t.path for t in model.textures],
+            }
+        for name in Model.SECTIONS:
+            info['num_'+name] = model.section_counts[name]
+        return info
+
+def open_writer(path, counts, add_uv_count=0):
+    """ Open a ModelWriter of a new pmx file to write a model section by section.
+
+    @param counts the item count (or an upper bound of it) of each section of Header.INDEXED_SECTIONS
+    @return a ModelWriter, which removes the incomplete file if it's closed on errors
+    """
+    fs = FileWriteStream(path)
+    try:
+        header = Header()
+        header.updateIndexSizesByCounts(counts)
         header.additional_uvs = max(0, min(4, add_uv_count)) # UV1~UV4
         header.save(fs)
         fs.setHeader(header)
-        model.save(fs)
+    except:
+        fs.close()
+        raise
+    return ModelWriter(fs)
+
+def save(path, model, add_uv_count=0):
+    counts = {name:len(getattr(model, name)) for name in Header.INDEXED_SECTIONS}
+    with open_writer(path, counts, add_uv_count) as writer:
+        writer.writeModel(model)
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 import os
-import copy
 import logging
 import shutil
 import time
@@ -8,6 +7,7 @@ import time
 import mathutils
 import bpy
 import bmesh
+import numpy as np
 
 from collections import OrderedDict
 from mmd_tools.core import pmx
@@ -22,31 +22,23 @@ from mmd_tools.bpyutils import matmul
 from mmd_tools.operators.misc import MoveObject
 
 
-class _Vertex:
-    def __init__(self, co, groups, offsets, edge_scale, vertex_order, uv_offsets):
-        self.co = co
-        self.groups = groups # [(group_number, weight), ...]
-        self.offsets = offsets
-        self.edge_scale = edge_scale
-        self.vertex_order = vertex_order # used for controlling vertex order
-        self.uv_offsets = uv_offsets
-        self.index = None
-        self.uv = None
-        self.normal = None
-        self.sdef_data = [] # (C, R0, R1)
-        self.add_uvs = [None]*4 # UV1~UV4
-
-class _Face:
-    def __init__(self, vertices):
-        ''' Temporary Face Class
-        '''
-        self.vertices = vertices
-
 class _Mesh:
-    def __init__(self, material_faces, shape_key_names, material_names):
-        self.material_faces = material_faces # dict of {material_index => [face1, face2, ....]}
+    def __init__(self, vertex_count, vertices, base_indices, faces, material_indices, material_names,
+                 shape_key_names, vertex_offsets, uv_offsets, vertex_orders):
+        """ Temporary columnar data of a mesh object
+
+        The blender vertices are split by uv, normal and additional uvs.
+        """
+        self.vertex_count = vertex_count # the count of blender vertices
+        self.vertices = vertices # pmx.VertexArrays of the split vertices
+        self.base_indices = base_indices # the blender vertex index of each split vertex
+        self.faces = faces # (face count, 3) indices of the split vertices
+        self.material_indices = material_indices # material index of each face
+        self.material_names = material_names # dict of {material_index => material name}
         self.shape_key_names = shape_key_names
-        self.material_names = material_names
+        self.vertex_offsets = vertex_offsets # dict of {shape key name => (blender vertex indices, offsets)}
+        self.uv_offsets = uv_offsets # dict of {uv morph name => (blender vertex indices, offsets)}
+        self.vertex_orders = vertex_orders # the weight of "mmd_vertex_order" of each blender vertex, or None
 
 
 class _DefaultMaterial:
@@ -72,15 +64,26 @@ class __PmxExporter:
         'MOUTH': pmx.Morph.CATEGORY_MOUTH,
         }
 
+    MORPH_TYPES = {
+        pmx.GroupMorph : 'group_morphs',
+        pmx.VertexMorph : 'vertex_morphs',
+        pmx.BoneMorph : 'bone_morphs',
+        pmx.UVMorph : 'uv_morphs',
+        pmx.MaterialMorph : 'material_morphs',
+        }
+
     def __init__(self):
         self.__model = None
         self.__bone_name_table = []
         self.__material_name_table = []
-        self.__exported_vertices = []
+        self.__exported_vertices = None # (mesh ids, blender vertex indices, pmx vertex indices) in export order
         self.__default_material = None
-        self.__vertex_order_map = None # used for controlling vertex order
+        self.__vertex_order_method = None # used for controlling vertex order
         self.__disable_specular = False
         self.__add_uv_count = 0
+        self.__writer = None # pmx.ModelWriter of the exported file
+        self.__morph_map = {} # the pmx morph index of each written morph by (morph type, name)
+        self.__morph_count = 0
 
     @staticmethod
     def flipUV_V(uv):
@@ -92,113 +95,91 @@ class __PmxExporter:
             self.__default_material = _DefaultMaterial()
         return self.__default_material.material
 
-    def __sortVertices(self):
+    def __sortVertices(self, meshes, mesh_ids, base_indices):
+        """ Get the sorted order of the exported vertices.
+
+        The vertices are sorted by mesh, the weight of vertex group "mmd_vertex_order" (CUSTOM only)
+        and blender vertex index. Split vertices of a blender vertex are kept in export order.
+        """
         logging.info(' - Sorting vertices ...')
-        weight_items = self.__vertex_order_map.items()
-        sorted_indices = [i[0] for i in sorted(weight_items, key=lambda x: x[1].vertex_order)]
-        vertices = self.__model.vertices
-        self.__model.vertices = [vertices[i] for i in sorted_indices]
-
-        # update indices
-        index_map = {x:i for i, x in enumerate(sorted_indices)}
-        for v in self.__vertex_order_map.values():
-            v.index = index_map[v.index]
-        for f in self.__model.faces:
-            f[:] = [index_map[i] for i in f]
-        logging.debug('   - Done (count:%d)', len(self.__vertex_order_map))
+        orders = np.zeros(len(mesh_ids))
+        if self.__vertex_order_method == 'CUSTOM':
+            for mesh_id, mesh in enumerate(meshes):
+                if mesh.vertex_orders is not None:
+                    selected = np.flatnonzero(mesh_ids == mesh_id)
+                    orders[selected] = mesh.vertex_orders[base_indices[selected]]
+        sorted_indices = np.lexsort((base_indices, orders, mesh_ids))
+        logging.debug('   - Done (count:%d)', len(sorted_indices))
+        return sorted_indices
 
     def __exportMeshes(self, meshes, bone_map):
         mat_map = OrderedDict()
-        for mesh in meshes:
-            for index, mat_faces in sorted(mesh.material_faces.items(), key=lambda x: x[0]):
+        for mesh_id, mesh in enumerate(meshes):
+            for index in sorted(mesh.material_names.keys()):
                 name = mesh.material_names[index]
                 if name not in mat_map:
                     mat_map[name] = []
-                mat_map[name].append(mat_faces)
-
-        sort_vertices = self.__vertex_order_map is not None
-        if sort_vertices:
-            self.__vertex_order_map.clear()
+                mat_map[name].append((mesh_id, index))
 
-        # export vertices
+        vertex_starts = np.cumsum([0] + [len(mesh.vertices) for mesh in meshes])
+        faces = [np.zeros((0, 3), np.int64)]
         for mat_name, mat_meshes in mat_map.items():
             face_count = 0
-            for mat_faces in mat_meshes:
-                mesh_vertices = []
-                for face in mat_faces:
-                    mesh_vertices.extend(face.vertices)
-
-                for v in mesh_vertices:
-                    if v.index is not None:
-                        continue
-
-                    v.index = len(self.__model.vertices)
-                    if sort_vertices:
-                        self.__vertex_order_map[v.index] = v
-
-                    pv = pmx.Vertex()
-                    pv.co = v.co
-                    pv.normal = v.normal
-                    pv.uv = self.flipUV_V(v.uv)
-                    pv.edge_scale = v.edge_scale
-                    for _uvzw in v.add_uvs:
-                        if _uvzw:
-                            pv.additional_uvs.append(self.flipUV_V(_uvzw[0])+self.flipUV_V(_uvzw[1]))
-
-                    t = len(v.groups)
-                    if t == 0:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF1
-                        weight.bones = [0]
-                        pv.weight = weight
-                    elif t == 1:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF1
-                        weight.bones = [v.groups[0][0]]
-                        pv.weight = weight
-                    elif t == 2:
-                        vg1, vg2 = v.groups
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF2
-                        weight.bones = [vg1[0], vg2[0]]
-                        w1, w2 = vg1[1], vg2[1]
-                        weight.weights = [w1/(w1+w2)]
-                        if v.sdef_data:
-                            weight.type = pmx.BoneWeight.SDEF
-                            sdef_weights = pmx.BoneWeightSDEF()
-                            sdef_weights.weight = weight.weights[0]
-                            sdef_weights.c, sdef_weights.r0, sdef_weights.r1 = v.sdef_data
-                            if weight.bones[0] > weight.bones[1]:
-                                weight.bones.reverse()
-                                sdef_weights.weight = 1.0 - sdef_weights.weight
-                            weight.weights = sdef_weights
-                        pv.weight = weight
-                    else:
-                        weight = pmx.BoneWeight()
-                        weight.type = pmx.BoneWeight.BDEF4
-                        weight.bones = [0, 0, 0, 0]
-                        weight.weights = [0.0, 0.0, 0.0, 0.0]
-                        w_all = 0.0
-                        if t > 4:
-                            v.groups.sort(key=lambda x: -x[1])
-                        for i in range(min(t, 4)):
-                            gn, w = v.groups[i]
-                            weight.bones[i] = gn
-                            weight.weights[i] = w
-                            w_all += w
-                        for i in range(4):
-                            weight.weights[i] /= w_all
-                        pv.weight = weight
-                    self.__model.vertices.append(pv)
-                    self.__exported_vertices.append(v)
-
-                for face in mat_faces:
-                    self.__model.faces.append([x.index for x in face.vertices])
+            for mesh_id, index in mat_meshes:
+                mesh = meshes[mesh_id]
+                mat_faces = mesh.faces[mesh.material_indices == index]
+                faces.append(mat_faces + vertex_starts[mesh_id])
                 face_count += len(mat_faces)
             self.__exportMaterial(bpy.data.materials[mat_name], face_count)
-
-        if sort_vertices:
-            self.__sortVertices()
+        faces = np.concatenate(faces)
+
+        # export vertices in the order of their first use by the faces
+        used_vertices, first_use = np.unique(faces.ravel(), return_index=True)
+        exported = used_vertices[np.argsort(first_use, kind='mergesort')]
+        mesh_ids = np.repeat(np.arange(len(meshes)), np.diff(vertex_starts))[exported]
+        base_indices = np.concatenate([np.zeros(0, np.int64)] + [mesh.base_indices for mesh in meshes])[exported]
+
+        pmx_indices = np.arange(len(exported)) # the pmx vertex index of each exported vertex
+        if self.__vertex_order_method is not None:
+            sorted_indices = self.__sortVertices(meshes, mesh_ids, base_indices)
+            pmx_indices[sorted_indices] = np.arange(len(exported))
+        index_map = np.full(vertex_starts[-1], -1, np.int64)
+        index_map[exported] = pmx_indices
+
+        vertices = pmx.VertexArrays.concatenate([mesh.vertices for mesh in meshes], min(self.__add_uv_count, 4))
+        self.__model.vertices = pmx.from_arrays(vertices.take(exported[np.argsort(pmx_indices)]))
+        face_data = pmx.FaceArrays()
+        face_data.indices = index_map[faces].astype(np.int32)
+        self.__model.faces = pmx.from_arrays(face_data)
+        self.__exported_vertices = (mesh_ids, base_indices, pmx_indices)
+        for mesh in meshes: # only the morph data of the meshes is used from here
+            mesh.vertices = mesh.faces = mesh.material_indices = None
+
+    def __gatherOffsets(self, meshes, attr, name, size):
+        """ Get the pmx vertex indices and the offsets of a morph of the exported vertices in export order.
+
+        The offsets of the morph are removed from the meshes, so they are released as soon as the morph is written.
+
+        @param attr the attribute name of the morph offsets of _Mesh
+        """
+        mesh_ids, base_indices, indices = self.__exported_vertices
+        positions, offsets = [np.zeros(0, np.int64)], []
+        for mesh_id, mesh in enumerate(meshes):
+            mesh_data = getattr(mesh, attr).pop(name, None)
+            if mesh_data is None:
+                continue
+            offset_indices, mesh_offsets = mesh_data
+            offsets_map = np.full(mesh.vertex_count, -1, np.int64)
+            offsets_map[offset_indices] = np.arange(len(offset_indices))
+            mesh_positions = np.flatnonzero(mesh_ids == mesh_id)
+            rows = offsets_map[base_indices[mesh_positions]]
+            valid = rows >= 0
+            positions.append(mesh_positions[valid])
+            offsets.append(mesh_offsets[rows[valid]])
+        positions = np.concatenate(positions)
+        order = np.argsort(positions, kind='mergesort')
+        offsets = np.concatenate(offsets)[order] if offsets else np.zeros((0, size), np.float32)
+        return indices[positions[order]], offsets
 
     def __exportTexture(self, filepath):
         if filepath.strip() == '':
@@ -563,13 +544,25 @@ class __PmxExporter:
                 r = c
         return r
 
-    def __exportVertexMorphs(self, meshes, root):
+    def __addMorph(self, morph):
+        """ Write an exported morph, so its data can be released before exporting the next one.
+        """
+        self.__morph_map[(self.MORPH_TYPES[type(morph)], morph.name)] = self.__morph_count
+        self.__morph_count += 1
+        self.__writer.write([morph])
+
+    @staticmethod
+    def __vertexMorphNames(meshes, root):
         shape_key_names = []
         for mesh in meshes:
             for i in mesh.shape_key_names:
                 if i not in shape_key_names:
                     shape_key_names.append(i)
+        if root:
+            shape_key_names.sort(key=lambda x: root.mmd_root.vertex_morphs.find(x))
+        return shape_key_names
 
+    def __exportVertexMorphs(self, meshes, root):
         morph_categories = {}
         morph_english_names = {}
         if root:
@@ -577,23 +570,19 @@ class __PmxExporter:
             for vtx_morph in root.mmd_root.vertex_morphs:
                 morph_english_names[vtx_morph.name] = vtx_morph.name_e
                 morph_categories[vtx_morph.name] = categories.get(vtx_morph.category, pmx.Morph.CATEGORY_OHTER)
-            shape_key_names.sort(key=lambda x: root.mmd_root.vertex_morphs.find(x))
 
-        for i in shape_key_names:
+        for i in self.__vertexMorphNames(meshes, root):
             morph = pmx.VertexMorph(
                 name=i,
                 name_e=morph_english_names.get(i, ''),
                 category=morph_categories.get(i, pmx.Morph.CATEGORY_OHTER)
             )
-            self.__model.morphs.append(morph)
-
-        append_table = dict(zip(shape_key_names, [m.offsets.append for m in self.__model.morphs]))
-        for v in self.__exported_vertices:
-            for i, offset in v.offsets.items():
-                mo = pmx.VertexMorphOffset()
-                mo.index = v.index
-                mo.offset = offset
-                append_table[i](mo)
+            indices, offsets = self.__gatherOffsets(meshes, 'vertex_offsets', i, 3)
+            data = pmx.MorphOffsetArrays(len(indices), 3)
+            data.index[:] = indices
+            data.offset[:] = offsets
+            morph.offsets = pmx.from_arrays(data)
+            self.__addMorph(morph)
 
     def __export_material_morphs(self, root):
         mmd_root = root.mmd_root
@@ -625,9 +614,9 @@ class __PmxExporter:
                 morph_data.sphere_texture_factor = data.sphere_texture_factor
                 morph_data.toon_texture_factor = data.toon_texture_factor
                 mat_morph.offsets.append(morph_data)
-            self.__model.morphs.append(mat_morph)
+            self.__addMorph(mat_morph)
 
-    def __sortMaterials(self):
+    def __sortMaterials(self, sort_key='DISTANCE'):
         """ sort materials for alpha blending
 
          モデル内全頂点の平均座標をモデルの中心と考えて、
@@ -635,35 +624,37 @@ class __PmxExporter:
          この値が小さい順にソートしてみる。
          モデル中心座標から離れている位置で使用されているマテリアルほどリストの後ろ側にくるように。
          かなりいいかげんな実装
+
+         @param sort_key the value of each material to sort by
+           - DISTANCE: the mean distance between the model center and the face vertices (the method above)
+           - DEPTH: the mean depth of the face vertices seen from the front, from back to front
+           - RADIUS: the max distance between the model center and the face vertices
         """
-        center = mathutils.Vector([0, 0, 0])
-        vertices = self.__model.vertices
-        vert_num = len(vertices)
-        for v in self.__model.vertices:
-            center += mathutils.Vector(v.co) / vert_num
-
-        faces = self.__model.faces
-        offset = 0
-        distances = []
-        for mat, bl_mat_name in zip(self.__model.materials, self.__material_name_table):
-            d = 0
-            face_num = int(mat.vertex_count / 3)
-            for i in range(offset, offset + face_num):
-                face = faces[i]
-                d += (mathutils.Vector(vertices[face[0]].co) - center).length
-                d += (mathutils.Vector(vertices[face[1]].co) - center).length
-                d += (mathutils.Vector(vertices[face[2]].co) - center).length
-            distances.append((d/mat.vertex_count, mat, offset, face_num, bl_mat_name))
-            offset += face_num
-        sorted_faces = []
-        sorted_mat = []
-        self.__material_name_table.clear()
-        for d, mat, offset, vert_count, bl_mat_name in sorted(distances, key=lambda x: x[0]):
-            sorted_faces.extend(faces[offset:offset+vert_count])
-            sorted_mat.append(mat)
-            self.__material_name_table.append(bl_mat_name)
-        self.__model.materials = sorted_mat
-        self.__model.faces = sorted_faces
+        co = pmx.columnar(self.__model.vertices, pmx.VertexArrays.fromVertices, 0).co.astype(np.float64)
+        faces = np.asarray(pmx.columnar(self.__model.faces, pmx.FaceArrays.fromFaces).indices, dtype=np.int64)
+        materials = self.__model.materials
+        face_counts = np.array([mat.vertex_count // 3 for mat in materials], dtype=np.int64)
+        face_materials = np.repeat(np.arange(len(materials)), face_counts)
+
+        if sort_key == 'DEPTH':
+            values = -co[faces, 2] # the front of a pmx model is -Z
+        else:
+            center = co.mean(axis=0) if len(co) > 0 else np.zeros(3)
+            values = np.linalg.norm(co[faces] - center, axis=2)
+        if sort_key == 'RADIUS':
+            keys = np.zeros(len(materials))
+            np.maximum.at(keys, face_materials, values.max(axis=1))
+        else:
+            keys = np.bincount(face_materials, weights=values.sum(axis=1), minlength=len(materials))
+            keys /= np.maximum(face_counts * 3, 1)
+
+        order = np.argsort(keys, kind='mergesort')
+        ranks = np.empty_like(order)
+        ranks[order] = np.arange(len(order))
+        self.__model.faces = pmx.take_items(self.__model.faces, np.argsort(ranks[face_materials], kind='mergesort'))
+        self.__model.materials = [materials[i] for i in order.tolist()]
+        self.__material_name_table[:] = [self.__material_name_table[i] for i in order.tolist()]
+        logging.debug(' - Sorted materials by %s', sort_key)
 
     def __export_bone_morphs(self, root):
         mmd_root = root.mmd_root
@@ -695,14 +686,15 @@ class __PmxExporter:
                 rw, rx, ry, rz = converter.convert_rotation([rx, ry, rz, rw])
                 morph_data.rotation_offset = (rx, ry, rz, rw)
                 bone_morph.offsets.append(morph_data)
-            self.__model.morphs.append(bone_morph)
+            self.__addMorph(bone_morph)
 
-    def __export_uv_morphs(self, root):
+    def __export_uv_morphs(self, root, meshes):
         mmd_root = root.mmd_root
         if len(mmd_root.uv_morphs) == 0:
             return
         categories = self.CATEGORIES
-        append_table_vg = {}
+        pmx_uv_morphs = []
+        uv_morphs_vg = {}
         for morph in mmd_root.uv_morphs:
             uv_morph = pmx.UVMorph(
                 name=morph.name,
@@ -710,45 +702,52 @@ class __PmxExporter:
                 category=categories.get(morph.category, pmx.Morph.CATEGORY_OHTER)
             )
             uv_morph.uv_index = morph.uv_index
-            self.__model.morphs.append(uv_morph)
+            pmx_uv_morphs.append(uv_morph)
             if morph.data_type == 'VERTEX_GROUP':
-                append_table_vg[morph.name] = uv_morph.offsets.append
+                uv_morphs_vg[morph.name] = uv_morph
                 continue
             logging.warning(' * Deprecated UV morph "%s", please convert it to vertex groups', morph.name)
 
-        if append_table_vg:
+        if uv_morphs_vg:
             incompleted = set()
             uv_morphs = mmd_root.uv_morphs
-            for v in self.__exported_vertices:
-                for name, offset in v.uv_offsets.items():
-                    if name not in append_table_vg:
-                        incompleted.add(name)
-                        continue
-                    scale = uv_morphs[name].vertex_group_scale
-                    morph_data = pmx.UVMorphOffset()
-                    morph_data.index = v.index
-                    morph_data.offset = (offset[0]*scale, -offset[1]*scale, offset[2]*scale, -offset[3]*scale)
-                    append_table_vg[name](morph_data)
+            for name in sorted({name for mesh in meshes for name in mesh.uv_offsets.keys()}):
+                indices, offsets = self.__gatherOffsets(meshes, 'uv_offsets', name, 4)
+                if len(indices) < 1:
+                    continue
+                if name not in uv_morphs_vg:
+                    incompleted.add(name)
+                    continue
+                scale = uv_morphs[name].vertex_group_scale
+                data = pmx.MorphOffsetArrays(len(indices), 4)
+                data.index[:] = indices
+                data.offset[:] = offsets * np.array([scale, -scale, scale, -scale])
+                uv_morphs_vg[name].offsets = pmx.from_arrays(data)
 
             if incompleted:
                 logging.warning(' * Incompleted UV morphs %s with vertex groups', incompleted)
 
+        for uv_morph in pmx_uv_morphs:
+            self.__addMorph(uv_morph)
+
     def __export_group_morphs(self, root):
         mmd_root = root.mmd_root
         if len(mmd_root.group_morphs) == 0:
             return
         categories = self.CATEGORIES
-        start_index = len(self.__model.morphs)
+        group_morphs = []
         for morph in mmd_root.group_morphs:
             group_morph = pmx.GroupMorph(
                 name=morph.name,
                 name_e=morph.name_e,
                 category=categories.get(morph.category, pmx.Morph.CATEGORY_OHTER)
             )
-            self.__model.morphs.append(group_morph)
+            group_morphs.append(group_morph)
 
-        morph_map = self.__get_pmx_morph_map()
-        for morph, group_morph in zip(mmd_root.group_morphs, self.__model.morphs[start_index:]):
+        morph_map = self.__morph_map.copy()
+        for i, group_morph in enumerate(group_morphs):
+            morph_map[('group_morphs', group_morph.name)] = self.__morph_count + i
+        for morph, group_morph in zip(mmd_root.group_morphs, group_morphs):
             for data in morph.data:
                 morph_index = morph_map.get((data.morph_type, data.name), -1)
                 if morph_index < 0:
@@ -758,10 +757,11 @@ class __PmxExporter:
                 morph_data.morph = morph_index
                 morph_data.factor = data.factor
                 group_morph.offsets.append(morph_data)
+            self.__addMorph(group_morph)
 
     def __exportDisplayItems(self, root, bone_map):
         res = []
-        morph_map = self.__get_pmx_morph_map()
+        morph_map = self.__morph_map
         for i in root.mmd_root.display_item_frames:
             d = pmx.Display()
             d.name = i.name
@@ -779,19 +779,6 @@ class __PmxExporter:
             res.append(d)
         self.__model.display = res
 
-    def __get_pmx_morph_map(self):
-        morph_types = {
-            pmx.GroupMorph : 'group_morphs',
-            pmx.VertexMorph : 'vertex_morphs',
-            pmx.BoneMorph : 'bone_morphs',
-            pmx.UVMorph : 'uv_morphs',
-            pmx.MaterialMorph : 'material_morphs',
-            }
-        morph_map = {}
-        for i, m in enumerate(self.__model.morphs):
-            morph_map[(morph_types[type(m)], m.name)] = i
-        return morph_map
-
 
     def __exportRigidBodies(self, rigid_bodies, bone_map):
         rigid_map = {}
@@ -873,37 +860,157 @@ class __PmxExporter:
 
 
     @staticmethod
-    def __convertFaceUVToVertexUV(vert_index, uv, normal, vertices_map):
-        vertices = vertices_map[vert_index]
-        for i in vertices:
-            if i.uv is None:
-                i.uv = uv
-                i.normal = normal
-                return i
-            elif (i.uv - uv).length < 0.001 and (normal - i.normal).length < 0.01:
-                return i
-        n = copy.copy(i) # shallow copy should be fine
-        n.uv = uv
-        n.normal = normal
-        vertices.append(n)
-        return n
+    def __flipUV_V_array(uv):
+        uv = uv.astype(np.float64)
+        uv[:, 1] = 1.0 - uv[:, 1]
+        return uv
 
     @staticmethod
-    def __convertAddUV(vert, adduv, addzw, uv_index, vertices, rip_vertices):
-        if vert.add_uvs[uv_index] is None:
-            vert.add_uvs[uv_index] = (adduv, addzw)
-            return vert
-        for i in rip_vertices:
-            uvzw = i.add_uvs[uv_index]
-            if (uvzw[0] - adduv).length < 0.001 and (uvzw[1] - addzw).length < 0.001:
-                return i
-        n = copy.copy(vert)
-        add_uvs = n.add_uvs.copy()
-        add_uvs[uv_index] = (adduv, addzw)
-        n.add_uvs = add_uvs
-        vertices.append(n)
-        rip_vertices.append(n)
-        return n
+    def __splitVertices(group_ids, features):
+        """ Split the loops of each group (a vertex) into vertices of similar features.
+
+        The result is the same as visiting the loops in order, where a loop is merged
+        into the first vertex of its group whose features are all within the
+        tolerances, or creates a new vertex. This is done in rounds: the first
+        remaining loop of each group creates a vertex, and the remaining loops of
+        the group which match it are merged.
+
+        @param group_ids the group id of each loop
+        @param features a list of (array of loop values, tolerance)
+        @return (the vertex id of each loop, the first loop of the vertex of each loop)
+        """
+        first_loops = np.empty(len(group_ids), np.int64)
+        remaining = np.arange(len(group_ids))
+        while len(remaining):
+            first, inverse = np.unique(group_ids[remaining], return_index=True, return_inverse=True)[1:]
+            reps = remaining[first][inverse.ravel()]
+            merged = np.ones(len(remaining), dtype=bool)
+            for values, tolerance in features:
+                merged &= np.linalg.norm(values[remaining] - values[reps], axis=1) < tolerance
+            merged |= remaining == reps
+            first_loops[remaining[merged]] = reps[merged]
+            remaining = remaining[~merged]
+        vertex_ids = np.unique(first_loops, return_inverse=True)[1].ravel()
+        return vertex_ids, first_loops
+
+    @staticmethod
+    def __loopUVs(uv_layer, loop_count):
+        uvs = np.empty((loop_count, 2), np.float32)
+        if uv_layer:
+            uv_layer.data.foreach_get('uv', uvs.ravel())
+        else:
+            uvs[:] = (0, 1)
+        return uvs
+
+    @staticmethod
+    def __vertexGroupArrays(vertices):
+        """ Get the vertex group elements of mesh vertices as arrays of (vertex index, group index, weight).
+        """
+        counts = [len(v.groups) for v in vertices]
+        data = np.array([(x.group, x.weight) for v in vertices for x in v.groups], np.float64).reshape(-1, 2)
+        return np.repeat(np.arange(len(counts)), counts), data[:, 0].astype(np.int64), data[:, 1]
+
+    @staticmethod
+    def __groupWeights(groups, group_index, vertex_count, default_weight):
+        vertex_indices, group_indices, weights = groups
+        values = np.full(vertex_count, default_weight, np.float64)
+        selected = np.flatnonzero(group_indices == group_index)
+        values[vertex_indices[selected]] = weights[selected]
+        return values
+
+    @staticmethod
+    def __boneGroups(groups, vg_to_bone, vertex_count):
+        """ Get the bone weights of blender vertices as (counts, (n, 4) bones, (n, 4) weights).
+
+        The groups of a vertex keep their order, or are sorted by weight if there are more than 4 of them.
+        """
+        vertex_indices, group_indices, weights = groups
+        bone_table = np.full(max([len(group_indices) and int(group_indices.max())] + list(vg_to_bone.keys())) + 1, -1, np.int64)
+        for group_index, bone_index in vg_to_bone.items():
+            bone_table[group_index] = bone_index
+        valid = (weights > 0) & (bone_table[group_indices] >= 0)
+        vertex_indices, bone_indices, weights = vertex_indices[valid], bone_table[group_indices[valid]], weights[valid]
+
+        counts = np.bincount(vertex_indices, minlength=vertex_count)
+        order = np.lexsort((np.where(counts[vertex_indices] > 4, -weights, 0), vertex_indices))
+        vertex_indices, bone_indices, weights = vertex_indices[order], bone_indices[order], weights[order]
+        ranks = np.arange(len(vertex_indices)) - (np.cumsum(counts) - counts)[vertex_indices]
+        used = ranks < 4
+        bones = np.full((vertex_count, 4), -1, np.int64)
+        bones[vertex_indices[used], ranks[used]] = bone_indices[used]
+        bone_weights = np.zeros((vertex_count, 4), np.float64)
+        bone_weights[vertex_indices[used], ranks[used]] = weights[used]
+        return counts, bones, bone_weights
+
+    @staticmethod
+    def __boneWeights(bone_groups, sdef_vertices):
+        """ Get the pmx (weight types, bones, weights) of blender vertices as in pmx.VertexArrays.
+        """
+        counts, bones, weights = bone_groups
+        vertex_count = len(counts)
+        weight_types = np.full(vertex_count, pmx.BoneWeight.BDEF1, np.uint8)
+        pmx_bones = np.full((vertex_count, 4), -1, np.int32)
+        pmx_weights = np.zeros((vertex_count, 4), np.float32)
+
+        bdef1 = counts < 2
+        pmx_bones[bdef1, 0] = np.maximum(bones[bdef1, 0], 0) # bone 0 if no weights
+        pmx_weights[bdef1, 0] = 1
+
+        bdef2 = counts == 2
+        w = np.zeros(vertex_count, np.float64)
+        w[bdef2] = weights[bdef2, 0] / (weights[bdef2, 0] + weights[bdef2, 1])
+        weight_types[bdef2] = pmx.BoneWeight.BDEF2
+        weight_types[sdef_vertices] = pmx.BoneWeight.SDEF
+        swapped = sdef_vertices & (bones[:, 0] > bones[:, 1])
+        bones[swapped, :2] = bones[swapped, 1::-1]
+        w[swapped] = 1.0 - w[swapped]
+        pmx_bones[bdef2, :2] = bones[bdef2, :2]
+        pmx_weights[bdef2, 0] = w[bdef2]
+        pmx_weights[bdef2, 1] = 1.0 - w[bdef2]
+
+        bdef4 = counts > 2
+        weight_types[bdef4] = pmx.BoneWeight.BDEF4
+        pmx_bones[bdef4] = np.maximum(bones[bdef4], 0)
+        pmx_weights[bdef4] = weights[bdef4] / weights[bdef4].sum(axis=1)[:, None]
+        return weight_types, pmx_bones, pmx_weights
+
+    @staticmethod
+    def __uvMorphOffsets(groups, uv_morph_groups):
+        """ Get the offsets of uv morphs with vertex groups as a dict of {name => (vertex indices, (n, 4) offsets)}.
+        """
+        vertex_indices, group_indices, weights = groups
+        morph_groups = {}
+        for group_index, (name, axis) in uv_morph_groups.items():
+            morph_groups.setdefault(name, []).append((group_index, axis))
+
+        uv_offsets = {}
+        for name, axes in morph_groups.items():
+            indices, columns, values = [], [], []
+            for group_index, axis in axes:
+                selected = np.flatnonzero((group_indices == group_index) & (weights > 0))
+                indices.append(vertex_indices[selected])
+                columns.append(np.full(len(selected), 'XYZW'.index(axis[1]), np.int64))
+                values.append(-weights[selected] if axis[0] == '-' else weights[selected])
+            offset_indices, rows = np.unique(np.concatenate(indices), return_inverse=True)
+            if len(offset_indices) < 1:
+                continue
+            offsets = np.zeros((len(offset_indices), 4), np.float64)
+            np.add.at(offsets, (rows.ravel(), np.concatenate(columns)), np.concatenate(values))
+            uv_offsets[name] = (offset_indices, offsets)
+        return uv_offsets
+
+    @staticmethod
+    def __shapeKeyOffsets(key_block, basis_co, matrix, co, out):
+        """ Get the (n, 3) offsets of a shape key from the basis in pmx space.
+
+        The shape key data is read directly, so it's only valid if the evaluated mesh is the basis itself.
+        The flat (n*3) buffer co and the (n, 3) buffer out are reused for each shape key, and out is returned.
+
+        @param matrix the transposed 3x3 float32 array of the pmx matrix
+        """
+        key_block.data.foreach_get('co', co)
+        co -= basis_co
+        return np.dot(co.reshape(-1, 3), matrix, out=out)
 
     @staticmethod
     def __triangulate(mesh, custom_normals):
@@ -929,11 +1036,12 @@ class __PmxExporter:
             quad_method, ngon_method = (1, 1) if bpy.app.version < (2, 80, 0) else ('FIXED', 'EAR_CLIP')
             face_map = bmesh.ops.triangulate(bm, faces=bm.faces, quad_method=quad_method, ngon_method=ngon_method)['face_map']
             logging.debug(' - Remapping custom normals...')
-            loop_normals = []
+            loop_ids = []
             for f in bm.faces:
                 vert_to_loop_id = face_verts_to_loop_id_map[face_map.get(f, f)]
                 for v in f.verts:
-                    loop_normals.append(custom_normals[vert_to_loop_id[v]])
+                    loop_ids.append(vert_to_loop_id[v])
+            loop_normals = custom_normals[np.array(loop_ids, np.int64)]
             logging.debug('   - Done (faces:%d)', len(bm.faces))
             bm.to_mesh(mesh)
             face_map.clear()
@@ -945,31 +1053,40 @@ class __PmxExporter:
 
     @staticmethod
     def __get_normals(mesh, matrix):
-        custom_normals = None
-        if hasattr(mesh, 'has_custom_normals'):
-            logging.debug(' - Calculating normals split...')
-            mesh.calc_normals_split()
-            custom_normals = [matmul(matrix, l.normal).normalized() for l in mesh.loops]
-            mesh.free_normals_split()
-        elif mesh.use_auto_smooth:
-            logging.debug(' - Calculating normals split (angle:%f)...', mesh.auto_smooth_angle)
-            mesh.calc_normals_split(mesh.auto_smooth_angle)
-            custom_normals = [matmul(matrix, l.normal).normalized() for l in mesh.loops]
+        loop_count = len(mesh.loops)
+        normals = np.empty((loop_count, 3), np.float32)
+        if hasattr(mesh, 'has_custom_normals') or mesh.use_auto_smooth:
+            if hasattr(mesh, 'has_custom_normals'):
+                logging.debug(' - Calculating normals split...')
+                mesh.calc_normals_split()
+            else:
+                logging.debug(' - Calculating normals split (angle:%f)...', mesh.auto_smooth_angle)
+                mesh.calc_normals_split(mesh.auto_smooth_angle)
+            mesh.loops.foreach_get('normal', normals.ravel())
             mesh.free_normals_split()
         else:
             logging.debug(' - Calculating normals...')
             mesh.calc_normals()
-            #custom_normals = [matmul(matrix, mesh.vertices[l.vertex_index].normal).normalized() for l in mesh.loops]
-            custom_normals = []
-            for f in mesh.polygons:
-                if f.use_smooth:
-                    for v in f.vertices:
-                        custom_normals.append(matmul(matrix, mesh.vertices[v].normal).normalized())
-                else:
-                    for v in f.vertices:
-                        custom_normals.append(matmul(matrix, f.normal).normalized())
+            polygon_count, vertex_count = len(mesh.polygons), len(mesh.vertices)
+            loop_totals = np.empty(polygon_count, np.int32)
+            mesh.polygons.foreach_get('loop_total', loop_totals)
+            use_smooth = np.empty(polygon_count, dtype=bool)
+            mesh.polygons.foreach_get('use_smooth', use_smooth)
+            polygon_normals = np.empty((polygon_count, 3), np.float32)
+            mesh.polygons.foreach_get('normal', polygon_normals.ravel())
+            vertex_normals = np.empty((vertex_count, 3), np.float32)
+            mesh.vertices.foreach_get('normal', vertex_normals.ravel())
+            loop_vertices = np.empty(loop_count, np.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vertices)
+            loop_polygons = np.repeat(np.arange(polygon_count), loop_totals)
+            smooth = use_smooth[loop_polygons]
+            normals[smooth] = vertex_normals[loop_vertices[smooth]]
+            normals[~smooth] = polygon_normals[loop_polygons[~smooth]]
+        normals = np.dot(normals, np.array(matrix, np.float64).T)
+        lengths = np.linalg.norm(normals, axis=1)
+        normals[lengths > 0] /= lengths[lengths > 0, None]
         logging.debug('   - Done (polygons:%d)', len(mesh.polygons))
-        return custom_normals
+        return normals
 
     def __doLoadMeshData(self, meshObj, bone_map):
         vg_to_bone = {i:bone_map[x.name] for i, x in enumerate(meshObj.vertex_groups) if x.name in bone_map}
@@ -995,109 +1112,65 @@ class __PmxExporter:
                 return obj.evaluated_get(depsgraph).to_mesh(depsgraph=depsgraph, preserve_all_data_layers=True)
             _to_mesh_clear = lambda obj, mesh: obj.to_mesh_clear()
 
+        def _get_co(mesh):
+            co = np.empty((len(mesh.vertices), 3), np.float32)
+            mesh.vertices.foreach_get('co', co.ravel())
+            return co
+
         base_mesh = _to_mesh(meshObj)
         loop_normals = self.__triangulate(base_mesh, self.__get_normals(base_mesh, normal_matrix))
         base_mesh.transform(pmx_matrix)
 
-        def _get_weight(vertex_group_index, vertex, default_weight):
-            for i in vertex.groups:
-                if i.group == vertex_group_index:
-                    return i.weight
-            return default_weight
+        vertex_count = len(base_mesh.vertices)
+        base_co = _get_co(base_mesh)
+        groups = self.__vertexGroupArrays(base_mesh.vertices)
+        bone_groups = self.__boneGroups(groups, vg_to_bone, vertex_count)
 
-        get_edge_scale = None
         if vg_edge_scale:
-            get_edge_scale = lambda x: _get_weight(vg_edge_scale.index, x, 1)
+            edge_scale = self.__groupWeights(groups, vg_edge_scale.index, vertex_count, 1)
         else:
-            get_edge_scale = lambda x: 1
-
-        get_vertex_order = None
-        if self.__vertex_order_map: # sort vertices
-            mesh_id = self.__vertex_order_map.setdefault('mesh_id', 0)
-            self.__vertex_order_map['mesh_id'] += 1
-            if vg_vertex_order and self.__vertex_order_map['method'] == 'CUSTOM':
-                get_vertex_order = lambda x: (mesh_id, _get_weight(vg_vertex_order.index, x, 2), x.index)
-            else:
-                get_vertex_order = lambda x: (mesh_id, x.index)
-        else:
-            get_vertex_order = lambda x: None
-
-        uv_morph_names = {g.index:(n, x) for g, n, x in FnMorph.get_uv_morph_vertex_groups(meshObj)}
-        def get_uv_offsets(v):
-            uv_offsets = {}
-            for x in v.groups:
-                if x.group in uv_morph_names and x.weight > 0:
-                    name, axis = uv_morph_names[x.group]
-                    d = uv_offsets.setdefault(name, [0, 0, 0, 0])
-                    d['XYZW'.index(axis[1])] += -x.weight if axis[0] == '-' else x.weight
-            return uv_offsets
-
-        base_vertices = {}
-        for v in base_mesh.vertices:
-            base_vertices[v.index] = [_Vertex(
-                v.co.copy(),
-                [(vg_to_bone[x.group], x.weight) for x in v.groups if x.weight > 0 and x.group in vg_to_bone],
-                {},
-                get_edge_scale(v),
-                get_vertex_order(v),
-                get_uv_offsets(v),
-                )]
+            edge_scale = np.ones(vertex_count)
 
-        # load face data
-        class _DummyUV:
-            uv1 = uv2 = uv3 = mathutils.Vector((0, 1))
-            def __init__(self, uvs):
-                self.uv1,  self.uv2, self.uv3 = (v.uv.copy() for v in uvs)
+        vertex_orders = None
+        if vg_vertex_order and self.__vertex_order_method == 'CUSTOM':
+            vertex_orders = self.__groupWeights(groups, vg_vertex_order.index, vertex_count, 2)
 
-        _UVWrapper = lambda x: (_DummyUV(x[i:i+3]) for i in range(0, len(x), 3))
+        uv_morph_groups = {g.index:(n, x) for g, n, x in FnMorph.get_uv_morph_vertex_groups(meshObj)}
+        uv_offsets = self.__uvMorphOffsets(groups, uv_morph_groups)
 
-        material_faces = {}
-        uv_data = base_mesh.uv_layers.active
-        if uv_data:
-            uv_data = _UVWrapper(uv_data.data)
-        else:
-            uv_data = iter(lambda: _DummyUV, None)
-        face_seq = []
-        for face, uv in zip(base_mesh.polygons, uv_data):
-            if len(face.vertices) != 3:
-                raise Exception
-            idx = face.index * 3
-            n1, n2, n3 = loop_normals[idx:idx+3]
-            v1 = self.__convertFaceUVToVertexUV(face.vertices[0], uv.uv1, n1, base_vertices)
-            v2 = self.__convertFaceUVToVertexUV(face.vertices[1], uv.uv2, n2, base_vertices)
-            v3 = self.__convertFaceUVToVertexUV(face.vertices[2], uv.uv3, n3, base_vertices)
-
-            t = _Face([v1, v2, v3])
-            face_seq.append(t)
-            if face.material_index not in material_faces:
-                material_faces[face.material_index] = []
-            material_faces[face.material_index].append(t)
+        # load face data
+        polygons, loops = base_mesh.polygons, base_mesh.loops
+        loop_count = len(loops)
+        loop_totals = np.empty(len(polygons), np.int32)
+        polygons.foreach_get('loop_total', loop_totals)
+        if np.any(loop_totals != 3) or loop_count != len(polygons) * 3:
+            raise Exception
+        loop_vertices = np.empty(loop_count, np.int32)
+        loops.foreach_get('vertex_index', loop_vertices)
+        material_indices = np.empty(len(polygons), np.int32)
+        polygons.foreach_get('material_index', material_indices)
+
+        # split vertices by uv and normal (within the tolerances)
+        uvs = self.__loopUVs(base_mesh.uv_layers.active, loop_count)
+        vertex_ids, uv_loops = self.__splitVertices(loop_vertices, [(uvs, 0.001), (loop_normals, 0.01)])
 
         _mat_name = lambda x: x.name if x else self.__getDefaultMaterial().name
         material_names = {i:_mat_name(m) for i, m in enumerate(base_mesh.materials)}
-        material_names = {i:material_names.get(i, None) or _mat_name(None) for i in material_faces.keys()}
+        material_names = {i:material_names.get(i, None) or _mat_name(None) for i in np.unique(material_indices).tolist()}
 
         # export add UV
         bl_add_uvs = [i for i in base_mesh.uv_layers[1:] if not i.name.startswith('_')]
         self.__add_uv_count = max(self.__add_uv_count, len(bl_add_uvs))
+        add_uvs = []
         for uv_n, uv_tex in enumerate(bl_add_uvs):
             if uv_n > 3:
                 logging.warning(' * extra addUV%d+ are not supported', uv_n+1)
                 break
-            uv_data = _UVWrapper(uv_tex.data)
-            zw_data = base_mesh.uv_layers.get('_'+uv_tex.name, None)
-            logging.info(' # exporting addUV%d: %s [zw: %s]', uv_n+1, uv_tex.name, zw_data)
-            if zw_data:
-                zw_data = _UVWrapper(zw_data.data)
-            else:
-                zw_data = iter(lambda: _DummyUV, None)
-            rip_vertices_map = {}
-            for f, face, uv, zw in zip(face_seq, base_mesh.polygons, uv_data, zw_data):
-                vertices = [base_vertices[x] for x in face.vertices]
-                rip_vertices = [rip_vertices_map.setdefault(x, [x]) for x in f.vertices]
-                f.vertices[0] = self.__convertAddUV(f.vertices[0], uv.uv1, zw.uv1, uv_n, vertices[0], rip_vertices[0])
-                f.vertices[1] = self.__convertAddUV(f.vertices[1], uv.uv2, zw.uv2, uv_n, vertices[1], rip_vertices[1])
-                f.vertices[2] = self.__convertAddUV(f.vertices[2], uv.uv3, zw.uv3, uv_n, vertices[2], rip_vertices[2])
+            zw_tex = base_mesh.uv_layers.get('_'+uv_tex.name, None)
+            logging.info(' # exporting addUV%d: %s [zw: %s]', uv_n+1, uv_tex.name, zw_tex)
+            add_uv, add_zw = self.__loopUVs(uv_tex, loop_count), self.__loopUVs(zw_tex, loop_count)
+            vertex_ids, add_uv_loops = self.__splitVertices(vertex_ids, [(add_uv, 0.001), (add_zw, 0.001)])
+            add_uvs.append((add_uv, add_zw, add_uv_loops))
 
         _to_mesh_clear(meshObj, base_mesh)
 
@@ -1114,57 +1187,88 @@ class __PmxExporter:
                 else:
                     shape_key_list.append((i, kb))
 
+        # without any evaluated modifier, the shape keys are read directly instead of evaluating a mesh per key
+        read_directly = shape_key_list and len(meshObj.data.vertices) == vertex_count and not any(m.show_viewport for m in meshObj.modifiers)
+        if read_directly:
+            basis_co = np.empty(vertex_count * 3, np.float32)
+            meshObj.data.shape_keys.key_blocks[0].data.foreach_get('co', basis_co)
+            key_co = np.empty_like(basis_co)
+            key_offsets = np.empty((vertex_count, 3), np.float32)
+            key_matrix = np.array(pmx_matrix.to_3x3(), np.float32).T
+
         shape_key_names = []
-        sdef_counts = 0
+        vertex_offsets = {}
+        sdef_vertices = np.zeros(vertex_count, dtype=bool)
+        sdef_data = [np.zeros((vertex_count, 3), np.float32) for i in range(3)] # (C, R0, R1)
         for i, kb in shape_key_list:
             shape_key_name = kb.name
             logging.info(' - processing shape key: %s', shape_key_name)
-            kb_mute, kb.mute = kb.mute, False
-            meshObj.active_shape_key_index = i
-            mesh = _to_mesh(meshObj)
-            mesh.transform(pmx_matrix)
-            kb.mute = kb_mute
-            if len(mesh.vertices) != len(base_vertices):
-                logging.warning('   * Error! vertex count mismatch!')
-                continue
+            if read_directly and not kb.vertex_group:
+                offsets = self.__shapeKeyOffsets(kb, basis_co, key_matrix, key_co, key_offsets)
+            else:
+                kb_mute, kb.mute = kb.mute, False
+                meshObj.active_shape_key_index = i
+                mesh = _to_mesh(meshObj)
+                mesh.transform(pmx_matrix)
+                kb.mute = kb_mute
+                co = _get_co(mesh)
+                _to_mesh_clear(meshObj, mesh)
+                if len(co) != vertex_count:
+                    logging.warning('   * Error! vertex count mismatch!')
+                    continue
+                offsets = co - base_co
             if shape_key_name in {'mmd_sdef_c', 'mmd_sdef_r0', 'mmd_sdef_r1'}:
+                co = base_co + offsets
                 if shape_key_name == 'mmd_sdef_c':
-                    for v in mesh.vertices:
-                        base = base_vertices[v.index][0]
-                        if len(base.groups) != 2:
-                            continue
-                        base_co = base.co
-                        c_co = v.co
-                        if (c_co - base_co).length < 0.001:
-                            continue
-                        base.sdef_data[:] = tuple(c_co), base_co, base_co
-                        sdef_counts += 1
-                    logging.info('   - Restored %d SDEF vertices', sdef_counts)
-                elif sdef_counts > 0:
+                    sdef_vertices = (bone_groups[0] == 2) & ~(np.linalg.norm(offsets, axis=1) < 0.001)
+                    sdef_data[0][sdef_vertices] = co[sdef_vertices]
+                    sdef_data[1][sdef_vertices] = base_co[sdef_vertices]
+                    sdef_data[2][sdef_vertices] = base_co[sdef_vertices]
+                    logging.info('   - Restored %d SDEF vertices', np.count_nonzero(sdef_vertices))
+                elif np.any(sdef_vertices):
                     ri = 1 if shape_key_name == 'mmd_sdef_r0' else 2
-                    for v in mesh.vertices:
-                        sdef_data = base_vertices[v.index][0].sdef_data
-                        if sdef_data:
-                            sdef_data[ri] = tuple(v.co)
+                    sdef_data[ri][sdef_vertices] = co[sdef_vertices]
                     logging.info('   - Updated SDEF data')
             else:
                 shape_key_names.append(shape_key_name)
-                for v in mesh.vertices:
-                    base = base_vertices[v.index][0]
-                    offset = v.co - base.co
-                    if offset.length < 0.001:
-                        continue
-                    base.offsets[shape_key_name] = offset
-            _to_mesh_clear(meshObj, mesh)
-
+                offset_indices = np.flatnonzero(~(np.linalg.norm(offsets, axis=1) < 0.001))
+                vertex_offsets[shape_key_name] = (offset_indices, offsets[offset_indices])
+
+        # build the split vertices
+        vertex_loops = np.unique(vertex_ids, return_index=True)[1]
+        base_indices = loop_vertices[vertex_loops].astype(np.int64)
+        vertices = pmx.VertexArrays(len(vertex_loops), len(add_uvs))
+        vertices.co[:] = base_co[base_indices]
+        vertices.normal[:] = loop_normals[uv_loops[vertex_loops]]
+        vertices.uv[:] = self.__flipUV_V_array(uvs[uv_loops[vertex_loops]])
+        for uv_n, (add_uv, add_zw, add_uv_loops) in enumerate(add_uvs):
+            add_uv_loops = add_uv_loops[vertex_loops]
+            vertices.additional_uvs[:, uv_n, :2] = self.__flipUV_V_array(add_uv[add_uv_loops])
+            vertices.additional_uvs[:, uv_n, 2:] = self.__flipUV_V_array(add_zw[add_uv_loops])
+        vertices.edge_scale[:] = edge_scale[base_indices]
+        weight_types, bones, weights = self.__boneWeights(bone_groups, sdef_vertices)
+        vertices.weight_type[:] = weight_types[base_indices]
+        vertices.bones[:] = bones[base_indices]
+        vertices.weights[:] = weights[base_indices]
+        vertices.sdef_c[:] = sdef_data[0][base_indices]
+        vertices.sdef_r0[:] = sdef_data[1][base_indices]
+        vertices.sdef_r1[:] = sdef_data[2][base_indices]
+
+        faces = vertex_ids.reshape(-1, 3)
         if not pmx_matrix.is_negative: # pmx.load/pmx.save reverse face vertices by default
-            for f in face_seq:
-                f.vertices.reverse()
+            faces = faces[:, ::-1]
 
         return _Mesh(
-            material_faces,
+            vertex_count,
+            vertices,
+            base_indices,
+            faces,
+            material_indices,
+            material_names,
             shape_key_names,
-            material_names)
+            vertex_offsets,
+            uv_offsets,
+            vertex_orders)
 
     def __loadMeshData(self, meshObj, bone_map):
         show_only_shape_key = meshObj.show_only_shape_key
@@ -1221,22 +1325,14 @@ class __PmxExporter:
         self.__disable_specular = args.get('disable_specular', False)
         sort_vertices = args.get('sort_vertices', 'NONE')
         if sort_vertices != 'NONE':
-            self.__vertex_order_map = {'method':sort_vertices}
+            self.__vertex_order_method = sort_vertices
 
         nameMap = self.__exportBones(meshes)
 
         mesh_data = [self.__loadMeshData(i, nameMap) for i in meshes]
         self.__exportMeshes(mesh_data, nameMap)
         if args.get('sort_materials', False):
-            self.__sortMaterials()
-
-        self.__exportVertexMorphs(mesh_data, root)
-        if root is not None:
-            self.__export_bone_morphs(root)
-            self.__export_material_morphs(root)
-            self.__export_uv_morphs(root)
-            self.__export_group_morphs(root)
-            self.__exportDisplayItems(root, nameMap)
+            self.__sortMaterials(args.get('sort_materials_by', 'DISTANCE'))
 
         rigid_map = self.__exportRigidBodies(rigids, nameMap)
         self.__exportJoints(joints, rigid_map)
@@ -1247,7 +1343,36 @@ class __PmxExporter:
             base_folder = bpyutils.addon_preferences('base_texture_folder', '')
             self.__copy_textures(output_dir, import_folder or base_folder)
 
-        pmx.save(filepath, self.__model, add_uv_count=self.__add_uv_count)
+        # the sections are written as soon as they are finalized, and the morphs are written one by one
+        morph_count = len(self.__vertexMorphNames(mesh_data, root))
+        if root is not None:
+            mmd_root = root.mmd_root
+            morph_count += len(mmd_root.bone_morphs) + len(mmd_root.material_morphs) + len(mmd_root.uv_morphs) + len(mmd_root.group_morphs)
+        counts = {name:len(getattr(self.__model, name)) for name in pmx.Header.INDEXED_SECTIONS}
+        counts['morphs'] = morph_count
+
+        model = self.__model
+        with pmx.open_writer(filepath, counts, add_uv_count=self.__add_uv_count) as writer:
+            self.__writer = writer
+            writer.writeInfo(model.name, model.name_e, model.comment, model.comment_e)
+            for name in ('vertices', 'faces', 'textures', 'materials', 'bones'):
+                writer.writeSection(name, getattr(model, name))
+                setattr(model, name, [])
+
+            writer.beginSection('morphs', morph_count)
+            self.__exportVertexMorphs(mesh_data, root)
+            if root is not None:
+                self.__export_bone_morphs(root)
+                self.__export_material_morphs(root)
+                self.__export_uv_morphs(root, mesh_data)
+                self.__export_group_morphs(root)
+            writer.endSection()
+
+            if root is not None:
+                self.__exportDisplayItems(root, nameMap)
+            for name in ('display', 'rigids', 'joints'):
+                writer.writeSection(name, getattr(model, name))
+        self.__writer = None
 
 def export(filepath, **kwargs):
     logging.info('****************************************')
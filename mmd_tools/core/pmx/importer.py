@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
-import collections
+import collections.abc
+import hashlib
 import logging
 import time
 
 import bpy
+import numpy as np
 from mathutils import Vector, Matrix
 
 import mmd_tools.core.model as mmd_model
@@ -37,6 +39,13 @@ class PMXImporter:
         7: 'uv_morphs',
         8: 'material_morphs',
         }
+    SECTIONS = { # pmx sections required by each import type
+        'MESH': ('vertices', 'faces', 'textures', 'materials', 'bones'),
+        'ARMATURE': ('bones',),
+        'PHYSICS': ('bones', 'rigids', 'joints'),
+        'DISPLAY': ('bones', 'morphs', 'display'),
+        'MORPHS': ('bones', 'morphs'),
+        }
 
     def __init__(self):
         self.__model = None
@@ -56,7 +65,8 @@ class PMXImporter:
         self.__materialTable = []
         self.__imageTable = {}
 
-        self.__sdefVertices = {} # pmx vertices
+        self.__arrays = None # pmx.ModelArrays
+        self.__sdefVertices = None # (blender vertex indices, c, r0, r1)
         self.__blender_ik_links = set()
         self.__vertex_map = None
 
@@ -71,6 +81,30 @@ class PMXImporter:
         u, v = uv
         return u, 1.0-v
 
+    @staticmethod
+    def __flipUV_V_array(uv):
+        uv = uv.astype(np.float64)
+        uv[:, 1] = 1.0 - uv[:, 1]
+        return uv
+
+    @staticmethod
+    def __convertNormalArray(normal):
+        """ Convert a (n, 3) array of pmx normals to a (n, 3) float32 array of normalized blender normals.
+
+        The normals are normalized like mathutils.Vector.normalized(), zero normals are kept.
+        """
+        normal = np.ascontiguousarray(normal[:, (0, 2, 1)], dtype=np.float32)
+        length_sq = np.einsum('ij,ij->i', normal, normal, dtype=np.float64)
+        valid = length_sq > 1e-35
+        scale = np.zeros(len(normal), np.float32)
+        scale[valid] = 1.0 / np.sqrt(length_sq[valid])
+        return normal * scale[:, None]
+
+    def __convertCoArray(self, co):
+        """ Convert a (n, 3) array of pmx coordinates to a flat float32 array of blender coordinates.
+        """
+        return (co[:, (0, 2, 1)].astype(np.float64) * self.__scale).astype(np.float32).ravel()
+
     def __createObjects(self):
         """ Create main objects and link them to scene.
         """
@@ -112,71 +146,86 @@ class PMXImporter:
         vgroups = self.__meshObj.vertex_groups
         self.__vertexGroupTable = [vgroups.new(name=i.name) for i in self.__model.bones] or [vgroups.new(name='NO BONES')]
 
+    def __meshVertexArrays(self):
+        """ Get the vertex arrays of the blender mesh vertices, excluding the merged doubles.
+        """
+        vertices = self.__arrays.vertices
+        vertex_map = self.__vertex_map
+        if vertex_map is not None:
+            vertices = vertices.take(np.flatnonzero(vertex_map[:, 0] == np.arange(len(vertex_map))))
+        return vertices
+
     def __importVertices(self):
         self.__importVertexGroup()
 
-        pmxModel = self.__model
-        pmx_vertices = pmxModel.vertices
-        vertex_count = len(pmx_vertices)
-        vertex_map = self.__vertex_map
-        if vertex_map:
-            indices = collections.OrderedDict(vertex_map).keys()
-            pmx_vertices = tuple(pmxModel.vertices[x] for x in indices)
-            vertex_count = len(indices)
+        vertices = self.__meshVertexArrays()
+        vertex_count = len(vertices)
         if vertex_count < 1:
             return
 
         mesh = self.__meshObj.data
         mesh.vertices.add(count=vertex_count)
-        mesh.vertices.foreach_set('co', tuple(i for pv in pmx_vertices for i in (Vector(pv.co).xzy * self.__scale)))
+        mesh.vertices.foreach_set('co', self.__convertCoArray(vertices.co))
+
+        # SDEF bones are sorted by bone index
+        is_sdef = (vertices.weight_type == pmx.BoneWeight.SDEF)
+        bones, weights = vertices.bones.copy(), vertices.weights.copy()
+        sdef_r0, sdef_r1 = vertices.sdef_r0.copy(), vertices.sdef_r1.copy()
+        swap = np.flatnonzero(is_sdef & (bones[:, 0] > bones[:, 1]))
+        bones[swap, :2] = bones[swap, 1::-1]
+        weights[swap, :2] = weights[swap, 1::-1]
+        sdef_r0[swap], sdef_r1[swap] = vertices.sdef_r1[swap], vertices.sdef_r0[swap]
 
         vertex_group_table = self.__vertexGroupTable
         vg_edge_scale = self.__meshObj.vertex_groups.new(name='mmd_edge_scale')
         vg_vertex_order = self.__meshObj.vertex_groups.new(name='mmd_vertex_order')
-        for i, pv in enumerate(pmx_vertices):
-            pv_bones, pv_weights, idx = pv.weight.bones, pv.weight.weights, (i,)
-
-            vg_edge_scale.add(index=idx, weight=pv.edge_scale, type='REPLACE')
-            vg_vertex_order.add(index=idx, weight=i/vertex_count, type='REPLACE')
-
-            if isinstance(pv_weights, pmx.BoneWeightSDEF):
-                if pv_bones[0] > pv_bones[1]:
-                    pv_bones.reverse()
-                    pv_weights.weight = 1.0 - pv_weights.weight
-                    pv_weights.r0, pv_weights.r1 = pv_weights.r1, pv_weights.r0
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights.weight, type='ADD')
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0-pv_weights.weight, type='ADD')
-                self.__sdefVertices[i] = pv
-            elif len(pv_bones) == 1:
-                bone_index = pv_bones[0]
-                if bone_index >= 0:
-                    vertex_group_table[bone_index].add(index=idx, weight=1.0, type='ADD')
-            elif len(pv_bones) == 2:
-                vertex_group_table[pv_bones[0]].add(index=idx, weight=pv_weights[0], type='ADD')
-                vertex_group_table[pv_bones[1]].add(index=idx, weight=1.0-pv_weights[0], type='ADD')
-            elif len(pv_bones) == 4:
-                for bone, weight in zip(pv_bones, pv_weights):
-                    vertex_group_table[bone].add(index=idx, weight=weight, type='ADD')
-            else:
-                raise Exception('unkown bone weight type.')
+        bpyutils.set_vertex_group_weights(mesh, (
+            (vg_edge_scale, vertices.edge_scale),
+            (vg_vertex_order, np.arange(vertex_count)/vertex_count),
+            ))
+
+        weight_types = vertices.weight_type
+        if len(weight_types) and weight_types.max() > pmx.BoneWeight.SDEF:
+            raise Exception('unkown bone weight type.')
+        slot_counts = np.array((1, 2, 4, 2))[weight_types] # BDEF1, BDEF2, BDEF4, SDEF
+        used_slots = np.arange(4) < slot_counts[:, None]
+        used_slots[:, 0] &= (weight_types != pmx.BoneWeight.BDEF1) | (bones[:, 0] >= 0)
+        vertex_indices, slots = np.nonzero(used_slots)
+        group_indices = bones[vertex_indices, slots]
+        group_indices[group_indices < 0] += len(vertex_group_table) # same as indexing the table by -1
+        bpyutils.add_vertex_group_weights(vertex_group_table, group_indices, vertex_indices, weights[vertex_indices, slots])
+
+        sdef_indices = np.flatnonzero(is_sdef)
+        if len(sdef_indices):
+            self.__sdefVertices = (sdef_indices, vertices.sdef_c[sdef_indices], sdef_r0[sdef_indices], sdef_r1[sdef_indices])
 
         vg_edge_scale.lock_weight = True
         vg_vertex_order.lock_weight = True
 
     def __storeVerticesSDEF(self):
-        if len(self.__sdefVertices) < 1:
+        if self.__sdefVertices is None:
             return
 
         self.__createBasisShapeKey()
-        sdefC = self.__meshObj.shape_key_add(name='mmd_sdef_c')
-        sdefR0 = self.__meshObj.shape_key_add(name='mmd_sdef_r0')
-        sdefR1 = self.__meshObj.shape_key_add(name='mmd_sdef_r1')
-        for i, pv in self.__sdefVertices.items():
-            w = pv.weight.weights
-            sdefC.data[i].co = Vector(w.c).xzy * self.__scale
-            sdefR0.data[i].co = Vector(w.r0).xzy * self.__scale
-            sdefR1.data[i].co = Vector(w.r1).xzy * self.__scale
-        logging.info('Stored %d SDEF vertices', len(self.__sdefVertices))
+        indices, c, r0, r1 = self.__sdefVertices
+        for name, data in (('mmd_sdef_c', c), ('mmd_sdef_r0', r0), ('mmd_sdef_r1', r1)):
+            shape_key = self.__meshObj.shape_key_add(name=name)
+            self.__updateShapeKey(shape_key, indices, self.__convertCoArray(data).reshape(-1, 3))
+        logging.info('Stored %d SDEF vertices', len(indices))
+
+    @staticmethod
+    def __updateShapeKey(shape_key, indices, co, add=False):
+        """ Set (or add if add is True) the coordinates of a shape key at the vertex indices.
+
+        The shape key is read by one foreach_get and written by one foreach_set.
+        """
+        data = np.empty(len(shape_key.data)*3, np.float32)
+        shape_key.data.foreach_get('co', data)
+        if add:
+            np.add.at(data.reshape(-1, 3), indices, co)
+        else:
+            data.reshape(-1, 3)[indices] = co
+        shape_key.data.foreach_set('co', data)
 
     def __importTextures(self):
         pmxModel = self.__model
@@ -466,26 +515,48 @@ class PMXImporter:
                     b_bone.lock_location = [True, True, True]
                     b_bone.lock_scale = [True, True, True]
 
+    @staticmethod
+    def __vectorArray(vectors, scale=1.0):
+        """ Convert pmx vectors to a (n, 3) float32 array of swizzled, scaled blender vectors.
+        """
+        return np.array(vectors, np.float32).reshape(-1, 3)[:, (0, 2, 1)] * np.float32(scale)
+
     def __importRigids(self):
         start_time = time.time()
         self.__rigidTable = {}
         rigid_pool = self.__rig.createRigidBodyPool(len(self.__model.rigids))
-        for i, (rigid, rigid_obj) in enumerate(zip(self.__model.rigids, rigid_pool)):
-            loc = Vector(rigid.location).xzy * self.__scale
-            rot = Vector(rigid.rotation).xzy * -1
-            size = Vector(rigid.size).xzy if rigid.type == pmx.Rigid.TYPE_BOX else Vector(rigid.size)
+        self.__setRigidBodies(rigid_pool, range(len(rigid_pool)))
+        logging.debug('Finished importing rigid bodies in %f seconds.', time.time() - start_time)
 
+    def __setRigidBodies(self, rigid_objs, indices):
+        """ Set up the rigid body objects by the pmx rigid bodies at indices.
+        """
+        rigids = self.__model.rigids
+
+        # convert the transforms of all rigid bodies at once
+        locations = self.__vectorArray([r.location for r in rigids], self.__scale).tolist()
+        rotations = self.__vectorArray([r.rotation for r in rigids], -1).tolist()
+        sizes = np.array([r.size for r in rigids], np.float32).reshape(-1, 3)
+        is_box = np.array([r.type == pmx.Rigid.TYPE_BOX for r in rigids], dtype=bool)
+        sizes[is_box] = sizes[is_box][:, (0, 2, 1)]
+        sizes = (sizes * np.float32(self.__scale)).tolist()
+        masks = np.array([r.collision_group_mask for r in rigids], np.int64).reshape(-1, 1)
+        collision_group_masks = ((masks >> np.arange(16)) & 1 == 0).tolist()
+
+        for i, rigid_obj in zip(indices, rigid_objs):
+            rigid = rigids[i]
             obj = self.__rig.createRigidBody(
                 obj = rigid_obj,
                 name = rigid.name,
                 name_e = rigid.name_e,
+                obj_name = MoveObject.get_indexed_name(rigid.name, i),
                 shape_type = rigid.type,
                 dynamics_type = rigid.mode,
-                location = loc,
-                rotation = rot,
-                size = size * self.__scale,
+                location = locations[i],
+                rotation = rotations[i],
+                size = sizes[i],
                 collision_group_number = rigid.collision_group_number,
-                collision_group_mask = [rigid.collision_group_mask & (1<<i) == 0 for i in range(16)],
+                collision_group_mask = collision_group_masks[i],
                 arm_obj = self.__armObj,
                 mass=rigid.mass,
                 friction = rigid.friction,
@@ -495,35 +566,42 @@ class PMXImporter:
                 bone = None if rigid.bone == -1 or rigid.bone is None else self.__boneTable[rigid.bone].name,
                 )
             obj.hide = True
-            MoveObject.set_index(obj, i)
             self.__rigidTable[i] = obj
 
-        logging.debug('Finished importing rigid bodies in %f seconds.', time.time() - start_time)
-
     def __importJoints(self):
         start_time = time.time()
-        joint_pool = self.__rig.createJointPool(len(self.__model.joints))
-        for i, (joint, joint_obj) in enumerate(zip(self.__model.joints, joint_pool)):
-            loc = Vector(joint.location).xzy * self.__scale
-            rot = Vector(joint.rotation).xzy * -1
-
+        joints = self.__model.joints
+        joint_pool = self.__rig.createJointPool(len(joints))
+
+        # convert the transforms and limits of all joints at once
+        vectorArray = self.__vectorArray
+        locations = vectorArray([j.location for j in joints], self.__scale).tolist()
+        rotations = vectorArray([j.rotation for j in joints], -1).tolist()
+        maximum_locations = vectorArray([j.maximum_location for j in joints], self.__scale).tolist()
+        minimum_locations = vectorArray([j.minimum_location for j in joints], self.__scale).tolist()
+        maximum_rotations = vectorArray([j.minimum_rotation for j in joints], -1).tolist()
+        minimum_rotations = vectorArray([j.maximum_rotation for j in joints], -1).tolist()
+        springs_linear = vectorArray([j.spring_constant for j in joints]).tolist()
+        springs_angular = vectorArray([j.spring_rotation_constant for j in joints]).tolist()
+
+        for i, (joint, joint_obj) in enumerate(zip(joints, joint_pool)):
             obj = self.__rig.createJoint(
                 obj = joint_obj,
                 name = joint.name,
                 name_e = joint.name_e,
-                location = loc,
-                rotation = rot,
+                obj_name = MoveObject.get_indexed_name('J.' + joint.name, i),
+                location = locations[i],
+                rotation = rotations[i],
                 rigid_a = self.__rigidTable.get(joint.src_rigid, None),
                 rigid_b = self.__rigidTable.get(joint.dest_rigid, None),
-                maximum_location = Vector(joint.maximum_location).xzy * self.__scale,
-                minimum_location = Vector(joint.minimum_location).xzy * self.__scale,
-                maximum_rotation = Vector(joint.minimum_rotation).xzy * -1,
-                minimum_rotation = Vector(joint.maximum_rotation).xzy * -1,
-                spring_linear = Vector(joint.spring_constant).xzy,
-                spring_angular = Vector(joint.spring_rotation_constant).xzy,
+                maximum_location = maximum_locations[i],
+                minimum_location = minimum_locations[i],
+                maximum_rotation = maximum_rotations[i],
+                minimum_rotation = minimum_rotations[i],
+                spring_linear = springs_linear[i],
+                spring_angular = springs_angular[i],
                 )
             obj.hide = True
-            MoveObject.set_index(obj, i)
 
         logging.debug('Finished importing joints in %f seconds.', time.time() - start_time)
 
@@ -537,21 +615,7 @@ class PMXImporter:
             mat = bpy.data.materials.new(name=self.__safe_name(i.name, max_length=50))
             self.__materialTable.append(mat)
             mmd_mat = mat.mmd_material
-            mmd_mat.name_j = i.name
-            mmd_mat.name_e = i.name_e
-            mmd_mat.ambient_color = i.ambient
-            mmd_mat.diffuse_color = i.diffuse[0:3]
-            mmd_mat.alpha = i.diffuse[3]
-            mmd_mat.specular_color = i.specular
-            mmd_mat.shininess = i.shininess
-            mmd_mat.is_double_sided = i.is_double_sided
-            mmd_mat.enabled_drop_shadow = i.enabled_drop_shadow
-            mmd_mat.enabled_self_shadow_map = i.enabled_self_shadow_map
-            mmd_mat.enabled_self_shadow = i.enabled_self_shadow
-            mmd_mat.enabled_toon_edge = i.enabled_toon_edge
-            mmd_mat.edge_color = i.edge_color
-            mmd_mat.edge_weight = i.edge_size
-            mmd_mat.comment = i.comment
+            self.__setMaterialParameters(mmd_mat, i)
 
             self.__materialFaceCountTable.append(int(i.vertex_count/3))
             self.__meshObj.data.materials.append(mat)
@@ -580,47 +644,69 @@ class PMXImporter:
                     texture_slot.uv_layer = 'UV1' # for SubTexture
             mmd_mat.sphere_texture_type = str(i.sphere_texture_mode)
 
+    @staticmethod
+    def __setMaterialParameters(mmd_mat, pmx_mat):
+        mmd_mat.name_j = pmx_mat.name
+        mmd_mat.name_e = pmx_mat.name_e
+        mmd_mat.ambient_color = pmx_mat.ambient
+        mmd_mat.diffuse_color = pmx_mat.diffuse[0:3]
+        mmd_mat.alpha = pmx_mat.diffuse[3]
+        mmd_mat.specular_color = pmx_mat.specular
+        mmd_mat.shininess = pmx_mat.shininess
+        mmd_mat.is_double_sided = pmx_mat.is_double_sided
+        mmd_mat.enabled_drop_shadow = pmx_mat.enabled_drop_shadow
+        mmd_mat.enabled_self_shadow_map = pmx_mat.enabled_self_shadow_map
+        mmd_mat.enabled_self_shadow = pmx_mat.enabled_self_shadow
+        mmd_mat.enabled_toon_edge = pmx_mat.enabled_toon_edge
+        mmd_mat.edge_color = pmx_mat.edge_color
+        mmd_mat.edge_weight = pmx_mat.edge_size
+        mmd_mat.comment = pmx_mat.comment
+
     def __importFaces(self):
         pmxModel = self.__model
         mesh = self.__meshObj.data
         vertex_map = self.__vertex_map
 
-        loop_indices_orig = tuple(i for f in pmxModel.faces for i in f)
-        loop_indices = tuple(vertex_map[i][1] for i in loop_indices_orig) if vertex_map else loop_indices_orig
-        material_indices = tuple(i for i, c in enumerate(self.__materialFaceCountTable) for x in range(c))
+        faces = self.__arrays.faces
+        face_count = len(faces)
+        loop_indices_orig = np.ascontiguousarray(faces, dtype=np.int32).ravel()
+        loop_indices = vertex_map[loop_indices_orig, 1] if vertex_map is not None else loop_indices_orig
+        face_count_table = self.__materialFaceCountTable
+        material_indices = np.repeat(np.arange(len(face_count_table), dtype=np.int32), face_count_table)
 
-        mesh.loops.add(len(pmxModel.faces)*3)
+        mesh.loops.add(face_count*3)
         mesh.loops.foreach_set('vertex_index', loop_indices)
 
-        mesh.polygons.add(len(pmxModel.faces))
-        mesh.polygons.foreach_set('loop_start', tuple(range(0, len(mesh.loops), 3)))
-        mesh.polygons.foreach_set('loop_total', (3,)*len(pmxModel.faces))
-        mesh.polygons.foreach_set('use_smooth', (True,)*len(pmxModel.faces))
+        mesh.polygons.add(face_count)
+        mesh.polygons.foreach_set('loop_start', np.arange(0, face_count*3, 3, dtype=np.int32))
+        mesh.polygons.foreach_set('loop_total', np.full(face_count, 3, dtype=np.int32))
+        mesh.polygons.foreach_set('use_smooth', np.ones(face_count, dtype=bool))
         mesh.polygons.foreach_set('material_index', material_indices)
 
         uv_textures, uv_layers = getattr(mesh, 'uv_textures', mesh.uv_layers), mesh.uv_layers
         uv_tex = uv_textures.new()
         uv_layer = uv_layers[uv_tex.name]
-        uv_table = {vi:self.flipUV_V(v.uv) for vi, v in enumerate(pmxModel.vertices)}
-        uv_layer.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in uv_table[i]))
+        uv_table = self.__flipUV_V_array(self.__arrays.vertices.uv)
+        uv_layer.data.foreach_set('uv', uv_table[loop_indices_orig].astype(np.float32).ravel())
 
         if hasattr(mesh, 'uv_textures'):
-            for bf, mi in zip(uv_tex.data, material_indices):
+            for bf, mi in zip(uv_tex.data, material_indices.tolist()):
                 bf.image = self.__imageTable.get(mi, None)
 
         if pmxModel.header and pmxModel.header.additional_uvs:
             logging.info('Importing %d additional uvs', pmxModel.header.additional_uvs)
             zw_data_map = collections.OrderedDict()
-            split_uvzw = lambda uvi: (self.flipUV_V(uvi[:2]), uvi[2:])
+            additional_uvs = self.__arrays.vertices.additional_uvs
             for i in range(pmxModel.header.additional_uvs):
                 add_uv = uv_layers[uv_textures.new(name='UV'+str(i+1)).name]
                 logging.info(' - %s...(uv channels)', add_uv.name)
-                uv_table = {vi:split_uvzw(v.additional_uvs[i]) for vi, v in enumerate(pmxModel.vertices)}
-                add_uv.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in uv_table[i][0]))
-                if not any(any(s[1]) for s in uv_table.values()):
+                uvzw = additional_uvs[:, i]
+                uv_table = self.__flipUV_V_array(uvzw[:, :2])
+                add_uv.data.foreach_set('uv', uv_table[loop_indices_orig].astype(np.float32).ravel())
+                if not np.any(uvzw[:, 2:]):
                     logging.info('\t- zw are all zeros: %s', add_uv.name)
                 else:
-                    zw_data_map['_'+add_uv.name] = {k:self.flipUV_V(v[1]) for k, v in uv_table.items()}
+                    zw_data_map['_'+add_uv.name] = uvzw[:, 2:]
             for name, zw_table in zw_data_map.items():
                 logging.info(' - %s...(zw channels of %s)', name, name[1:])
                 add_zw = uv_textures.new(name=name)
@@ -628,21 +714,25 @@ class PMXImporter:
                     logging.warning('\t* Lost zw channels')
                     continue
                 add_zw = uv_layers[add_zw.name]
-                add_zw.data.foreach_set('uv', tuple(v for i in loop_indices_orig for v in zw_table[i]))
+                zw_table = self.__flipUV_V_array(zw_table)
+                add_zw.data.foreach_set('uv', zw_table[loop_indices_orig].astype(np.float32).ravel())
 
     def __importVertexMorphs(self):
         mmd_root = self.__root.mmd_root
         categories = self.CATEGORIES
         self.__createBasisShapeKey()
-        for morph in (x for x in self.__model.morphs if isinstance(x, pmx.VertexMorph)):
+        scale = np.float32(self.__scale)
+        has_vertices = len(self.__meshObj.data.vertices) > 0 # the offsets are skipped without the mesh
+        for morph, offsets in zip(self.__model.morphs, self.__arrays.morphs):
+            if not isinstance(morph, pmx.VertexMorph):
+                continue
             shapeKey = self.__meshObj.shape_key_add(name=morph.name)
             vtx_morph = mmd_root.vertex_morphs.add()
             vtx_morph.name = morph.name
             vtx_morph.name_e = morph.name_e
             vtx_morph.category = categories.get(morph.category, 'OTHER')
-            for md in morph.offsets:
-                shapeKeyPoint = shapeKey.data[md.index]
-                shapeKeyPoint.co += Vector(md.offset).xzy * self.__scale
+            if len(offsets) and has_vertices:
+                self.__updateShapeKey(shapeKey, offsets.index, offsets.offset[:, (0, 2, 1)] * scale, add=True)
 
     def __importMaterialMorphs(self):
         mmd_root = self.__root.mmd_root
@@ -759,12 +849,11 @@ class PMXImporter:
             logging.info(' * No support for custom normals!!')
             return
         logging.info('Setting custom normals...')
-        if self.__vertex_map:
-            verts, faces = self.__model.vertices, self.__model.faces
-            custom_normals = [(Vector(verts[i].normal).xzy).normalized() for f in faces for i in f]
-            mesh.normals_split_custom_set(custom_normals)
+        custom_normals = self.__convertNormalArray(self.__arrays.vertices.normal)
+        if self.__vertex_map is not None:
+            loop_indices_orig = np.ascontiguousarray(self.__arrays.faces, dtype=np.int32).ravel()
+            mesh.normals_split_custom_set(custom_normals[loop_indices_orig])
         else:
-            custom_normals = [(Vector(v.normal).xzy).normalized() for v in self.__model.vertices]
             mesh.normals_split_custom_set_from_vertices(custom_normals)
         mesh.use_auto_smooth = True
         logging.info('   - Done!!')
@@ -786,16 +875,30 @@ class PMXImporter:
             m.name = utils.uniqueName(m.name or 'Morph', used_names)
             used_names.add(m.name)
 
-    def execute(self, **args):
+    def __loadModel(self, args):
+        types = args.get('types', set())
         if 'pmx' in args:
             self.__model = args['pmx']
         else:
-            self.__model = pmx.load(args['filepath'])
+            sections = {x for t in types for x in self.SECTIONS.get(t, ())}
+            self.__model = pmx.load(args['filepath'], use_mmap=args.get('use_mmap', False), sections=sections)
         self.__fixRepeatedMorphName()
 
+    def __cleanModel(self, args):
+        types = args.get('types', set())
+        if args.get('pmx_cleaned', False): # cleaned by the loader with the same options
+            self.__vertex_map = args.get('vertex_map', None)
+        else:
+            if args.get('clean_model', False):
+                _PMXCleaner.clean(self.__model, 'MORPHS' not in types)
+            if args.get('remove_doubles', False):
+                self.__vertex_map = _PMXCleaner.remove_doubles(self.__model, 'MORPHS' not in types)
+        self.__arrays = pmx.ModelArrays(self.__model)
+
+    def execute(self, **args):
         types = args.get('types', set())
-        clean_model = args.get('clean_model', False)
-        remove_doubles = args.get('remove_doubles', False)
+        self.__loadModel(args)
+
         self.__scale = args.get('scale', 1.0)
         self.__use_mipmap = args.get('use_mipmap', True)
         self.__sph_blend_factor = args.get('sph_blend_factor', 1.0)
@@ -816,10 +919,7 @@ class PMXImporter:
         self.__createObjects()
 
         if 'MESH' in types:
-            if clean_model:
-                _PMXCleaner.clean(self.__model, 'MORPHS' not in types)
-            if remove_doubles:
-                self.__vertex_map = _PMXCleaner.remove_doubles(self.__model, 'MORPHS' not in types)
+            self.__cleanModel(args)
             self.__createMeshObject()
             self.__importVertices()
             self.__importMaterials()
@@ -853,6 +953,8 @@ class PMXImporter:
             self.__rig.initialDisplayFrames()
 
         if 'MORPHS' in types:
+            if self.__arrays is None: # the model is not cleaned without the mesh
+                self.__arrays = pmx.ModelArrays(self.__model)
             self.__importGroupMorphs()
             self.__importVertexMorphs()
             self.__importBoneMorphs()
@@ -871,39 +973,221 @@ class PMXImporter:
         self.__targetScene.active_object = root
         root.select = True
 
+        if args.get('store_digests', False): # hashing the model data takes time, only for reimport()
+            if self.__arrays is None:
+                self.__arrays = pmx.ModelArrays(self.__model)
+            root[self.DIGESTS_KEY] = self.__modelDigests(args)
+
         logging.info(' Finished importing the model in %f seconds.', time.time() - start_time)
         logging.info('----------------------------------------')
         logging.info(' mmd_tools.import_pmx module')
         logging.info('****************************************')
 
 
+    #********************************************
+    # Re-import
+    #********************************************
+
+    DIGESTS_KEY = 'mmd_tools_pmx_digests'
+    # sections which can be updated in place, the others require a full import
+    UPDATABLE_SECTIONS = {'vertices', 'normals', 'materials', 'morphs', 'rigids'}
+
+    def __modelDigests(self, args):
+        """ Get the digests of the imported model data by section.
+
+        The materials, morphs and rigids sections are lists of digests of each item.
+        """
+        model, arrays = self.__model, self.__arrays
+        vertices = arrays.vertices
+        texture_fields = ('texture', 'sphere_texture', 'sphere_texture_mode', 'is_shared_toon_texture', 'toon_texture')
+        material_fields = texture_fields + ('vertex_count',)
+        morph_offsets = [(x.index, x.offset) if x is not None else m.offsets for m, x in zip(model.morphs, arrays.morphs)]
+        return {
+            'options': _digest(sorted(args.get('types', ())), args.get('scale', 1.0), args.get('clean_model', False), args.get('remove_doubles', False)),
+            'vertices': _digest(vertices.co),
+            'normals': _digest(vertices.normal),
+            'mesh': _digest(arrays.faces, vertices.uv, vertices.additional_uvs, vertices.weight_type, vertices.bones,
+                            vertices.weights, vertices.sdef_c, vertices.sdef_r0, vertices.sdef_r1, vertices.edge_scale,
+                            self.__vertex_map, [m.vertex_count for m in model.materials]),
+            'textures': _digest(model.textures, [[getattr(m, k) for k in texture_fields] for m in model.materials]),
+            'materials': [_digest(sorted((k, v) for k, v in vars(m).items() if k not in material_fields)) for m in model.materials],
+            'bones': _digest(model.bones),
+            'bone_names': [b.mmd_bone.name_j for b in self.__boneTable],
+            'morph_list': _digest([(type(m).__name__, m.name, m.name_e, m.category) for m in model.morphs]),
+            'morphs': [_digest(x) for x in morph_offsets],
+            'display': _digest(model.display),
+            'rigids': [_digest(r) for r in model.rigids],
+            'joints': _digest(model.joints),
+            }
+
+    def reimport(self, root, **args):
+        """ Update a model imported from a pmx file in place with the changed data of the pmx file.
+
+        The model data is compared with the digests stored at the import by section,
+        the model has to be imported with store_digests=True.
+        Changed vertex positions and normals, offsets of vertex morphs, material
+        parameters and rigid body parameters are updated, which takes a fraction of
+        a full import for small changes. The other sections have to be unchanged.
+
+        @param root the root object of the imported model
+        @param args the arguments of execute(), which have to be the same as the import
+        @return a set of the names of the updated sections
+        """
+        digests = root.get(self.DIGESTS_KEY, None)
+        if digests is None:
+            raise ValueError('The model "%s" has no pmx import data, a full import with "Store Update Data" is required'%root.name)
+        digests = digests.to_dict()
+
+        start_time = time.time()
+        self.__loadModel(args)
+        self.__scale = args.get('scale', 1.0)
+        self.__cleanModel(args)
+
+        self.__root = root
+        self.__rig = mmd_model.Model(root)
+        self.__armObj = self.__rig.armature()
+        self.__meshObj = self.__rig.firstMesh()
+        pose_bones = {b.mmd_bone.name_j:b for b in self.__armObj.pose.bones} if self.__armObj else {}
+        bone_names = digests.get('bone_names', ())
+        missing = [name for name in bone_names if name not in pose_bones]
+        if missing:
+            raise ValueError('The bones %s of the model "%s" are missing, a full import is required'%(', '.join(missing[:5]), root.name))
+        self.__boneTable = [pose_bones[name] for name in bone_names]
+
+        new_digests = self.__modelDigests(args)
+        changes = {k for k, v in new_digests.items() if digests.get(k, None) != v}
+        for k in ('materials', 'morphs', 'rigids'):
+            if len(new_digests[k]) != len(digests.get(k, ())):
+                changes.add(k+' count')
+        changed_morphs = [i for i, (old, new) in enumerate(zip(digests.get('morphs', ()), new_digests['morphs'])) if old != new]
+        if any(not isinstance(self.__model.morphs[i], pmx.VertexMorph) for i in changed_morphs):
+            changes.add('non-vertex morphs')
+        unsupported = changes - self.UPDATABLE_SECTIONS
+        if unsupported:
+            raise ValueError('Can not update %s of the model "%s" in place, a full import is required'%(', '.join(sorted(unsupported)), root.name))
+
+        if changes & {'vertices', 'normals', 'morphs'} and self.__meshObj is None:
+            raise ValueError('The model "%s" has no mesh'%root.name)
+        if 'vertices' in changes:
+            self.__updateVertices()
+        if 'normals' in changes:
+            self.__assignCustomNormals()
+        if 'morphs' in changes:
+            self.__updateVertexMorphs(changed_morphs)
+        if 'materials' in changes:
+            self.__updateMaterials([i for i, (old, new) in enumerate(zip(digests['materials'], new_digests['materials'])) if old != new])
+        if 'rigids' in changes:
+            self.__updateRigids([i for i, (old, new) in enumerate(zip(digests['rigids'], new_digests['rigids'])) if old != new])
+
+        root[self.DIGESTS_KEY] = new_digests
+        logging.info(' Updated %s of the model in %f seconds.', ', '.join(sorted(changes)) or 'nothing', time.time() - start_time)
+        return changes
+
+    def __updateVertices(self):
+        mesh = self.__meshObj.data
+        co = self.__convertCoArray(self.__meshVertexArrays().co)
+        if len(co) != len(mesh.vertices)*3:
+            raise ValueError('The vertex count of the mesh "%s" was changed'%mesh.name)
+        if mesh.shape_keys:
+            # keep the offsets of the other shape keys, the SDEF data is not a relative position
+            basis = mesh.shape_keys.reference_key
+            delta = np.empty_like(co)
+            basis.data.foreach_get('co', delta)
+            delta = co - delta
+            data = np.empty_like(co)
+            for key in mesh.shape_keys.key_blocks:
+                if key == basis:
+                    key.data.foreach_set('co', co)
+                elif not key.name.startswith('mmd_sdef_'):
+                    key.data.foreach_get('co', data)
+                    key.data.foreach_set('co', data + delta)
+        mesh.vertices.foreach_set('co', co)
+        mesh.update()
+
+    def __updateVertexMorphs(self, indices):
+        mesh = self.__meshObj.data
+        key_blocks = mesh.shape_keys.key_blocks
+        basis = np.empty(len(mesh.vertices)*3, np.float32)
+        mesh.shape_keys.reference_key.data.foreach_get('co', basis)
+        scale = np.float32(self.__scale)
+        for i in indices:
+            morph, offsets = self.__model.morphs[i], self.__arrays.morphs[i]
+            shape_key = key_blocks[morph.name]
+            shape_key.data.foreach_set('co', basis)
+            if len(offsets):
+                self.__updateShapeKey(shape_key, offsets.index, offsets.offset[:, (0, 2, 1)] * scale, add=True)
+        mesh.update()
+
+    def __updateMaterials(self, indices):
+        materials = self.__meshObj.data.materials if self.__meshObj else ()
+        if len(materials) != len(self.__model.materials):
+            raise ValueError('The materials of the model "%s" were changed'%self.__root.name)
+        for i in indices:
+            self.__setMaterialParameters(materials[i].mmd_material, self.__model.materials[i])
+
+    def __updateRigids(self, indices):
+        if self.__root.mmd_root.is_built:
+            raise ValueError('The rigid bodies of the model "%s" are built, clean the rig first'%self.__root.name)
+        rigid_objs = sorted(self.__rig.rigidBodies(), key=lambda x: x.name)
+        if len(rigid_objs) != len(self.__model.rigids):
+            raise ValueError('The rigid bodies of the model "%s" were changed'%self.__root.name)
+        self.__rigidTable = {}
+        self.__setRigidBodies([rigid_objs[i] for i in indices], indices)
+
+
+def _digest(*values):
+    """ Get a digest of values of pmx data: numbers, strings, arrays, sequences and pmx objects.
+    """
+    h = hashlib.sha1()
+    def update(value):
+        if isinstance(value, np.ndarray):
+            # the same values are equal regardless of the stored integer/float types
+            value = value.astype(np.int64 if value.dtype.kind in 'biu' else np.float64)
+            h.update(repr(value.shape).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple, collections.abc.Sequence)) and not isinstance(value, str):
+            h.update(b'[')
+            for x in value:
+                update(x)
+            h.update(b']')
+        elif hasattr(value, '__dict__'):
+            h.update(type(value).__name__.encode())
+            update(sorted(vars(value).items()))
+        else:
+            h.update(repr(value).encode())
+    update(values)
+    return h.hexdigest()
+
+
 class _PMXCleaner:
+    """ Remove unused vertices and duplicated faces/vertices of a pmx model.
+
+    The vertex, face and morph data is compared as columnar arrays. The values
+    are compared like Python floats, so 0.0 equals -0.0 and NaN equals nothing.
+    """
     @classmethod
     def clean(cls, pmx_model, mesh_only):
         logging.info('Cleaning PMX data...')
-        pmx_faces = pmx_model.faces
         pmx_vertices = pmx_model.vertices
 
         # clean face/vertex
-        cls.__clean_pmx_faces(pmx_faces, pmx_model.materials, lambda f: frozenset(f))
+        faces = cls.__clean_pmx_faces(pmx_model)
 
-        index_map = {v:v for f in pmx_faces for v in f}
-        is_index_clean = len(index_map) == len(pmx_vertices)
+        used_indices = np.unique(faces)
+        is_index_clean = len(used_indices) == len(pmx_vertices)
         if is_index_clean:
             logging.info('   (vertices is clean)')
         else:
-            new_vertex_count = 0
-            for v in sorted(index_map):
-                if v != new_vertex_count:
-                    pmx_vertices[new_vertex_count] = pmx_vertices[v]
-                    index_map[v] = new_vertex_count
-                new_vertex_count += 1
+            new_vertex_count = len(used_indices)
             logging.warning('   - removed %d vertices', len(pmx_vertices)-new_vertex_count)
-            del pmx_vertices[new_vertex_count:]
+            pmx_model.vertices = pmx.take_items(pmx_vertices, used_indices)
 
             # update vertex indices of faces
-            for f in pmx_faces:
-                f[:] = [index_map[v] for v in f]
+            index_map = np.full(len(pmx_vertices), -1, np.int64)
+            index_map[used_indices] = np.arange(new_vertex_count)
+            face_data = pmx.FaceArrays()
+            face_data.indices = index_map[faces].astype(np.int32)
+            pmx_model.faces = pmx.from_arrays(face_data)
 
         if mesh_only:
             logging.info('   - Done (mesh only)!!')
@@ -911,95 +1195,153 @@ class _PMXCleaner:
 
         if not is_index_clean:
             # clean vertex/uv morphs
-            def __update_index(x):
-                x.index = index_map.get(x.index, None)
-                return x.index is not None
+            def __update_index(indices):
+                valid = (indices >= 0) & (indices < len(index_map))
+                return np.where(valid, index_map[np.where(valid, indices, 0)], -1)
             cls.__clean_pmx_morphs(pmx_model.morphs, __update_index)
         logging.info('   - Done!!')
 
     @classmethod
     def remove_doubles(cls, pmx_model, mesh_only):
+        """ Merge the vertices of equal coordinates and equal offsets of vertex/uv morphs.
+
+        @return a (vertex count, 2) int32 array of (pmx index of the merged vertex, blender index),
+            or None if there are no doubles
+        """
         logging.info('Removing doubles...')
-        pmx_vertices = pmx_model.vertices
+        vertices = pmx.columnar(pmx_model.vertices, pmx.VertexArrays.fromVertices)
+        vertex_count = len(vertices)
 
-        vertex_map = [None] * len(pmx_vertices)
-        # gather vertex data
-        for i, v in enumerate(pmx_vertices):
-            vertex_map[i] = [tuple(v.co)]
+        # gather vertex data: the coordinates followed by the offsets of each vertex in morph order
+        morph_indices, morph_offsets = [], []
         if not mesh_only:
             for m in pmx_model.morphs:
                 if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
                     continue
-                for x in m.offsets:
-                    vertex_map[x.index].append(tuple(x.offset))
+                size = 3 if isinstance(m, pmx.VertexMorph) else 4
+                offsets = pmx.columnar(m.offsets, pmx.MorphOffsetArrays.fromOffsets, size)
+                rows = np.zeros((len(offsets), 5), np.float64)
+                rows[:, 0] = size # offsets of different sizes never match
+                rows[:, 1:size+1] = offsets.offset
+                morph_indices.append(np.asarray(offsets.index, dtype=np.int64))
+                morph_offsets.append(rows)
+        if morph_indices:
+            morph_indices = np.arange(vertex_count)[np.concatenate(morph_indices)] # python index semantics
+            offset_ids = cls.__row_ids(np.concatenate(morph_offsets))
+        else:
+            morph_indices = offset_ids = np.zeros(0, np.int64)
+
         # generate vertex merging table
-        keys = {}
-        for i, v in enumerate(vertex_map):
-            k = tuple(v)
-            if k in keys:
-                vertex_map[i] = keys[k] # merge pmx_vertices[i] to pmx_vertices[keys[k][0]]
-            else:
-                vertex_map[i] = keys[k] = (i, len(keys)) # (pmx index, blender index)
-        counts = len(vertex_map) - len(keys)
-        keys.clear()
+        offset_counts = np.bincount(morph_indices, minlength=vertex_count)
+        keys = cls.__pair_ids(cls.__row_ids(vertices.co), offset_counts)
+        order = np.argsort(morph_indices, kind='mergesort')
+        morph_indices, offset_ids = morph_indices[order], offset_ids[order]
+        positions = np.arange(len(morph_indices)) - np.repeat(np.cumsum(offset_counts) - offset_counts, offset_counts)
+        order = np.argsort(positions, kind='mergesort')
+        start = 0
+        for count in np.bincount(positions).tolist() if len(positions) else ():
+            # refine the keys of vertices which have an offset at this position
+            x = order[start:start+count]
+            start += count
+            indices = morph_indices[x]
+            keys[indices] = cls.__pair_ids(keys[indices], offset_ids[x]) + keys.max() + 1
+        _, first_indices, keys = np.unique(keys, return_index=True, return_inverse=True)
+        keys = keys.ravel()
+        counts = vertex_count - len(first_indices)
         if counts:
             logging.warning('   - %d vertices will be removed', counts)
         else:
             logging.info('   - Done (no changes)!!')
             return None
+        new_indices = np.empty(len(first_indices), np.int64)
+        new_indices[np.argsort(first_indices)] = np.arange(len(first_indices))
+        vertex_map = np.column_stack((first_indices[keys], new_indices[keys])).astype(np.int32) # (pmx index, blender index)
 
         # clean face
-        #face_key_func = lambda f: frozenset(vertex_map[x][0] for x in f)
-        face_key_func = lambda f: frozenset({vertex_map[x][0]:tuple(pmx_vertices[x].uv) for x in f}.items())
-        cls.__clean_pmx_faces(pmx_model.faces, pmx_model.materials, face_key_func)
+        cls.__clean_pmx_faces(pmx_model, vertex_map[:, 0], cls.__row_ids(vertices.uv))
 
         if mesh_only:
             logging.info('   - Done (mesh only)!!')
         else:
             # clean vertex/uv morphs
-            def __update_index(x):
-                indices = vertex_map[x.index]
-                x.index = indices[1] if x.index == indices[0] else None
-                return x.index is not None
+            def __update_index(indices):
+                merged = vertex_map[indices]
+                return np.where(merged[:, 0] == indices, merged[:, 1], -1)
             cls.__clean_pmx_morphs(pmx_model.morphs, __update_index)
             logging.info('   - Done!!')
         return vertex_map
 
+    @staticmethod
+    def __row_ids(rows):
+        """ Get an id of each row of a 2d float array, equal rows get the same id.
+        """
+        rows = np.ascontiguousarray(rows, dtype=np.float64) + 0.0 # -0.0 to 0.0
+        keys = rows.view(np.dtype((np.void, rows.itemsize*rows.shape[1]))).ravel()
+        ids = np.unique(keys, return_inverse=True)[1].ravel().astype(np.int64)
+        nan_rows = np.flatnonzero(np.isnan(rows).any(axis=1))
+        if len(nan_rows):
+            ids[nan_rows] = len(ids) + np.arange(len(nan_rows))
+        return ids
+
+    @staticmethod
+    def __pair_ids(a, b):
+        """ Get an id of each (a, b) pair of two non-negative integer arrays, equal pairs get the same id.
+        """
+        if len(a) < 1:
+            return np.zeros(0, np.int64)
+        return np.unique(a * (int(b.max()) + 1) + b, return_inverse=True)[1].ravel().astype(np.int64)
 
     @staticmethod
-    def __clean_pmx_faces(pmx_faces, pmx_materials, face_key_func):
-        new_face_count = 0
-        face_iter = iter(pmx_faces)
-        for mat in pmx_materials:
-            used_faces = set()
-            new_vertex_count = 0
-            for i in range(int(mat.vertex_count/3)):
-                f = next(face_iter)
-
-                f_key = face_key_func(f)
-                if len(f_key) != 3 or f_key in used_faces:
-                    continue
-                used_faces.add(f_key)
-
-                pmx_faces[new_face_count] = list(f)
-                new_face_count += 1
-                new_vertex_count += 3
-            mat.vertex_count = new_vertex_count
-        face_iter = None
-        if new_face_count == len(pmx_faces):
+    def __clean_pmx_faces(pmx_model, merged_indices=None, uv_ids=None):
+        """ Remove degenerate faces and duplicated faces of each material.
+
+        The faces are compared by the set of (merged vertex index, uv id) of the vertices,
+        the uv ids are ignored if uv_ids is None.
+
+        @return the vertex indices of the remaining faces
+        """
+        pmx_materials = pmx_model.materials
+        faces = np.asarray(pmx.columnar(pmx_model.faces, pmx.FaceArrays.fromFaces).indices, dtype=np.int64)
+        face_counts = np.array([int(mat.vertex_count/3) for mat in pmx_materials], np.int64)
+        face_counts = np.diff(np.minimum(np.cumsum(np.append(0, face_counts)), len(faces)))
+        material_indices = np.repeat(np.arange(len(face_counts)), face_counts)
+        faces = faces[:len(material_indices)]
+
+        merged = merged_indices[faces] if merged_indices is not None else faces
+        order = (np.arange(len(faces))[:, None], np.argsort(merged, axis=1, kind='mergesort'))
+        merged = merged[order]
+        uvs = uv_ids[faces][order] if uv_ids is not None else np.zeros((len(faces), 0), np.int64)
+        valid = np.flatnonzero((merged[:, 0] != merged[:, 1]) & (merged[:, 1] != merged[:, 2]))
+        f_keys = np.column_stack((material_indices[valid], merged[valid], uvs[valid]))
+        f_keys = np.ascontiguousarray(f_keys).view(np.dtype((np.void, f_keys.itemsize*f_keys.shape[1]))).ravel()
+        used_faces = np.sort(valid[np.unique(f_keys, return_index=True)[1]])
+
+        new_face_counts = np.bincount(material_indices[used_faces], minlength=len(pmx_materials))
+        for mat, count in zip(pmx_materials, new_face_counts.tolist()):
+            mat.vertex_count = count * 3
+        if len(used_faces) == len(pmx_model.faces):
             logging.info('   (faces is clean)')
-        else:
-            logging.warning('   - removed %d faces', len(pmx_faces)-new_face_count)
-            del pmx_faces[new_face_count:]
+            return faces
+        logging.warning('   - removed %d faces', len(pmx_model.faces)-len(used_faces))
+        pmx_model.faces = pmx.take_items(pmx_model.faces, used_faces)
+        return faces[used_faces]
 
     @staticmethod
     def __clean_pmx_morphs(pmx_morphs, index_update_func):
+        """ Update the vertex indices of vertex/uv morphs by index_update_func,
+        the offsets of updated indices -1 are removed.
+        """
         for m in pmx_morphs:
             if not isinstance(m, pmx.VertexMorph) and not isinstance(m, pmx.UVMorph):
                 continue
             old_len = len(m.offsets)
-            m.offsets = [x for x in m.offsets if index_update_func(x)]
+            size = 3 if isinstance(m, pmx.VertexMorph) else 4
+            offsets = pmx.columnar(m.offsets, pmx.MorphOffsetArrays.fromOffsets, size)
+            indices = index_update_func(np.asarray(offsets.index, dtype=np.int64))
+            used_offsets = np.flatnonzero(indices >= 0)
+            offsets = offsets.take(used_offsets)
+            offsets.index = indices[used_offsets].astype(np.int32)
+            m.offsets = pmx.from_arrays(offsets)
             counts = old_len - len(m.offsets)
             if counts:
                 logging.warning('   - removed %d (of %d) offsets of "%s"', counts, old_len, m.name)
-
@@ -1,16 +1,39 @@
 # -*- coding: utf-8 -*-
 import struct
 import collections
+import mmap
+import sys
+
+import numpy as np
 
 class InvalidFileError(Exception):
     pass
 
+class NameCache(dict):
+    """ A cache of converted names. The cache is cleared when it reaches the size limit.
+    """
+    def __init__(self, convert, size_limit=65536):
+        dict.__init__(self)
+        self.__convert = convert
+        self.__size_limit = size_limit
+
+    def __missing__(self, name):
+        if len(self) >= self.__size_limit:
+            self.clear()
+        value = self[name] = self.__convert(name)
+        return value
+
 ## vmd仕様の文字列をstringに変換
+_decoded_names = NameCache(lambda byteString: sys.intern(byteString.split(b'\x00')[0].decode('shift_jis', errors='replace')))
+_encoded_names = NameCache(lambda string: string.encode('shift_jis', errors='replace'))
+
 def _toShiftJisString(byteString):
-    return byteString.split(b'\x00')[0].decode('shift_jis', errors='replace')
+    """ Decode a raw name. The decoded names are cached by raw name and interned.
+    """
+    return _decoded_names[byteString]
 
 def _toShiftJisBytes(string):
-    return string.encode('shift_jis', errors='replace')
+    return _encoded_names[string]
 
 
 class Header:
@@ -34,6 +57,8 @@ class Header:
 
 
 class BoneFrameKey:
+    _STRUCT = struct.Struct('<L3f4f64b')
+
     def __init__(self):
         self.frame_number = 0
         self.location = []
@@ -41,12 +66,16 @@ class BoneFrameKey:
         self.interp = []
 
     def load(self, fin):
-        self.frame_number, = struct.unpack('<L', fin.read(4))
-        self.location = list(struct.unpack('<fff', fin.read(4*3)))
-        self.rotation = list(struct.unpack('<ffff', fin.read(4*4)))
+        self.unpack(fin.read(self._STRUCT.size))
+
+    def unpack(self, buffer, offset=0):
+        values = self._STRUCT.unpack_from(buffer, offset)
+        self.frame_number = values[0]
+        self.location = list(values[1:4])
+        self.rotation = list(values[4:8])
         if not any(self.rotation):
             self.rotation = (0, 0, 0, 1)
-        self.interp = list(struct.unpack('<64b', fin.read(64)))
+        self.interp = list(values[8:])
 
     def save(self, fin):
         fin.write(struct.pack('<L', self.frame_number))
@@ -63,13 +92,17 @@ class BoneFrameKey:
 
 
 class ShapeKeyFrameKey:
+    _STRUCT = struct.Struct('<Lf')
+
     def __init__(self):
         self.frame_number = 0
         self.weight = 0.0
 
     def load(self, fin):
-        self.frame_number, = struct.unpack('<L', fin.read(4))
-        self.weight, = struct.unpack('<f', fin.read(4))
+        self.unpack(fin.read(self._STRUCT.size))
+
+    def unpack(self, buffer, offset=0):
+        self.frame_number, self.weight = self._STRUCT.unpack_from(buffer, offset)
 
     def save(self, fin):
         fin.write(struct.pack('<L', self.frame_number))
@@ -235,6 +268,197 @@ class _AnimationBase(collections.defaultdict):
                 frameKey.save(fin)
 
 
+def _group_names(raw_names):
+    """ Decode the raw names of keyframe records and group the records by name.
+
+    Returns the names in the order of appearance and the name index of each record.
+    """
+    unique_names, first_indices, inverse = np.unique(raw_names, return_index=True, return_inverse=True)
+    name_ids, ids = {}, np.empty(len(unique_names), np.int64)
+    for i in np.argsort(first_indices, kind='stable').tolist():
+        ids[i] = name_ids.setdefault(_toShiftJisString(unique_names[i]), len(name_ids))
+    return list(name_ids), ids[inverse.reshape(-1)]
+
+
+class _TrackArraysBase:
+    """ Columnar keyframe data of a bone/morph track.
+
+    Each field of RECORD is an array attribute with a row per keyframe.
+    """
+    RECORD = None
+
+    def __len__(self):
+        return len(self.frame_number)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.item(i)
+
+    def __repr__(self):
+        return '<%s frames %d>'%(self.__class__.__name__, len(self))
+
+    def item(self, index):
+        raise NotImplementedError
+
+    @classmethod
+    def fromRecords(cls, records):
+        data = cls.__new__(cls)
+        for name in cls.RECORD.names:
+            setattr(data, name, np.array(records[name], dtype=records.dtype[name].base.newbyteorder('=')))
+        return data
+
+    def records(self):
+        records = np.empty(len(self), self.RECORD)
+        for name in self.RECORD.names:
+            records[name] = getattr(self, name)
+        return records
+
+    def take(self, indices):
+        data = self.__class__.__new__(self.__class__)
+        for name in self.RECORD.names:
+            setattr(data, name, getattr(self, name)[indices])
+        return data
+
+    def sorted(self):
+        """ Get the keyframes sorted by frame number. The order of keyframes at the same frame is kept.
+        """
+        return self.take(np.argsort(self.frame_number, kind='stable'))
+
+    def window(self, first, last):
+        """ Get the keyframes in the frame range [first, last].
+        """
+        return self.take((self.frame_number >= first) & (self.frame_number <= last))
+
+    def merge(self, other):
+        """ Get the keyframes of both tracks sorted by frame number.
+
+        The keyframes of other replace the keyframes at the same frame numbers.
+        """
+        data = self.__class__.__new__(self.__class__)
+        for name in self.RECORD.names:
+            setattr(data, name, np.concatenate((getattr(self, name), getattr(other, name))))
+        data = data.sorted()
+        frame_number = data.frame_number
+        keep = np.ones(len(data), bool)
+        keep[:-1] = frame_number[1:] != frame_number[:-1]
+        return data.take(keep)
+
+
+class BoneTrackArrays(_TrackArraysBase):
+    RECORD = np.dtype([('frame_number', '<u4'), ('location', '<f4', (3,)), ('rotation', '<f4', (4,)), ('interp', 'i1', (64,))])
+
+    def __init__(self, count=0):
+        self.frame_number = np.zeros(count, np.uint32)
+        self.location = np.zeros((count, 3), np.float32)
+        self.rotation = np.zeros((count, 4), np.float32)
+        self.rotation[:, 3] = 1
+        self.interp = np.zeros((count, 64), np.int8)
+
+    def item(self, index):
+        frameKey = BoneFrameKey()
+        frameKey.frame_number = int(self.frame_number[index])
+        frameKey.location = self.location[index].tolist()
+        frameKey.rotation = self.rotation[index].tolist()
+        frameKey.interp = self.interp[index].tolist()
+        return frameKey
+
+    @classmethod
+    def fromRecords(cls, records):
+        data = super().fromRecords(records)
+        data.rotation[~data.rotation.any(axis=1)] = (0, 0, 0, 1)
+        return data
+
+    @classmethod
+    def fromFrameKeys(cls, frameKeys):
+        data = cls(len(frameKeys))
+        if len(frameKeys):
+            data.frame_number[:] = [k.frame_number for k in frameKeys]
+            data.location[:] = [k.location for k in frameKeys]
+            data.rotation[:] = [k.rotation for k in frameKeys]
+            data.interp[:] = [k.interp for k in frameKeys]
+        return data
+
+
+class ShapeKeyTrackArrays(_TrackArraysBase):
+    RECORD = np.dtype([('frame_number', '<u4'), ('weight', '<f4')])
+
+    def __init__(self, count=0):
+        self.frame_number = np.zeros(count, np.uint32)
+        self.weight = np.zeros(count, np.float32)
+
+    def item(self, index):
+        frameKey = ShapeKeyFrameKey()
+        frameKey.frame_number = int(self.frame_number[index])
+        frameKey.weight = float(self.weight[index])
+        return frameKey
+
+    @classmethod
+    def fromFrameKeys(cls, frameKeys):
+        data = cls(len(frameKeys))
+        if len(frameKeys):
+            data.frame_number[:] = [k.frame_number for k in frameKeys]
+            data.weight[:] = [k.weight for k in frameKeys]
+        return data
+
+
+class _ArrayAnimationBase(collections.OrderedDict):
+    """ Bone/morph animation of track name and columnar track data.
+
+    A section is decoded and encoded by a single numpy buffer.
+    """
+    @staticmethod
+    def trackClass():
+        raise NotImplementedError
+
+    @classmethod
+    def recordType(cls):
+        return np.dtype([('name', 'S15'), ('key', cls.trackClass().RECORD)])
+
+    def load(self, fin):
+        count, = struct.unpack('<L', fin.read(4))
+        print('loading %s... %d'%(self.__class__.__name__, count))
+        dtype = self.recordType()
+        data = fin.read(dtype.itemsize * count)
+        records = np.frombuffer(data, dtype, len(data)//dtype.itemsize)
+
+        names, name_ids = _group_names(records['name'])
+        order = np.argsort(name_ids, kind='stable')
+        bounds = np.searchsorted(name_ids[order], np.arange(len(names)+1))
+        keys = records['key'][order]
+        cls = self.trackClass()
+        for i, name in enumerate(names):
+            self[name] = cls.fromRecords(keys[bounds[i]:bounds[i+1]])
+        if len(records) < count:
+            raise struct.error('%s data is truncated'%self.__class__.__name__)
+
+    def save(self, fin):
+        count = sum([len(i) for i in self.values()])
+        fin.write(struct.pack('<L', count))
+        records = np.empty(count, self.recordType())
+        cls = self.trackClass()
+        pos = 0
+        for name, track in self.items():
+            if not isinstance(track, cls):
+                track = cls.fromFrameKeys(track)
+            end = pos + len(track)
+            records['name'][pos:end] = _toShiftJisBytes(name)
+            records['key'][pos:end] = track.records()
+            pos = end
+        fin.write(records.tobytes())
+
+
+class BoneArrayAnimation(_ArrayAnimationBase):
+    @staticmethod
+    def trackClass():
+        return BoneTrackArrays
+
+
+class ShapeKeyArrayAnimation(_ArrayAnimationBase):
+    @staticmethod
+    def trackClass():
+        return ShapeKeyTrackArrays
+
+
 class _AnimationListBase(list):
     def __init__(self):
         list.__init__(self)
@@ -312,6 +536,124 @@ class PropertyAnimation(_AnimationListBase):
         return PropertyFrameKey
 
 
+class Track:
+    """ The keyframes of a bone/morph track in a vmd file.
+
+    The keyframes are decoded from the file data on each iteration, in the order of frame numbers.
+    """
+    def __init__(self, name, frame_class, buffer, offsets):
+        self.name = name
+        self.__frame_class = frame_class
+        self.__buffer = buffer
+        self.__offsets = offsets
+
+    def __repr__(self):
+        return '<Track name %s, frames %d>'%(self.name, len(self))
+
+    def __len__(self):
+        return len(self.__offsets)
+
+    def __iter__(self):
+        cls, buffer = self.__frame_class, self.__buffer
+        for offset in self.__offsets.tolist():
+            frameKey = cls()
+            frameKey.unpack(buffer, offset)
+            yield frameKey
+
+
+class StreamReader:
+    """ Read a vmd file track by track.
+
+    Only the names and the frame numbers of bone/morph keyframes are read
+    when the file is opened, and the keyframes of a track are decoded when the
+    track is iterated. Keyframes out of frame_range (first, last) and tracks not in
+    the name lists are skipped without decoding.
+
+    The bone/morph animations are dicts of track name and Track, and the other
+    animations are loaded as vmd.File does.
+    """
+    def __init__(self, filepath, frame_range=None, bone_names=None, morph_names=None):
+        self.filepath = filepath
+        self.header = Header()
+        self.boneAnimation = collections.OrderedDict()
+        self.shapeKeyAnimation = collections.OrderedDict()
+        self.cameraAnimation = CameraAnimation()
+        self.lampAnimation = LampAnimation()
+        self.selfShadowAnimation = SelfShadowAnimation()
+        self.propertyAnimation = PropertyAnimation()
+
+        self.__frame_range = frame_range
+        with open(filepath, 'rb') as fin:
+            self.header.load(fin)
+            self.__buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            pos = fin.tell()
+            pos = self.__scanTracks(self.boneAnimation, BoneFrameKey, pos, bone_names)
+            if pos is None:
+                return
+            pos = self.__scanTracks(self.shapeKeyAnimation, ShapeKeyFrameKey, pos, morph_names)
+            if pos is None:
+                return
+            fin.seek(pos)
+            try:
+                self.cameraAnimation.load(fin)
+                self.lampAnimation.load(fin)
+                self.selfShadowAnimation.load(fin)
+                self.propertyAnimation.load(fin)
+            except struct.error:
+                pass # no valid camera/lamp data
+
+        if frame_range is not None:
+            first, last = frame_range
+            for anim in (self.cameraAnimation, self.lampAnimation, self.selfShadowAnimation, self.propertyAnimation):
+                anim[:] = [k for k in anim if first <= k.frame_number <= last]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        try:
+            self.__buffer.close()
+        except BufferError:
+            pass
+
+    def __scanTracks(self, animation, frame_class, pos, names):
+        """ Group the keyframe records of a section by track name.
+
+        Returns the position of the next section, or None if the section is truncated.
+        """
+        buffer = self.__buffer
+        if pos + 4 > len(buffer):
+            return None
+        count, = struct.unpack_from('<L', buffer, pos)
+        pos += 4
+        record_size = 15 + frame_class._STRUCT.size
+        available = min(count, (len(buffer) - pos) // record_size)
+        print('loading %s... %d'%(frame_class.__name__, count))
+
+        records = np.frombuffer(buffer, np.dtype([('name', 'S15'), ('frame_number', '<u4'), ('data', 'V%d'%(record_size-19))]), available, pos)
+        offsets = pos + 15 + record_size * np.arange(available, dtype=np.int64)
+        frame_numbers = records['frame_number']
+        if self.__frame_range is not None:
+            first, last = self.__frame_range
+            mask = (frame_numbers >= first) & (frame_numbers <= last)
+            records, offsets, frame_numbers = records[mask], offsets[mask], frame_numbers[mask]
+
+        track_names, track_ids = _group_names(records['name'])
+        order = np.lexsort((frame_numbers, track_ids))
+        offsets = offsets[order]
+        bounds = np.searchsorted(track_ids[order], np.arange(len(track_names)+1))
+        for i, name in enumerate(track_names):
+            if names is None or name in names:
+                animation[name] = Track(name, frame_class, buffer, offsets[bounds[i]:bounds[i+1]])
+
+        if available < count:
+            return None
+        return pos + record_size * count
+
+
 class File:
     def __init__(self):
         self.filepath = None
@@ -324,13 +666,19 @@ class File:
         self.propertyAnimation = None
 
     def load(self, **args):
+        """ Load a vmd file.
+
+        If use_arrays is True, the bone/morph animations are loaded as BoneArrayAnimation
+        and ShapeKeyArrayAnimation.
+        """
         path = args['filepath']
+        use_arrays = args.get('use_arrays', False)
 
         with open(path, 'rb') as fin:
             self.filepath = path
             self.header = Header()
-            self.boneAnimation = BoneAnimation()
-            self.shapeKeyAnimation = ShapeKeyAnimation()
+            self.boneAnimation = BoneArrayAnimation() if use_arrays else BoneAnimation()
+            self.shapeKeyAnimation = ShapeKeyArrayAnimation() if use_arrays else ShapeKeyAnimation()
             self.cameraAnimation = CameraAnimation()
             self.lampAnimation = LampAnimation()
             self.selfShadowAnimation = SelfShadowAnimation()
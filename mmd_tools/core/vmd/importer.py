@@ -42,18 +42,22 @@ class RenamedBoneMapper:
         self.__rename_LR_bones = rename_LR_bones
         self.__use_underscore = use_underscore
         self.__translator = translator
+        self.__bl_bone_names = vmd.NameCache(self.__rename) # shared by all armatures of an import
 
     def init(self, armObj):
         self.__pose_bones = armObj.pose.bones
         return self
 
-    def get(self, bone_name, default=None):
+    def __rename(self, bone_name):
         bl_bone_name = bone_name
         if self.__rename_LR_bones:
             bl_bone_name = utils.convertNameToLR(bl_bone_name, self.__use_underscore)
         if self.__translator:
             bl_bone_name = self.__translator.translate(bl_bone_name)
-        return self.__pose_bones.get(bl_bone_name, default)
+        return bl_bone_name
+
+    def get(self, bone_name, default=None):
+        return self.__pose_bones.get(self.__bl_bone_names[bone_name], default)
 
 
 class _InterpolationHelper:
@@ -254,9 +258,8 @@ class _FnBezier:
 
 class VMDImporter:
     def __init__(self, filepath, scale=1.0, bone_mapper=None, use_pose_mode=False,
-            convert_mmd_camera=True, convert_mmd_lamp=True, frame_margin=5, use_mirror=False):
-        self.__vmdFile = vmd.File()
-        self.__vmdFile.load(filepath=filepath)
+            convert_mmd_camera=True, convert_mmd_lamp=True, frame_margin=5, use_mirror=False, frame_range=None):
+        self.__vmdFile = vmd.StreamReader(filepath, frame_range=frame_range)
         logging.debug(str(self.__vmdFile.header))
         self.__scale = scale
         self.__convert_mmd_camera = convert_mmd_camera
@@ -266,6 +269,15 @@ class VMDImporter:
         self.__frame_margin = frame_margin + 1
         self.__mirror = use_mirror
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Release the vmd file. The motion can't be assigned after this. """
+        self.__vmdFile.close()
 
     @staticmethod
     def __minRotationDiff(prev_q, curr_q):
@@ -389,7 +401,6 @@ class VMDImporter:
             converter = self.__getBoneConverter(bone)
             prev_rot = bone_rotation if extra_frame else None
             prev_kps, indices = None, tuple(converter.convert_interpolation((0, 16, 32)))+(48,)*len(bone_rotation)
-            keyFrames.sort(key=lambda x:x.frame_number)
             for k, x, y, z, r0, r1, r2, r3 in zip(keyFrames, *fcurves):
                 frame = k.frame_number + self.__frame_margin
                 loc = converter.convert_location(_loc(k.location))
@@ -461,11 +472,11 @@ class VMDImporter:
             shapeKey = shapeKeyDict[name]
             fcurve = action.fcurves.new(data_path='key_blocks["%s"].value'%shapeKey.name)
             fcurve.keyframe_points.add(len(keyFrames))
-            keyFrames.sort(key=lambda x:x.frame_number)
+            weights = []
             for k, v in zip(keyFrames, fcurve.keyframe_points):
                 v.co = (k.frame_number+self.__frame_margin, k.weight)
                 v.interpolation = 'LINEAR'
-            weights = tuple(i.weight for i in keyFrames)
+                weights.append(k.weight)
             shapeKey.slider_min = min(shapeKey.slider_min, floor(min(weights)))
             shapeKey.slider_max = max(shapeKey.slider_max, ceil(max(weights)))
 
@@ -14,10 +14,13 @@ from bpy_extras.io_utils import ImportHelper, ExportHelper
 from mmd_tools import register_wrap
 from mmd_tools import auto_scene_setup
 from mmd_tools.utils import makePmxBoneMap
+from mmd_tools.bpyutils import addon_preferences
 from mmd_tools.core.camera import MMDCamera
 from mmd_tools.core.lamp import MMDLamp
+from mmd_tools.core.model_cache import ModelCache
 from mmd_tools.translations import DictionaryEnum
 
+import mmd_tools.core.loader as model_loader
 import mmd_tools.core.pmd.importer as pmd_importer
 import mmd_tools.core.pmx.importer as pmx_importer
 import mmd_tools.core.pmx.exporter as pmx_exporter
@@ -153,22 +156,80 @@ class ImportPmx(Operator, ImportHelper):
         description='Create a log file',
         default=False,
         )
+    store_update_data = bpy.props.BoolProperty(
+        name='Store Update Data',
+        description='Store digests of the model data to update the model in place later (hashing the model data takes extra time)',
+        default=False,
+        )
+    update_active_model = bpy.props.BoolProperty(
+        name='Update Active Model',
+        description='Update the active model in place with the changed data of the file instead of importing a new model (use the same options as the import of the model)',
+        default=False,
+        options={'SKIP_SAVE'},
+        )
 
     def execute(self, context):
+        if self.update_active_model:
+            return self._update_model(context)
         try:
             self.__translator = DictionaryEnum.get_translator(self.dictionary)
             if self.directory:
-                for f in self.files:
-                    self.filepath = os.path.join(self.directory, f.name)
-                    self._do_execute(context)
+                filepaths = [os.path.join(self.directory, f.name) for f in self.files]
             elif self.filepath:
-                self._do_execute(context)
+                filepaths = [self.filepath]
+            else:
+                filepaths = []
+            # the files are decoded in worker processes while the models are built here
+            models = model_loader.load_models(filepaths, self.types, log_level=self.log_level, cache=self._model_cache(),
+                                              clean_model=self.clean_model, remove_doubles=self.remove_doubles)
+            for filepath, model_args, error in models:
+                self.filepath = filepath
+                try:
+                    if error is not None:
+                        raise error
+                    self._do_execute(context, model_args)
+                except Exception as e: # report the error of each file and import the rest
+                    err_msg = traceback.format_exc()
+                    self.report({'ERROR'}, 'Failed to import "%s":\n%s'%(filepath, err_msg))
         except Exception as e:
             err_msg = traceback.format_exc()
             self.report({'ERROR'}, err_msg)
         return {'FINISHED'}
 
-    def _do_execute(self, context):
+    def _update_model(self, context):
+        root = mmd_model.Model.findRoot(context.active_object)
+        if root is None:
+            self.report({'ERROR'}, 'Select a MMD model to update')
+            return {'CANCELLED'}
+        if self.directory and self.files:
+            self.filepath = os.path.join(self.directory, self.files[0].name)
+
+        logger = logging.getLogger()
+        logger.setLevel(self.log_level)
+        try:
+            model_args = model_loader.load_import_args(self.filepath, self.types, self.clean_model, self.remove_doubles, cache=self._model_cache())
+            changes = pmx_importer.PMXImporter().reimport(
+                root,
+                types=self.types,
+                scale=self.scale,
+                clean_model=self.clean_model,
+                remove_doubles=self.remove_doubles,
+                **model_args
+                )
+        except ValueError as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, 'Updated %s of MMD model "%s" from "%s"'%(', '.join(sorted(changes)) or 'nothing', root.name, self.filepath))
+        return {'FINISHED'}
+
+    @staticmethod
+    def _model_cache():
+        folder = addon_preferences('model_cache_folder', '')
+        if not folder:
+            return None
+        return ModelCache(bpy.path.abspath(folder), addon_preferences('model_cache_size', 1024)*1024*1024)
+
+    def _do_execute(self, context, model_args=None):
         logger = logging.getLogger()
         logger.setLevel(self.log_level)
         if self.save_log:
@@ -176,9 +237,10 @@ class ImportPmx(Operator, ImportHelper):
             logger.addHandler(handler)
         try:
             importer_cls = pmx_importer.PMXImporter
-            if re.search('\.pmd$', self.filepath, flags=re.I):
+            if not model_args and re.search('\.pmd$', self.filepath, flags=re.I):
                 importer_cls = pmd_importer.PMDImporter
 
+            importer_args = model_args or {}
             importer_cls().execute(
                 filepath=self.filepath,
                 types=self.types,
@@ -193,6 +255,8 @@ class ImportPmx(Operator, ImportHelper):
                 use_mipmap=self.use_mipmap,
                 sph_blend_factor=self.sph_blend_factor,
                 spa_blend_factor=self.spa_blend_factor,
+                store_digests=self.store_update_data,
+                **importer_args
                 )
             self.report({'INFO'}, 'Imported MMD model from "%s"'%self.filepath)
         except Exception as e:
@@ -262,6 +326,23 @@ class ImportVmd(Operator, ImportHelper):
         description='Import the motion by using X-Axis mirror',
         default=False,
         )
+    use_frame_range = bpy.props.BoolProperty(
+        name='Limit Frame Range',
+        description='Import only the keyframes in the frame range of the motion',
+        default=False,
+        )
+    frame_start = bpy.props.IntProperty(
+        name='Start Frame',
+        description='The first frame of the motion to import',
+        min=0,
+        default=0,
+        )
+    frame_end = bpy.props.IntProperty(
+        name='End Frame',
+        description='The last frame of the motion to import',
+        min=0,
+        default=1000,
+        )
     update_scene_settings = bpy.props.BoolProperty(
         name='Update scene settings',
         description='Update frame range and frame rate (30 fps)',
@@ -285,6 +366,11 @@ class ImportVmd(Operator, ImportHelper):
         layout.prop(self, 'use_pose_mode')
         layout.prop(self, 'use_mirror')
 
+        layout.prop(self, 'use_frame_range')
+        if self.use_frame_range:
+            layout.prop(self, 'frame_start')
+            layout.prop(self, 'frame_end')
+
         layout.prop(self, 'update_scene_settings')
 
     def execute(self, context):
@@ -308,17 +394,20 @@ class ImportVmd(Operator, ImportHelper):
                 ).init
 
         start_time = time.time()
-        importer = vmd_importer.VMDImporter(
-            filepath=self.filepath,
-            scale=self.scale,
-            bone_mapper=bone_mapper,
-            use_pose_mode=self.use_pose_mode,
-            frame_margin=self.margin,
-            use_mirror=self.use_mirror,
-            )
-
-        for i in selected_objects:
-            importer.assign(i)
+        frame_range = None
+        if self.use_frame_range:
+            frame_range = (self.frame_start, max(self.frame_start, self.frame_end))
+        with vmd_importer.VMDImporter(
+                filepath=self.filepath,
+                scale=self.scale,
+                bone_mapper=bone_mapper,
+                use_pose_mode=self.use_pose_mode,
+                frame_margin=self.margin,
+                use_mirror=self.use_mirror,
+                frame_range=frame_range,
+                ) as importer:
+            for i in selected_objects:
+                importer.assign(i)
         logging.info(' Finished importing motion in %f seconds.', time.time() - start_time)
 
         if self.update_scene_settings:
@@ -451,6 +540,16 @@ class ExportPmx(Operator, ExportHelper):
                      'E.g. blush meshes'),
         default=False,
         )
+    sort_materials_by = bpy.props.EnumProperty(
+        name='Sort Materials By',
+        description='Choose the value of each material to sort materials by',
+        items=[
+            ('DISTANCE', 'Distance', 'Mean distance from the model center to the vertices of the material', 0),
+            ('DEPTH', 'Depth', 'Mean depth of the vertices of the material seen from the front, from back to front', 1),
+            ('RADIUS', 'Radius', 'Max distance from the model center to the vertices of the material', 2),
+            ],
+        default='DISTANCE',
+        )
     disable_specular = bpy.props.BoolProperty(
         name='Disable SPH/SPA',
         description='Disables all the Specular Map textures. It is required for some MME Shaders.',
@@ -541,6 +640,7 @@ class ExportPmx(Operator, ExportHelper):
                 joints=rig.joints(),
                 copy_textures=self.copy_textures,
                 sort_materials=self.sort_materials,
+                sort_materials_by=self.sort_materials_by,
                 sort_vertices=self.sort_vertices,
                 disable_specular=self.disable_specular,
                 )
@@ -25,9 +25,13 @@ class MoveObject(Operator, utils.ItemMoveOp):
 
     @classmethod
     def set_index(cls, obj, index):
-        m = cls.__PREFIX_REGEXP.match(obj.name)
-        name = m.group('name') if m else obj.name
-        obj.name = '%s_%s'%(utils.int2base(index, 36, 3), name)
+        obj.name = cls.get_indexed_name(obj.name, index)
+
+    @classmethod
+    def get_indexed_name(cls, name, index):
+        m = cls.__PREFIX_REGEXP.match(name)
+        name = m.group('name') if m else name
+        return '%s_%s'%(utils.int2base(index, 36, 3), name)
 
     @classmethod
     def get_name(cls, obj, prefix=None):
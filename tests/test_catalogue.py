@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import shutil
+import struct
+import unittest
+
+from mmd_tools.core import catalogue
+from mmd_tools.core import pmd
+from mmd_tools.core import pmx
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        self.__output_dir = os.path.join(TESTS_DIR, 'output', 'test_catalogue')
+        shutil.rmtree(self.__output_dir, ignore_errors=True)
+        os.makedirs(self.__output_dir)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    @staticmethod
+    def __str(value, size):
+        return value.encode('shift_jis').ljust(size, b'\x00')
+
+    def __create_pmd(self, name, extended=True, physics=True):
+        """ Write a pmd file with 2 IKs and 3 skin morphs, the IK chains have different lengths.
+        """
+        s = self.__str
+        data = bytearray(b'Pmd' + struct.pack('<f', 1.0) + s('model', 20) + s('comment', 256))
+        data += struct.pack('<I', 4)
+        for i in range(4):
+            data += struct.pack('<8f2H2B', float(i), 0, 0, 0, 1, 0, 0, 0, 0, 1, 100, 0)
+        data += struct.pack('<I', 6) + struct.pack('<6H', 0, 1, 2, 1, 2, 3)
+        data += struct.pack('<I', 1) + struct.pack('<4ff3f3fbBI', *([1.0]*4 + [5.0] + [0.5]*6), -1, 0, 6) + s('tex.png*sph.sph', 20)
+        data += struct.pack('<H', 4)
+        for i in range(4):
+            data += s('bone%d'%i, 20) + struct.pack('<HHBH3f', 0xffff if i == 0 else i-1, 0, 0, 0, 0, 0, float(i))
+        data += struct.pack('<H', 2)
+        for chain in (3, 1):
+            data += struct.pack('<HHBHf', 3, 2, chain, 300, 0.5) + struct.pack('<%dH'%chain, *range(chain))
+        data += struct.pack('<H', 3)
+        for i in range(3):
+            data += s('morph%d'%i, 20) + struct.pack('<IB', 2, 0 if i == 0 else 1)
+            data += struct.pack('<I3fI3f', i, 0, 1, 0, 3-i, 1, 0, 0)
+        data += struct.pack('<B', 2) + struct.pack('<2H', 1, 2) # facial display items
+        data += struct.pack('<B', 1) + s('frame', 50)
+        data += struct.pack('<I', 1) + struct.pack('<HB', 1, 1)
+        if extended:
+            data += struct.pack('<B', 1) + s('model_e', 20) + s('comment_e', 256)
+            data += s('bone_e', 20) * 4 + s('morph_e', 20) * 2 + s('frame_e', 50)
+            data += s('toon01.bmp', 100) * 10
+            if physics:
+                data += struct.pack('<I', 2)
+                for i in range(2):
+                    data += s('rigid%d'%i, 20) + struct.pack('<HBHB', 0, 1, 0xffff, 1) + struct.pack('<14f', *([0.5]*14)) + struct.pack('<B', 1)
+                data += struct.pack('<I', 1) + s('joint', 20) + struct.pack('<II', 0, 1) + struct.pack('<24f', *([0.1]*24))
+        filepath = os.path.join(self.__output_dir, name)
+        with open(filepath, 'wb') as f:
+            f.write(bytes(data))
+        return filepath
+
+    def __create_pmx(self, name):
+        model = pmx.Model()
+        model.name, model.comment = 'pmx model', 'comment'
+        filepath = os.path.join(self.__output_dir, name)
+        pmx.save(filepath, model)
+        return filepath
+
+    #********************************************
+    # Probe
+    #********************************************
+
+    def test_pmd_probe(self):
+        for extended, physics in ((True, True), (True, False), (False, False)):
+            filepath = self.__create_pmd('probe.pmd', extended, physics)
+            for use_mmap in (False, True):
+                model = pmd.load(filepath, use_mmap=use_mmap)
+                self.assertEqual([len(m.data) for m in model.morphs], [2, 2, 2])
+            info = pmd.probe(filepath)
+            self.assertEqual(info['format'], 'pmd')
+            self.assertEqual((info['name'], info['name_e']), (model.name, model.name_e))
+            self.assertEqual((info['comment'], info['comment_e']), (model.comment, model.comment_e))
+            self.assertEqual(info['textures'], ['tex.png', 'sph.sph'])
+            counts = {
+                'num_vertices': len(model.vertices),
+                'num_faces': len(model.faces),
+                'num_materials': len(model.materials),
+                'num_bones': len(model.bones),
+                'num_morphs': len(model.morphs),
+                'num_display': len(model.bone_disp_names[0]) + 2, # with the root and facial frames of pmx
+                'num_rigids': len(model.rigid_bodies),
+                'num_joints': len(model.joints),
+                }
+            self.assertEqual({k:info[k] for k in counts}, counts)
+            self.assertEqual((info['num_rigids'], info['num_joints']), (2, 1) if physics else (0, 0))
+            self.assertEqual(info['num_display'], 3)
+
+        # a truncated file is reported as corrupted
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        with open(filepath, 'wb') as f:
+            f.write(data[:-10])
+        with self.assertRaises(pmd.InvalidFileError):
+            pmd.probe(filepath)
+
+    #********************************************
+    # Catalogue
+    #********************************************
+
+    def test_scan(self):
+        pmd_path = self.__create_pmd('a.pmd')
+        pmx_path = self.__create_pmx('b.pmx')
+        os.makedirs(os.path.join(self.__output_dir, 'sub'))
+        sub_path = self.__create_pmx(os.path.join('sub', 'c.pmx'))
+        broken_path = os.path.join(self.__output_dir, 'd.pmx')
+        with open(broken_path, 'wb') as f:
+            f.write(b'not a pmx file')
+        with open(os.path.join(self.__output_dir, 'e.txt'), 'wb') as f:
+            f.write(b'ignored')
+
+        for max_workers in (1, None):
+            entries = catalogue.scan(self.__output_dir, max_workers=max_workers)
+            self.assertEqual([x['filepath'] for x in entries], [pmd_path, pmx_path, broken_path, sub_path])
+            self.assertEqual(entries[0]['num_morphs'], 3)
+            self.assertEqual(entries[1]['name'], 'pmx model')
+            self.assertNotIn('error', entries[1])
+            self.assertIn('error', entries[2])
+        entries = catalogue.scan(self.__output_dir, recursive=False)
+        self.assertEqual([x['filepath'] for x in entries], [pmd_path, pmx_path, broken_path])
+
+    def test_write_catalogue(self):
+        pmd_path = self.__create_pmd('a.pmd')
+        pmx_path = self.__create_pmx('b.pmx')
+        json_path = os.path.join(TESTS_DIR, 'output', 'test_catalogue.json')
+        self.assertEqual(catalogue.write_catalogue(self.__output_dir, json_path), 2)
+        with open(json_path, encoding='utf-8') as f:
+            entries = json.load(f)
+        self.assertEqual(entries, catalogue.scan(self.__output_dir))
+
+        csv_path = os.path.join(TESTS_DIR, 'output', 'test_catalogue.csv')
+        self.assertEqual(catalogue.write_catalogue(self.__output_dir, csv_path), 2)
+        with open(csv_path, encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([x['filepath'] for x in rows], [pmd_path, pmx_path])
+        self.assertEqual(rows[0]['textures'], 'tex.png;sph.sph')
+        self.assertEqual(rows[0]['num_bones'], '4')
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import time
+import unittest
+
+import bpy
+import numpy as np
+from mathutils import Vector
+
+from mmd_tools import bpyutils
+from mmd_tools.core.model import Model
+from mmd_tools.core.pmx.importer import PMXImporter
+from mmd_tools.operators.misc import MoveObject
+
+@unittest.skipUnless(os.environ.get('MMD_TOOLS_BENCHMARK'), 'set MMD_TOOLS_BENCHMARK=1 to run the benchmarks')
+class TestImportBenchmark(unittest.TestCase):
+    """ Timings of the bulk paths used by the importers against the per-item paths they replace.
+
+    The results of both paths are compared, the timings are printed.
+    These run on large data, so they are skipped unless MMD_TOOLS_BENCHMARK is set.
+    """
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        random.seed(0)
+        np.random.seed(0)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    @staticmethod
+    def __report(name, count, old_time, new_time):
+        print('\n * %s (%d): %.3f sec -> %.3f sec (x%.1f)'%(name, count, old_time, new_time, old_time/max(new_time, 1e-6)))
+
+    @staticmethod
+    def __create_mesh_object(name, vertex_count):
+        mesh = bpy.data.meshes.new(name=name)
+        mesh.vertices.add(count=vertex_count)
+        mesh.vertices.foreach_set('co', np.random.rand(vertex_count*3).astype(np.float32))
+        return bpy.data.objects.new(name=name, object_data=mesh)
+
+    @staticmethod
+    def __remove_object(obj):
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        bpy.data.meshes.remove(mesh)
+
+    @staticmethod
+    def __vertex_weights(obj):
+        return [sorted((g.group, round(g.weight, 6)) for g in v.groups) for v in obj.data.vertices]
+
+    #********************************************
+    # Vertex Groups
+    #********************************************
+
+    def __create_weights(self, vertex_count, bone_count):
+        # the weights of MMD models are mostly BDEF1/BDEF2 with coarse weights
+        weight_types = np.random.choice(4, vertex_count, p=(0.4, 0.45, 0.1, 0.05))
+        bones = np.random.randint(0, bone_count, (vertex_count, 4))
+        weights = np.zeros((vertex_count, 4), np.float32)
+        w = np.random.randint(0, 21, vertex_count).astype(np.float32) / 20
+        weights[:, 0] = np.where(weight_types == 0, 1, w)
+        weights[:, 1] = 1 - w
+        bdef4 = (weight_types == 2)
+        weights[bdef4] = np.random.dirichlet((1, 1, 1, 1), bdef4.sum()).round(2)
+        bones[weight_types == 0, 1:] = -1
+        bones[(weight_types == 1) | (weight_types == 3), 2:] = -1
+        edge_scales = np.random.randint(0, 5, vertex_count).astype(np.float32) / 4
+        return weight_types, bones, weights, edge_scales
+
+    def test_vertex_group_weights(self):
+        vertex_count, bone_count = 100000, 200
+        weight_types, bones, weights, edge_scales = self.__create_weights(vertex_count, bone_count)
+        slot_counts = (1, 2, 4, 2)
+
+        old_obj = self.__create_mesh_object('old', vertex_count)
+        new_obj = self.__create_mesh_object('new', vertex_count)
+
+        start_time = time.time()
+        vertex_groups = [old_obj.vertex_groups.new(name='bone%d'%i) for i in range(bone_count)]
+        vg_edge_scale = old_obj.vertex_groups.new(name='mmd_edge_scale')
+        vg_vertex_order = old_obj.vertex_groups.new(name='mmd_vertex_order')
+        for i, (t, pv_bones, pv_weights) in enumerate(zip(weight_types.tolist(), bones.tolist(), weights.tolist())):
+            idx = (i,)
+            vg_edge_scale.add(index=idx, weight=float(edge_scales[i]), type='REPLACE')
+            vg_vertex_order.add(index=idx, weight=i/vertex_count, type='REPLACE')
+            for bone, weight in zip(pv_bones[:slot_counts[t]], pv_weights):
+                vertex_groups[bone].add(index=idx, weight=weight, type='ADD')
+        old_time = time.time() - start_time
+
+        start_time = time.time()
+        vertex_groups = [new_obj.vertex_groups.new(name='bone%d'%i) for i in range(bone_count)]
+        vg_edge_scale = new_obj.vertex_groups.new(name='mmd_edge_scale')
+        vg_vertex_order = new_obj.vertex_groups.new(name='mmd_vertex_order')
+        bpyutils.set_vertex_group_weights(new_obj.data, (
+            (vg_edge_scale, edge_scales),
+            (vg_vertex_order, np.arange(vertex_count)/vertex_count),
+            ))
+        used_slots = np.arange(4) < np.array(slot_counts)[weight_types][:, None]
+        vertex_indices, slots = np.nonzero(used_slots)
+        bpyutils.add_vertex_group_weights(vertex_groups, bones[vertex_indices, slots], vertex_indices, weights[vertex_indices, slots])
+        new_time = time.time() - start_time
+
+        self.__report('vertex group weights', vertex_count, old_time, new_time)
+        self.assertEqual(self.__vertex_weights(new_obj), self.__vertex_weights(old_obj))
+        self.__remove_object(old_obj)
+        self.__remove_object(new_obj)
+
+    #********************************************
+    # Shape Keys
+    #********************************************
+
+    def test_vertex_morph_shape_keys(self):
+        vertex_count, morph_count, offset_count, scale = 50000, 50, 2000, 0.08
+        morphs = []
+        for i in range(morph_count):
+            indices = np.random.randint(0, vertex_count, offset_count)
+            offsets = np.random.uniform(-1, 1, (offset_count, 3)).astype(np.float32)
+            morphs.append((indices, offsets))
+
+        old_obj = self.__create_mesh_object('old', vertex_count)
+        new_obj = self.__create_mesh_object('new', vertex_count)
+        old_obj.shape_key_add(name='Basis')
+        new_obj.shape_key_add(name='Basis')
+
+        start_time = time.time()
+        for i, (indices, offsets) in enumerate(morphs):
+            shape_key = old_obj.shape_key_add(name='morph%d'%i)
+            for index, offset in zip(indices.tolist(), offsets.tolist()):
+                shape_key.data[index].co += Vector(offset).xzy * scale
+        old_time = time.time() - start_time
+
+        start_time = time.time()
+        update_shape_key = PMXImporter._PMXImporter__updateShapeKey
+        for i, (indices, offsets) in enumerate(morphs):
+            shape_key = new_obj.shape_key_add(name='morph%d'%i)
+            update_shape_key(shape_key, indices, offsets[:, (0, 2, 1)] * np.float32(scale), add=True)
+        new_time = time.time() - start_time
+
+        self.__report('vertex morph shape keys', morph_count*offset_count, old_time, new_time)
+        old_co, new_co = np.empty(vertex_count*3, np.float32), np.empty(vertex_count*3, np.float32)
+        for old_key, new_key in zip(old_obj.data.shape_keys.key_blocks, new_obj.data.shape_keys.key_blocks):
+            old_key.data.foreach_get('co', old_co)
+            new_key.data.foreach_get('co', new_co)
+            self.assertTrue(np.allclose(new_co, old_co, atol=1e-6), new_key.name)
+        self.__remove_object(old_obj)
+        self.__remove_object(new_obj)
+
+    #********************************************
+    # Custom Normals
+    #********************************************
+
+    def __create_grid_object(self, name, size):
+        x, y = np.meshgrid(np.arange(size+1, dtype=np.float32), np.arange(size+1, dtype=np.float32))
+        vertices = np.column_stack((x.ravel(), y.ravel(), np.random.rand(x.size))).tolist()
+        quads = (np.arange(size)[None, :] + (size+1)*np.arange(size)[:, None]).ravel()
+        faces = np.column_stack((quads, quads+1, quads+size+2, quads, quads+size+2, quads+size+1)).reshape(-1, 3).tolist()
+        mesh = bpy.data.meshes.new(name=name)
+        mesh.from_pydata(vertices, [], faces)
+        mesh.polygons.foreach_set('use_smooth', np.ones(len(mesh.polygons), dtype=bool))
+        mesh.use_auto_smooth = True
+        return bpy.data.objects.new(name=name, object_data=mesh)
+
+    @staticmethod
+    def __split_normals(obj):
+        mesh = obj.data
+        mesh.calc_normals_split()
+        normals = np.empty(len(mesh.loops)*3, np.float32)
+        mesh.loops.foreach_get('normal', normals)
+        return normals
+
+    def test_custom_normals(self):
+        size = 200
+        old_obj = self.__create_grid_object('old', size)
+        new_obj = self.__create_grid_object('new', size)
+        vertex_count = len(old_obj.data.vertices)
+        pmx_normals = np.random.uniform(-1, 1, (vertex_count, 3)).astype(np.float32)
+        pmx_normals[:10] = 0 # zero normals are kept
+        loop_indices = np.empty(len(old_obj.data.loops), np.int32)
+        old_obj.data.loops.foreach_get('vertex_index', loop_indices)
+
+        start_time = time.time()
+        custom_normals = [Vector(pmx_normals[i]).xzy.normalized() for i in loop_indices.tolist()]
+        old_obj.data.normals_split_custom_set(custom_normals)
+        old_time = time.time() - start_time
+
+        start_time = time.time()
+        normals = PMXImporter._PMXImporter__convertNormalArray(pmx_normals)
+        new_obj.data.normals_split_custom_set(normals[loop_indices])
+        new_time = time.time() - start_time
+
+        self.__report('custom normals', len(loop_indices), old_time, new_time)
+        self.assertTrue(np.allclose(self.__split_normals(new_obj), self.__split_normals(old_obj), atol=1e-4))
+        self.__remove_object(old_obj)
+        self.__remove_object(new_obj)
+
+    #********************************************
+    # Rigid Bodies and Joints
+    #********************************************
+
+    @staticmethod
+    def __remove_model(rig):
+        for obj in rig.allObjects():
+            bpy.data.objects.remove(obj)
+
+    def __create_physics(self, rig, rigid_params, joint_params, batched):
+        rigid_objs = rig.createRigidBodyPool(len(rigid_params))
+        for i, (obj, (name, shape, location, rotation, size, group)) in enumerate(zip(rigid_objs, rigid_params)):
+            if batched:
+                size = (np.array(size, np.float32) * np.float32(0.08)).tolist()
+                rig.createRigidBody(obj=obj, name=name, obj_name=MoveObject.get_indexed_name(name, i),
+                    shape_type=shape, dynamics_type=1, location=location, rotation=rotation,
+                    size=size, collision_group_number=group, mass=1.0)
+            else:
+                rig.createRigidBody(obj=obj, name=name,
+                    shape_type=shape, dynamics_type=1, location=Vector(location), rotation=Vector(rotation),
+                    size=Vector(size) * 0.08, collision_group_number=group, mass=1.0)
+                MoveObject.set_index(obj, i)
+            obj.hide = True
+
+        joint_objs = rig.createJointPool(len(joint_params))
+        for i, (obj, (name, a, b, location)) in enumerate(zip(joint_objs, joint_params)):
+            limits = dict(maximum_location=(1, 1, 1), minimum_location=(-1, -1, -1), maximum_rotation=(1, 1, 1),
+                          minimum_rotation=(-1, -1, -1), spring_linear=(0, 0, 0), spring_angular=(0, 0, 0))
+            if batched:
+                rig.createJoint(obj=obj, name=name, obj_name=MoveObject.get_indexed_name('J.' + name, i),
+                    location=location, rotation=(0, 0, 0), rigid_a=rigid_objs[a], rigid_b=rigid_objs[b], **limits)
+            else:
+                rig.createJoint(obj=obj, name=name,
+                    location=location, rotation=(0, 0, 0), rigid_a=rigid_objs[a], rigid_b=rigid_objs[b], **limits)
+                MoveObject.set_index(obj, i)
+            obj.hide = True
+        return rigid_objs, joint_objs
+
+    @staticmethod
+    def __physics_state(objects):
+        return [(obj.name, obj.mmd_type, tuple(round(x, 5) for x in obj.location), tuple(round(x, 5) for x in obj.dimensions)) for obj in objects]
+
+    def test_rigid_bodies(self):
+        for rigid_count in (100, 1000, 5000):
+            joint_count = rigid_count * 3 // 2
+            rigid_params = [('剛体%d'%i, random.randrange(3), self.__random_vector(), self.__random_vector(), (random.uniform(0.5, 2), random.uniform(0.5, 2), random.uniform(0.5, 2)), random.randrange(16)) for i in range(rigid_count)]
+            joint_params = [('ジョイント%d'%i, random.randrange(rigid_count), random.randrange(rigid_count), self.__random_vector()) for i in range(joint_count)]
+
+            results = []
+            for batched in (False, True):
+                rig = Model.create('physics', 'physics')
+                start_time = time.time()
+                objects = self.__create_physics(rig, rigid_params, joint_params, batched)
+                results.append((time.time() - start_time, [self.__physics_state(x) for x in objects]))
+                self.__remove_model(rig)
+
+            self.__report('rigid bodies and joints', rigid_count + joint_count, results[0][0], results[1][0])
+            self.assertEqual(results[1][1], results[0][1])
+
+    @staticmethod
+    def __random_vector():
+        return (random.uniform(-10, 10), random.uniform(-10, 10), random.uniform(-10, 10))
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
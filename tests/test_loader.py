@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import unittest
+
+from mmd_tools.core import loader
+from mmd_tools.core import pmx
+from mmd_tools.core.model_cache import ModelCache
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestLoader(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        self.__output_dir = os.path.join(TESTS_DIR, 'output', 'test_loader')
+        shutil.rmtree(self.__output_dir, ignore_errors=True)
+        os.makedirs(self.__output_dir)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    def __create_file(self, name):
+        """ Save a model of 2 faces with a duplicated vertex, an unused vertex and a vertex morph.
+        """
+        model = pmx.Model()
+        for co in ((0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0), (5, 5, 5)):
+            v = pmx.Vertex()
+            v.co, v.normal, v.uv = tuple(map(float, co)), (0.0, 0.0, 1.0), (0.0, 0.0)
+            v.weight = pmx.BoneWeight()
+            v.weight.type = pmx.BoneWeight.BDEF1
+            v.weight.bones, v.weight.weights = [0], [1.0]
+            model.vertices.append(v)
+        model.faces = [(0, 1, 2), (3, 4, 2)]
+        bone = pmx.Bone()
+        bone.name, bone.location = 'bone', (0.0, 0.0, 0.0)
+        model.bones.append(bone)
+        mat = pmx.Material()
+        mat.name, mat.vertex_count = 'mat', 6
+        mat.diffuse, mat.specular, mat.ambient, mat.edge_color = (1, 1, 1, 1), (0, 0, 0), (0.5, 0.5, 0.5), (0, 0, 0, 1)
+        model.materials.append(mat)
+        morph = pmx.VertexMorph('morph', '', 1)
+        offset = pmx.VertexMorphOffset()
+        offset.index, offset.offset = 4, (0.0, 0.0, 1.0)
+        morph.offsets.append(offset)
+        model.morphs.append(morph)
+        filepath = os.path.join(self.__output_dir, name)
+        pmx.save(filepath, model)
+        return filepath
+
+    @staticmethod
+    def __summary(data):
+        model = data['pmx']
+        vertex_map = data['vertex_map']
+        return (data['pmx_cleaned'], [tuple(v.co) for v in model.vertices], [tuple(f) for f in model.faces],
+                [(x.index, tuple(x.offset)) for m in model.morphs for x in m.offsets],
+                None if vertex_map is None else vertex_map.tolist())
+
+    #********************************************
+    # Import Arguments
+    #********************************************
+
+    def test_load_import_args(self):
+        filepath = self.__create_file('model.pmx')
+        types = {'MESH', 'MORPHS'}
+        data = loader.load_import_args(filepath, types, clean_model=True, remove_doubles=True)
+        self.assertEqual(set(data.keys()), {'pmx', 'pmx_cleaned', 'vertex_map'})
+        self.assertTrue(data['pmx_cleaned'])
+        self.assertEqual(len(data['pmx'].vertices), 5) # the unused vertex is removed
+        self.assertEqual(len(data['vertex_map']), 5)
+        self.assertEqual(data['vertex_map'][3, 0], data['vertex_map'][1, 0]) # merged doubles
+        expected = self.__summary(data)
+
+        data = loader.load_import_args(filepath, {'ARMATURE'}, clean_model=True, remove_doubles=True)
+        self.assertFalse(data['pmx_cleaned'])
+        self.assertIsNone(data['vertex_map'])
+        self.assertEqual(len(data['pmx'].vertices), 0)
+        self.assertEqual(len(data['pmx'].bones), 1)
+
+        cache = ModelCache(os.path.join(self.__output_dir, 'cache'))
+        self.assertEqual(self.__summary(loader.load_import_args(filepath, types, True, True, cache=cache)), expected)
+        self.assertEqual(len(cache.entries()), 1)
+
+        # a hit is neither decoded nor cleaned
+        load_model, clean, remove_doubles = loader.load_model, loader._PMXCleaner.clean, loader._PMXCleaner.remove_doubles
+        def fail(*args):
+            raise AssertionError('unexpected call')
+        try:
+            loader.load_model = loader._PMXCleaner.clean = loader._PMXCleaner.remove_doubles = fail
+            self.assertEqual(self.__summary(loader.load_import_args(filepath, types, True, True, cache=cache)), expected)
+            self.assertRaises(AssertionError, loader.load_import_args, filepath, types, True, False, cache=cache)
+        finally:
+            loader.load_model = load_model
+            loader._PMXCleaner.clean, loader._PMXCleaner.remove_doubles = clean, remove_doubles
+
+        # the key varies with the options which affect the data
+        for args in ((types, True, False), ({'MESH'}, True, True), ({'MESH', 'PHYSICS', 'MORPHS'}, True, True),
+                     (types, False, False), ({'ARMATURE'}, False, False)):
+            count = len(cache.entries())
+            loader.load_import_args(filepath, *args, cache=cache)
+            self.assertEqual(len(cache.entries()), count + 1, str(args))
+        # but not with the clean options if the mesh is not imported
+        loader.load_import_args(filepath, {'ARMATURE'}, True, True, cache=cache)
+        self.assertEqual(len(cache.entries()), count + 1)
+
+        data = loader.load_import_args(filepath, {'MESH'}, True, True, cache=cache)
+        self.assertTrue(data['pmx_cleaned'])
+        self.assertEqual((len(data['pmx'].vertices), len(data['pmx'].morphs)), (5, 0))
+
+    def test_load_models(self):
+        filepaths = [self.__create_file('model%d.pmx'%i) for i in range(3)]
+        broken_path = os.path.join(self.__output_dir, 'broken.pmx')
+        with open(broken_path, 'wb') as f:
+            f.write(b'not a pmx file')
+        filepaths.insert(1, broken_path)
+        cache = ModelCache(os.path.join(self.__output_dir, 'cache'))
+        for max_workers in (1, None):
+            results = list(loader.load_models(filepaths, {'MESH'}, max_workers=max_workers, cache=cache, clean_model=True))
+            self.assertEqual([x[0] for x in results], filepaths)
+            self.assertIsInstance(results[1][2], pmx.InvalidFileError)
+            for filepath, data, error in results[:1] + results[2:]:
+                self.assertIsNone(error)
+                self.assertTrue(data['pmx_cleaned'])
+                self.assertEqual(len(data['pmx'].vertices), 5)
+
+        results = list(loader.load_models(filepaths, {'MESH'}, max_workers=1))
+        self.assertEqual(results, [(f, {}, None) for f in filepaths])
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
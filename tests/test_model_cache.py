@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from mmd_tools.core import pmx
+from mmd_tools.core.model_cache import ModelCache, compact, dump_model, load_model
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        self.__cache_dir = os.path.join(TESTS_DIR, 'output', 'test_model_cache')
+        shutil.rmtree(self.__cache_dir, ignore_errors=True)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    def __create_file(self, name, data):
+        filepath = os.path.join(TESTS_DIR, 'output', 'test_model_cache_%s.pmx'%name)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return filepath
+
+    @staticmethod
+    def __create_model(vertex_count):
+        model = pmx.Model()
+        model.header = pmx.Header()
+        for i in range(vertex_count):
+            v = pmx.Vertex()
+            v.co, v.normal, v.uv = (float(i), 0.0, 0.0), (0.0, 0.0, 1.0), (0.0, 0.0)
+            v.weight = pmx.BoneWeight()
+            v.weight.type = pmx.BoneWeight.BDEF1
+            v.weight.bones, v.weight.weights = [0], [1.0]
+            model.vertices.append(v)
+        model.faces = [[i, i+1, i+2] for i in range(vertex_count-2)]
+        morph = pmx.VertexMorph('morph', '', 4)
+        for i in range(vertex_count):
+            x = pmx.VertexMorphOffset()
+            x.index, x.offset = i, (0.0, 1.0, 0.0)
+            morph.offsets.append(x)
+        model.morphs.append(morph)
+        return model
+
+    def __create_full_model(self):
+        model = self.__create_model(10)
+        model.name, model.comment = 'モデル', 'comment'
+        model.header.additional_uvs = 1
+        for v in model.vertices:
+            v.additional_uvs = [(0.0, 1.0, 2.0, 3.0)]
+        texture = pmx.Texture()
+        texture.path = os.path.join(TESTS_DIR, 'tex.png')
+        model.textures.append(texture)
+        mat = pmx.Material()
+        mat.name, mat.texture, mat.vertex_count = 'mat', 0, np.int64(24)
+        mat.diffuse, mat.specular, mat.ambient = (1.0, 1.0, 1.0, 1.0), (0.0, 0.0, 0.0), (0.5, 0.5, 0.5)
+        model.materials.append(mat)
+        for i in range(2):
+            bone = pmx.Bone()
+            bone.name, bone.location, bone.parent = 'bone%d'%i, (0.0, float(i), 0.0), i-1 if i else None
+            bone.localCoordinate = pmx.Coordinate((1.0, 0.0, 0.0), (0.0, 0.0, 1.0))
+            model.bones.append(bone)
+        model.bones[1].isIK, model.bones[1].target = True, 0
+        link = pmx.IKLink()
+        link.target, link.maximumAngle, link.minimumAngle = 0, (1.0, 0.0, 0.0), (-1.0, 0.0, 0.0)
+        model.bones[1].ik_links.append(link)
+        morph = pmx.UVMorph('uv', '', 4)
+        offset = pmx.UVMorphOffset()
+        offset.index, offset.offset = 1, (0.5, 0.5, 0.0, 0.0)
+        morph.offsets.append(offset)
+        model.morphs.append(morph)
+        morph = pmx.BoneMorph('bone', '', 2)
+        offset = pmx.BoneMorphOffset()
+        offset.index, offset.location_offset, offset.rotation_offset = 1, (0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0)
+        morph.offsets.append(offset)
+        model.morphs.append(morph)
+        model.display[1].data.append((1, 0))
+        rigid = pmx.Rigid()
+        rigid.name, rigid.bone, rigid.location = 'rigid', 0, (0.0, 1.0, 0.0)
+        model.rigids.append(rigid)
+        return compact(model)
+
+    def __assertObjectsEqual(self, a, b, msg=None):
+        """ Compare pmx objects by class and attributes recursively.
+        """
+        if isinstance(a, (list, pmx._LazyList)):
+            self.assertIsInstance(b, (list, pmx._LazyList), msg)
+            self.assertEqual(len(a), len(b), msg)
+            for x, y in zip(a, b):
+                self.__assertObjectsEqual(x, y, msg)
+        elif hasattr(a, '__dict__'):
+            self.assertIs(type(a), type(b), msg)
+            self.assertEqual(sorted(vars(a)), sorted(vars(b)), msg)
+            for k, v in vars(a).items():
+                self.__assertObjectsEqual(v, getattr(b, k), '%s.%s'%(msg or type(a).__name__, k))
+        else:
+            if not isinstance(a, np.generic): # numpy scalars are stored as python numbers
+                self.assertIs(type(a), type(b), msg)
+            self.assertEqual(a, b, msg)
+
+    #********************************************
+    # Cache
+    #********************************************
+
+    def test_get_put(self):
+        cache = ModelCache(self.__cache_dir)
+        filepath = self.__create_file('a', b'model a')
+        key = cache.key(filepath, sections={'vertices', 'faces'}, clean_model=True)
+        self.assertEqual(key, cache.key(filepath, clean_model=True, sections={'faces', 'vertices'}))
+        self.assertNotEqual(key, cache.key(filepath, sections={'vertices', 'faces'}, clean_model=False))
+        self.assertNotEqual(key, cache.key(self.__create_file('b', b'model b'), sections={'vertices', 'faces'}, clean_model=True))
+        self.assertIsNone(cache.get(key))
+
+        model = compact(self.__create_model(100))
+        self.assertIsInstance(model.vertices.data(), pmx.VertexArrays)
+        cache.put(key, {'pmx':model, 'pmx_cleaned':False, 'vertex_map':None})
+        data = cache.get(key)
+        self.assertFalse(data['pmx_cleaned'])
+        self.assertIsNone(data['vertex_map'])
+        self.assertEqual([tuple(v.co) for v in data['pmx'].vertices], [tuple(v.co) for v in model.vertices])
+        self.assertEqual([list(f) for f in data['pmx'].faces], [list(f) for f in model.faces])
+        self.assertEqual([(x.index, tuple(x.offset)) for x in data['pmx'].morphs[0].offsets],
+                         [(x.index, tuple(x.offset)) for x in model.morphs[0].offsets])
+
+        vertex_map = np.arange(20, dtype=np.int32).reshape(-1, 2)
+        cache.put(key, {'pmx':model, 'pmx_cleaned':True, 'vertex_map':vertex_map})
+        data = cache.get(key)
+        self.assertTrue(data['pmx_cleaned'])
+        self.assertEqual(data['vertex_map'].tolist(), vertex_map.tolist())
+
+        # an entry of another key is invalid
+        other_key = cache.key(filepath)
+        os.rename(os.path.join(self.__cache_dir, key + ModelCache.EXT), os.path.join(self.__cache_dir, other_key + ModelCache.EXT))
+        self.assertIsNone(cache.get(other_key))
+        self.assertEqual(cache.entries(), [])
+
+        # an entry of another add-on version is invalid
+        old_cache = ModelCache(self.__cache_dir)
+        old_cache.VERSION = '0.0.0'
+        self.assertNotEqual(old_cache.key(filepath), cache.key(filepath))
+        old_cache.put(key, {'pmx':model})
+        self.assertIsNotNone(old_cache.get(key))
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.entries(), [])
+
+    def test_model_data(self):
+        model = self.__create_full_model()
+        arrays, value = dump_model(model)
+        self.assertTrue(all(isinstance(x, np.ndarray) and x.dtype != object for x in arrays.values()))
+        value = json.loads(json.dumps(value))
+        loaded = load_model(arrays, value)
+        self.assertIsInstance(loaded.vertices.data(), pmx.VertexArrays)
+        self.assertIsInstance(loaded.faces.data(), pmx.FaceArrays)
+        self.assertIsInstance(loaded.morphs[1].offsets.data(), pmx.MorphOffsetArrays)
+        self.assertEqual(loaded.morphs[1].offsets.data().offset.shape, (1, 4))
+        self.__assertObjectsEqual(model, loaded)
+
+        # only the classes of the pmx module are created
+        value['model']['pmx'] = 'os'
+        with self.assertRaises(ValueError):
+            load_model(arrays, value)
+
+        cache = ModelCache(self.__cache_dir)
+        key = '%040d'%0
+        cache.put(key, {'pmx':model})
+        path = os.path.join(self.__cache_dir, key + ModelCache.EXT)
+        with np.load(path, allow_pickle=False) as npz:
+            arrays = {k:npz[k] for k in npz.files}
+        meta = json.loads(arrays['meta'].tobytes().decode('utf-8'))
+        meta['model']['morphs'][2]['pmx'] = 'np'
+        arrays['meta'] = np.frombuffer(json.dumps(meta).encode('utf-8'), np.uint8)
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.entries(), [])
+
+    def test_evict(self):
+        cache = ModelCache(self.__cache_dir)
+        keys = ['%040d'%i for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.put(key, {'pmx':compact(self.__create_model(1000))})
+            os.utime(os.path.join(self.__cache_dir, key + ModelCache.EXT), (i, i))
+        size = max(x[1] for x in cache.entries())
+
+        self.assertIsNotNone(cache.get(keys[0])) # the most recently used
+        cache.size_limit = size * 2
+        cache.evict()
+        self.assertEqual(sorted(os.path.basename(x[2]) for x in cache.entries()), sorted(k + ModelCache.EXT for k in (keys[0], keys[3])))
+        cache.clear()
+        self.assertEqual(cache.entries(), [])
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from mmd_tools.core import pmd
+from mmd_tools.core import pmx
+from mmd_tools.core.pmd.importer import convert_vertex_arrays, convert_morph_data_arrays
+
+class TestPmdImporter(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+
+    #********************************************
+    # Convert
+    #********************************************
+
+    def test_convert_vertices(self):
+        vertices = []
+        for i, (bones, weight, enable_edge) in enumerate((([1, 2], 40, 0), ([3, 3], 100, 1), ([0, 5], 0, 0))):
+            v = pmd.Vertex()
+            v.position, v.normal, v.uv = (float(i), 2.0, 3.0), (0.0, 1.0, 0.0), (0.5, 0.25)
+            v.bones, v.weight, v.enable_edge = bones, weight, enable_edge
+            vertices.append(v)
+
+        pmx_vertices = pmx.from_arrays(convert_vertex_arrays(pmd.VertexArrays.fromVertices(vertices)))
+        self.assertEqual([tuple(v.co) for v in pmx_vertices], [v.position for v in vertices])
+        self.assertEqual([v.edge_scale for v in pmx_vertices], [1.0, 0.0, 1.0])
+        weights = [v.weight for v in pmx_vertices]
+        self.assertEqual([w.type for w in weights], [pmx.BoneWeight.BDEF2, pmx.BoneWeight.BDEF1, pmx.BoneWeight.BDEF2])
+        self.assertEqual([list(w.bones) for w in weights], [[1, 2], [3], [0, 5]])
+        self.assertEqual([list(w.weights) for w in weights if w.type == pmx.BoneWeight.BDEF2], [[np.float32(0.4)], [0.0]])
+
+    def test_convert_morph_data(self):
+        morph_data = []
+        for index, offset in ((2, (1.0, 0.0, 0.0)), (0, (0.0, 1.0, 0.0))):
+            d = pmd.MorphData()
+            d.index, d.offset = index, offset
+            morph_data.append(d)
+
+        offsets = pmx.from_arrays(convert_morph_data_arrays(pmd.MorphDataArrays.fromMorphData(morph_data), np.array([7, 8, 9])))
+        self.assertEqual([(x.index, tuple(x.offset)) for x in offsets], [(9, (1.0, 0.0, 0.0)), (7, (0.0, 1.0, 0.0))])
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from mmd_tools.core import pmx
+from mmd_tools.core.pmx.importer import _PMXCleaner
+
+class TestPmxCleaner(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    @staticmethod
+    def __create_model(vertices, faces, material_face_counts, vertex_morphs=()):
+        model = pmx.Model()
+        model.header = pmx.Header()
+        for co, uv in vertices:
+            v = pmx.Vertex()
+            v.co, v.normal, v.uv = co, (0.0, 0.0, 1.0), uv
+            v.weight = pmx.BoneWeight()
+            v.weight.type = pmx.BoneWeight.BDEF1
+            v.weight.bones, v.weight.weights = [0], [1.0]
+            model.vertices.append(v)
+        model.faces = [list(f) for f in faces]
+        for count in material_face_counts:
+            mat = pmx.Material()
+            mat.vertex_count = count * 3
+            model.materials.append(mat)
+        for i, offsets in enumerate(vertex_morphs):
+            morph = pmx.VertexMorph('morph%d'%i, '', 4)
+            for index, offset in offsets:
+                x = pmx.VertexMorphOffset()
+                x.index, x.offset = index, offset
+                morph.offsets.append(x)
+            model.morphs.append(morph)
+        return model
+
+    @staticmethod
+    def __faces(model):
+        return [list(f) for f in model.faces]
+
+    #********************************************
+    # Clean
+    #********************************************
+
+    def test_clean(self):
+        vertices = [((float(i), 0.0, 0.0), (0.0, 0.0)) for i in range(6)]
+        faces = [(0, 1, 2), (2, 0, 1), (0, 0, 1), (5, 4, 2), (0, 1, 2)]
+        morphs = [[(1, (1.0, 0.0, 0.0)), (3, (0.0, 1.0, 0.0)), (5, (0.0, 0.0, 1.0))]]
+        model = self.__create_model(vertices, faces, (4, 1), morphs)
+
+        _PMXCleaner.clean(model, False)
+        self.assertEqual(self.__faces(model), [[0, 1, 2], [4, 3, 2], [0, 1, 2]])
+        self.assertEqual([m.vertex_count for m in model.materials], [6, 3])
+        self.assertEqual([tuple(v.co) for v in model.vertices], [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (2.0, 0.0, 0.0), (4.0, 0.0, 0.0), (5.0, 0.0, 0.0)])
+        self.assertEqual([(x.index, tuple(x.offset)) for x in model.morphs[0].offsets], [(1, (1.0, 0.0, 0.0)), (4, (0.0, 0.0, 1.0))])
+
+    #********************************************
+    # Remove Doubles
+    #********************************************
+
+    def test_remove_doubles(self):
+        nan = float('nan')
+        vertices = [
+            ((0.0, 0.0, 0.0), (0.0, 0.0)),
+            ((1.0, 0.0, 0.0), (0.0, 0.0)),
+            ((0.0, 1.0, 0.0), (0.0, 0.0)),
+            ((-0.0, 0.0, 0.0), (0.0, 0.0)), # equals 0
+            ((1.0, 0.0, 0.0), (1.0, 0.0)), # equals 1, a different uv
+            ((nan, 0.0, 0.0), (0.0, 0.0)),
+            ((nan, 0.0, 0.0), (0.0, 0.0)), # nan equals nothing
+            ((0.0, 1.0, 0.0), (0.0, 0.0)), # different morph offset to 2
+            ]
+        faces = [(0, 1, 2), (3, 1, 2), (3, 4, 2), (0, 3, 1), (5, 6, 7)]
+        morphs = [[(2, (1.0, 0.0, 0.0)), (7, (2.0, 0.0, 0.0)), (4, (0.0, 0.0, 0.0)), (1, (0.0, 0.0, 0.0))]]
+        model = self.__create_model(vertices, faces, (5,), morphs)
+
+        vertex_map = _PMXCleaner.remove_doubles(model, False)
+        self.assertEqual(vertex_map.tolist(), [[0, 0], [1, 1], [2, 2], [0, 0], [1, 1], [5, 3], [6, 4], [7, 5]])
+        self.assertEqual(self.__faces(model), [[0, 1, 2], [3, 4, 2], [5, 6, 7]])
+        self.assertEqual(model.materials[0].vertex_count, 9)
+        self.assertEqual([(x.index, tuple(x.offset)) for x in model.morphs[0].offsets], [(2, (1.0, 0.0, 0.0)), (5, (2.0, 0.0, 0.0)), (1, (0.0, 0.0, 0.0))])
+
+        model = self.__create_model(vertices[:3], faces[:1], (1,))
+        self.assertIsNone(_PMXCleaner.remove_doubles(model, True))
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
@@ -5,11 +5,13 @@ import shutil
 import unittest
 
 import bpy
+import numpy as np
 
 from math import pi
 from mathutils import Euler
 from mathutils import Vector
 from mmd_tools.core import pmx
+from mmd_tools.core.pmx import exporter as pmx_exporter
 from mmd_tools.core.model import Model
 from mmd_tools.core.pmd.importer import import_pmd_to_pmx
 from mmd_tools.core.pmx.importer import PMXImporter
@@ -662,6 +664,79 @@ class TestPmxExporter(unittest.TestCase):
                     if 'DISPLAY' in check_types:
                         self.__check_pmx_display_data(source_model, result_model, 'MORPHS' in check_types)
 
+    #********************************************
+    # Sort Materials
+    #********************************************
+
+    @staticmethod
+    def __sort_materials(co, faces, face_counts, sort_key):
+        """ Sort the materials of a model of columnar vertices and faces by the exporter.
+        """
+        model = pmx.Model()
+        vertices = pmx.VertexArrays(len(co))
+        vertices.co[:] = co
+        model.vertices = pmx.from_arrays(vertices)
+        face_data = pmx.FaceArrays(len(faces))
+        face_data.indices[:] = faces
+        model.faces = pmx.from_arrays(face_data)
+        for i, count in enumerate(face_counts):
+            mat = pmx.Material()
+            mat.name, mat.vertex_count = 'mat%d'%i, count * 3
+            model.materials.append(mat)
+        exporter = getattr(pmx_exporter, '__PmxExporter')()
+        exporter._PmxExporter__model = model
+        exporter._PmxExporter__material_name_table = [m.name for m in model.materials]
+        exporter._PmxExporter__sortMaterials(sort_key)
+        names = [m.name for m in model.materials]
+        assert names == exporter._PmxExporter__material_name_table
+        return names, [tuple(f) for f in model.faces], model.faces
+
+    @staticmethod
+    def __sort_materials_by_distance(co, faces, face_counts):
+        """ The previous implementation of the DISTANCE sort.
+        """
+        center = Vector((0, 0, 0))
+        for v in co:
+            center += Vector(v) / len(co)
+        offset = 0
+        distances = []
+        for i, face_num in enumerate(face_counts):
+            d = 0
+            for face in faces[offset:offset + face_num]:
+                d += (Vector(co[face[0]]) - center).length
+                d += (Vector(co[face[1]]) - center).length
+                d += (Vector(co[face[2]]) - center).length
+            distances.append((d/(face_num*3), 'mat%d'%i, offset, face_num))
+            offset += face_num
+        names, sorted_faces = [], []
+        for d, name, offset, face_num in sorted(distances, key=lambda x: x[0]):
+            names.append(name)
+            sorted_faces.extend(tuple(f) for f in faces[offset:offset + face_num])
+        return names, sorted_faces
+
+    def test_sort_materials(self):
+        np.random.seed(0)
+        co = np.random.uniform(-5, 5, (200, 3)).astype(np.float32)
+        face_counts = np.random.randint(1, 30, 12).tolist()
+        faces = np.random.randint(0, len(co), (sum(face_counts), 3)).tolist()
+        co_list = co.tolist()
+
+        names, sorted_faces, model_faces = self.__sort_materials(co, faces, face_counts, 'DISTANCE')
+        self.assertEqual((names, sorted_faces), self.__sort_materials_by_distance(co_list, faces, face_counts))
+        self.assertIsInstance(model_faces.data(), pmx.FaceArrays)
+
+        ranges = np.cumsum([0] + face_counts)
+        center = co.astype(np.float64).mean(axis=0)
+        expected = {
+            'DEPTH': [-np.mean([co[i][2] for f in faces[s:e] for i in f]) for s, e in zip(ranges[:-1], ranges[1:])],
+            'RADIUS': [max(np.linalg.norm(co[i] - center) for f in faces[s:e] for i in f) for s, e in zip(ranges[:-1], ranges[1:])],
+            }
+        for sort_key, keys in expected.items():
+            names, sorted_faces, model_faces = self.__sort_materials(co, faces, face_counts, sort_key)
+            order = sorted(range(len(keys)), key=lambda i: keys[i])
+            self.assertEqual(names, ['mat%d'%i for i in order], sort_key)
+            self.assertEqual(sorted_faces, [tuple(f) for i in order for f in faces[ranges[i]:ranges[i+1]]], sort_key)
+
 if __name__ == '__main__':
     import sys
     sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
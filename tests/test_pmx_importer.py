@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+import bpy
+import numpy as np
+from mathutils import Vector
+
+from mmd_tools import bpyutils
+from mmd_tools.core import loader
+from mmd_tools.core import pmx
+from mmd_tools.core.model import Model
+from mmd_tools.core.pmx.importer import PMXImporter
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestPmxImporter(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        np.random.seed(0)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    @staticmethod
+    def __create_model(vertex_count, morph_offsets=()):
+        model = pmx.Model()
+        model.name = 'test'
+        bone = pmx.Bone()
+        bone.name, bone.location = 'bone0', (0.0, 0.0, 0.0)
+        model.bones.append(bone)
+        for co in np.random.uniform(-1, 1, (vertex_count, 3)).astype(np.float32).tolist():
+            v = pmx.Vertex()
+            v.co, v.normal, v.uv = co, (0.0, 1.0, 0.0), (0.0, 0.0)
+            v.weight = pmx.BoneWeight()
+            v.weight.type = pmx.BoneWeight.BDEF1
+            v.weight.bones, v.weight.weights = [0], [1.0]
+            model.vertices.append(v)
+        model.faces = [(i, i+1, i+2) for i in range(vertex_count-2)]
+        mat = pmx.Material()
+        mat.name = 'mat0'
+        mat.diffuse, mat.specular, mat.ambient, mat.edge_color = (1, 1, 1, 1), (0, 0, 0), (0.5, 0.5, 0.5), (0, 0, 0, 1)
+        mat.vertex_count = len(model.faces) * 3
+        model.materials.append(mat)
+        for i, (indices, offsets) in enumerate(morph_offsets):
+            morph = pmx.VertexMorph('morph%d'%i, '', 4)
+            for index, offset in zip(indices, offsets):
+                x = pmx.VertexMorphOffset()
+                x.index, x.offset = index, offset
+                morph.offsets.append(x)
+            model.morphs.append(morph)
+        return model
+
+    def __import_model(self, model, types, scale, **args):
+        """ Save and load a model to import the columnar data of a pmx file.
+        """
+        filepath = os.path.join(TESTS_DIR, 'output', 'test_pmx_importer.pmx')
+        pmx.save(filepath, model)
+        if 'pmx' not in args:
+            args['pmx'] = pmx.load(filepath)
+        PMXImporter().execute(types=types, scale=scale, **args)
+        return Model(Model.findRoot(bpyutils.SceneOp(bpy.context).active_object))
+
+    @staticmethod
+    def __mesh_data(rig):
+        mesh = rig.firstMesh().data
+        return [tuple(v.co) for v in mesh.vertices], [tuple(p.vertices) for p in mesh.polygons]
+
+    @staticmethod
+    def __remove_model(rig):
+        for obj in rig.allObjects():
+            bpy.data.objects.remove(obj)
+
+    #********************************************
+    # Normals
+    #********************************************
+
+    def test_convert_normals(self):
+        pmx_normals = np.random.uniform(-1, 1, (100, 3)).astype(np.float32)
+        pmx_normals[0] = (0, 0, 0)
+        pmx_normals[1] = (0, 1e-30, 0)
+        pmx_normals[2] = (0, 3, 4)
+        normals = PMXImporter._PMXImporter__convertNormalArray(pmx_normals)
+        self.assertEqual(normals.dtype, np.float32)
+        self.assertEqual(normals[0].tolist(), [0, 0, 0])
+        self.assertTrue(np.allclose(normals[2], (0, 0.8, 0.6)))
+        expected = [Vector(n).xzy.normalized() for n in pmx_normals.tolist()]
+        self.assertTrue(np.allclose(normals, expected, atol=1e-6))
+
+    #********************************************
+    # Vertex Morphs
+    #********************************************
+
+    def test_vertex_morphs(self):
+        vertex_count, scale = 100, 0.5
+        morph_offsets = []
+        for count in (0, 30, 200): # with duplicated indices
+            indices = np.random.randint(0, vertex_count, count)
+            morph_offsets.append((indices.tolist(), np.random.uniform(-1, 1, (count, 3)).astype(np.float32).tolist()))
+        model = self.__create_model(vertex_count, morph_offsets)
+        rig = self.__import_model(model, {'MESH', 'ARMATURE', 'MORPHS'}, scale, clean_model=False)
+
+        key_blocks = rig.firstMesh().data.shape_keys.key_blocks
+        basis = np.array([v.co for v in model.vertices], np.float32)[:, (0, 2, 1)] * np.float32(scale)
+        co = np.empty(vertex_count*3, np.float32)
+        key_blocks[0].data.foreach_get('co', co)
+        self.assertTrue(np.allclose(co.reshape(-1, 3), basis, atol=1e-6))
+        for i, (indices, offsets) in enumerate(morph_offsets):
+            expected = basis.copy()
+            for index, offset in zip(indices, offsets):
+                expected[index] += np.array(offset, np.float32)[[0, 2, 1]] * np.float32(scale)
+            key_blocks['morph%d'%i].data.foreach_get('co', co)
+            self.assertTrue(np.allclose(co.reshape(-1, 3), expected, atol=1e-5), 'morph%d'%i)
+        self.__remove_model(rig)
+
+    def test_armature_morphs(self):
+        model = self.__create_model(10, [([1, 2], [(0.0, 1.0, 0.0)]*2)])
+        morph = pmx.BoneMorph('bone_morph', '', 4)
+        offset = pmx.BoneMorphOffset()
+        offset.index, offset.location_offset, offset.rotation_offset = 0, (0.0, 1.0, 0.0), (0.0, 0.0, 0.0, 1.0)
+        morph.offsets.append(offset)
+        model.morphs.append(morph)
+        morph = pmx.GroupMorph('group_morph', '', 4)
+        for i in range(2):
+            offset = pmx.GroupMorphOffset()
+            offset.morph, offset.factor = i, 0.5
+            morph.offsets.append(offset)
+        model.morphs.append(morph)
+
+        # the morphs are imported without the mesh
+        rig = self.__import_model(model, {'ARMATURE', 'MORPHS'}, 1.0, clean_model=True)
+        mmd_root = rig.rootObject().mmd_root
+        self.assertEqual([m.name for m in mmd_root.vertex_morphs], ['morph0'])
+        self.assertEqual([m.name for m in mmd_root.bone_morphs], ['bone_morph'])
+        self.assertEqual([m.name for m in mmd_root.group_morphs], ['group_morph'])
+        self.assertEqual([d.name for d in mmd_root.group_morphs[0].data], ['morph0', 'bone_morph'])
+        self.__remove_model(rig)
+
+    #********************************************
+    # Clean Model
+    #********************************************
+
+    def test_cleaned_model(self):
+        vertex_count = 20
+        model = self.__create_model(vertex_count)
+        model.vertices[10].co = model.vertices[3].co # a duplicated vertex
+        unused = pmx.Vertex()
+        unused.co, unused.normal, unused.uv, unused.weight = (9.0, 9.0, 9.0), (0.0, 1.0, 0.0), (0.0, 0.0), model.vertices[0].weight
+        model.vertices.append(unused)
+        types = {'MESH', 'ARMATURE'}
+        clean_args = {'clean_model':True, 'remove_doubles':True}
+
+        rig = self.__import_model(model, types, 1.0, **clean_args)
+        expected = self.__mesh_data(rig)
+        self.__remove_model(rig)
+        self.assertEqual(len(expected[0]), vertex_count - 1)
+
+        # the model cleaned by the loader is imported as is
+        filepath = os.path.join(TESTS_DIR, 'output', 'test_pmx_importer.pmx')
+        args = loader.load_import_args(filepath, types, **clean_args)
+        self.assertTrue(args['pmx_cleaned'])
+        rig = self.__import_model(model, types, 1.0, **dict(clean_args, **args))
+        self.assertEqual(self.__mesh_data(rig), expected)
+        self.__remove_model(rig)
+
+        rig = self.__import_model(model, types, 1.0, pmx_cleaned=True, **clean_args)
+        vertices, polygons = self.__mesh_data(rig)
+        self.assertEqual(len(vertices), vertex_count + 1)
+        self.assertEqual(len(polygons), vertex_count - 2)
+        self.__remove_model(rig)
+
+    #********************************************
+    # Re-import
+    #********************************************
+
+    def __create_update_model(self):
+        """ Create a model of 2 materials, 2 vertex morphs and 2 box rigid bodies.
+        """
+        model = self.__create_model(20, [([1, 2], [(0.0, 1.0, 0.0)]*2), ([3, 4, 5], [(1.0, 0.0, 0.0)]*3)])
+        mat0 = model.materials[0]
+        mat0.vertex_count = 9
+        mat1 = pmx.Material()
+        mat1.name = 'mat1'
+        mat1.diffuse, mat1.specular, mat1.ambient, mat1.edge_color = mat0.diffuse, mat0.specular, mat0.ambient, mat0.edge_color
+        mat1.vertex_count = len(model.faces) * 3 - mat0.vertex_count
+        model.materials.append(mat1)
+        for i in range(2):
+            rigid = pmx.Rigid()
+            rigid.name, rigid.bone, rigid.type = 'rigid%d'%i, 0, pmx.Rigid.TYPE_BOX
+            rigid.size, rigid.location, rigid.rotation = (0.5, 0.25, 0.75), (0.0, float(i), 0.0), (0.0, 0.0, 0.0)
+            rigid.velocity_attenuation = rigid.rotation_attenuation = rigid.bounce = rigid.friction = 0.5
+            model.rigids.append(rigid)
+        return model
+
+    def __reimport_model(self, rig, model, types, scale, **args):
+        filepath = os.path.join(TESTS_DIR, 'output', 'test_pmx_importer.pmx')
+        pmx.save(filepath, model)
+        return PMXImporter().reimport(rig.rootObject(), types=types, scale=scale, pmx=pmx.load(filepath), **args)
+
+    def __assert_shape_keys(self, rig, model, scale):
+        mesh = rig.firstMesh().data
+        basis = np.array([v.co for v in model.vertices], np.float32)[:, (0, 2, 1)] * np.float32(scale)
+        co = np.empty(basis.size, np.float32)
+        mesh.vertices.foreach_get('co', co)
+        self.assertTrue(np.allclose(co.reshape(-1, 3), basis, atol=1e-6))
+        key_blocks = mesh.shape_keys.key_blocks
+        key_blocks[0].data.foreach_get('co', co)
+        self.assertTrue(np.allclose(co.reshape(-1, 3), basis, atol=1e-6))
+        for morph in model.morphs:
+            expected = basis.copy()
+            for x in morph.offsets:
+                expected[x.index] += np.array(x.offset, np.float32)[[0, 2, 1]] * np.float32(scale)
+            key_blocks[morph.name].data.foreach_get('co', co)
+            self.assertTrue(np.allclose(co.reshape(-1, 3), expected, atol=1e-5), morph.name)
+
+    def test_reimport_vertices(self):
+        types, scale = {'MESH', 'ARMATURE', 'PHYSICS', 'MORPHS'}, 0.5
+        model = self.__create_update_model()
+        rig = self.__import_model(model, types, scale, store_digests=True)
+
+        model.vertices[4].co = (2.0, 3.0, 4.0)
+        model.morphs[1].offsets[0].offset = (0.0, 0.0, 2.0)
+        self.assertEqual(self.__reimport_model(rig, model, types, scale), {'vertices', 'morphs'})
+        # the basis moves the unchanged shape key too
+        self.__assert_shape_keys(rig, model, scale)
+        # the digests are updated
+        self.assertEqual(self.__reimport_model(rig, model, types, scale), set())
+        self.__remove_model(rig)
+
+    def test_reimport_materials_rigids(self):
+        types, scale = {'MESH', 'ARMATURE', 'PHYSICS', 'MORPHS'}, 0.5
+        model = self.__create_update_model()
+        rig = self.__import_model(model, types, scale, store_digests=True)
+
+        model.materials[1].diffuse = (1.0, 0.0, 0.0, 1.0)
+        model.rigids[1].size = (1.0, 2.0, 3.0)
+        self.assertEqual(self.__reimport_model(rig, model, types, scale), {'materials', 'rigids'})
+        materials = rig.firstMesh().data.materials
+        self.assertTrue(np.allclose(materials[0].mmd_material.diffuse_color, (1, 1, 1)))
+        self.assertTrue(np.allclose(materials[1].mmd_material.diffuse_color, (1, 0, 0)))
+        rigid_objs = sorted(rig.rigidBodies(), key=lambda x: x.name)
+        self.assertEqual([x.mmd_rigid.name_j for x in rigid_objs], ['rigid0', 'rigid1'])
+        self.assertTrue(np.allclose(rigid_objs[0].mmd_rigid.size, np.array((0.5, 0.75, 0.25)) * scale, atol=1e-5))
+        self.assertTrue(np.allclose(rigid_objs[1].mmd_rigid.size, np.array((1.0, 3.0, 2.0)) * scale, atol=1e-5))
+        self.__remove_model(rig)
+
+    def test_reimport_unsupported(self):
+        types, scale = {'MESH', 'ARMATURE', 'MORPHS'}, 1.0
+        model = self.__create_update_model()
+        rig = self.__import_model(model, types, scale, store_digests=True)
+        root = rig.rootObject()
+        mesh_data = self.__mesh_data(rig)
+        digests = root[PMXImporter.DIGESTS_KEY].to_dict()
+
+        # a changed bone or face list requires a full import, even with updatable changes
+        model.vertices[4].co = (2.0, 3.0, 4.0)
+        model.bones[0].location = (0.0, 1.0, 0.0)
+        self.assertRaises(ValueError, self.__reimport_model, rig, model, types, scale)
+        model.bones[0].location = (0.0, 0.0, 0.0)
+        model.faces[0] = (2, 1, 0)
+        self.assertRaises(ValueError, self.__reimport_model, rig, model, types, scale)
+        self.assertEqual(self.__mesh_data(rig), mesh_data)
+        self.assertEqual(root[PMXImporter.DIGESTS_KEY].to_dict(), digests)
+        self.__remove_model(rig)
+
+        # a model imported without the digests
+        rig = self.__import_model(model, types, scale)
+        self.assertNotIn(PMXImporter.DIGESTS_KEY, rig.rootObject().keys())
+        self.assertRaises(ValueError, self.__reimport_model, rig, model, types, scale)
+        self.__remove_model(rig)
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
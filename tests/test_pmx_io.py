@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+
+import os
+import pickle
+import random
+import unittest
+
+from mmd_tools.core import pmx
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestPmxIO(unittest.TestCase):
+    output_count = 0
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        random.seed(0)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    @staticmethod
+    def __float32(value):
+        import struct
+        return struct.unpack('<f', struct.pack('<f', value))[0]
+
+    def __random_vector(self, size):
+        return tuple(self.__float32(random.uniform(-1, 1)) for i in range(size))
+
+    def __random_weight(self, weight_type, bone_count):
+        weight = pmx.BoneWeight()
+        weight.type = weight_type
+        bone = lambda: random.randrange(-1, bone_count)
+        if weight_type == pmx.BoneWeight.BDEF1:
+            weight.bones = [bone()]
+        elif weight_type == pmx.BoneWeight.BDEF2:
+            weight.bones = [bone(), bone()]
+            weight.weights = [self.__float32(random.random())]
+        elif weight_type == pmx.BoneWeight.BDEF4:
+            weight.bones = [bone() for i in range(4)]
+            weight.weights = self.__random_vector(4)
+        elif weight_type == pmx.BoneWeight.SDEF:
+            weight.bones = [bone(), bone()]
+            weight.weights = pmx.BoneWeightSDEF(self.__float32(random.random()),
+                self.__random_vector(3), self.__random_vector(3), self.__random_vector(3))
+        return weight
+
+    def __create_model(self, vertex_count, weight_types, additional_uvs, bone_count=300):
+        model = pmx.Model()
+        model.name = 'test'
+        for i in range(bone_count):
+            bone = pmx.Bone()
+            bone.name = 'bone%d'%i
+            bone.location = self.__random_vector(3)
+            model.bones.append(bone)
+        for i in range(vertex_count):
+            v = pmx.Vertex()
+            v.co = self.__random_vector(3)
+            v.normal = self.__random_vector(3)
+            v.uv = self.__random_vector(2)
+            v.additional_uvs = [self.__random_vector(4) for j in range(additional_uvs)]
+            v.weight = self.__random_weight(random.choice(weight_types), bone_count)
+            v.edge_scale = self.__float32(random.random())
+            model.vertices.append(v)
+        model.faces = [tuple(random.randrange(vertex_count) for j in range(3)) for i in range(vertex_count)]
+        return model
+
+    def __create_full_model(self):
+        model = self.__create_model(50, [t for t, name in pmx.BoneWeight.TYPES], 1, bone_count=3)
+        vec = self.__random_vector
+
+        for i in range(3):
+            texture = pmx.Texture()
+            texture.path = os.path.join(TESTS_DIR, 'output', 'tex%d.png'%i)
+            model.textures.append(texture)
+
+        for i, face_count in enumerate((20, 30)):
+            mat = pmx.Material()
+            mat.name = 'mat%d'%i
+            mat.diffuse, mat.specular, mat.ambient = vec(4), vec(3), vec(3)
+            mat.edge_color = vec(4)
+            mat.texture, mat.sphere_texture, mat.sphere_texture_mode = 1, 2, 1
+            mat.is_shared_toon_texture, mat.toon_texture = (i == 0), i
+            mat.comment = 'comment%d'%i
+            mat.vertex_count = face_count * 3
+            model.materials.append(mat)
+
+        b0, b1, b2 = model.bones
+        b1.parent, b1.displayConnection = 0, vec(3)
+        b1.hasAdditionalRotate, b1.additionalTransform = True, (0, 0.5)
+        b1.axis = vec(3)
+        b1.localCoordinate = pmx.Coordinate(vec(3), vec(3))
+        b1.externalTransKey = 2
+        b2.parent, b2.isIK, b2.target, b2.loopCount, b2.rotationConstraint = 1, True, 0, 40, 0.5
+        b2.ik_links = [pmx.IKLink(), pmx.IKLink()]
+        b2.ik_links[0].target = 1
+        b2.ik_links[1].target = 0
+        b2.ik_links[1].minimumAngle, b2.ik_links[1].maximumAngle = vec(3), vec(3)
+
+        def add_morph(morph_class, offset_class, type_index=None, **values):
+            morph = morph_class(name=morph_class.__name__, name_e='', category=1, type_index=type_index)
+            offset = offset_class()
+            for k, v in values.items():
+                setattr(offset, k, v)
+            morph.offsets.append(offset)
+            model.morphs.append(morph)
+        add_morph(pmx.GroupMorph, pmx.GroupMorphOffset, morph=1, factor=0.5)
+        add_morph(pmx.VertexMorph, pmx.VertexMorphOffset, index=3, offset=vec(3))
+        add_morph(pmx.BoneMorph, pmx.BoneMorphOffset, index=1, location_offset=vec(3), rotation_offset=vec(4))
+        add_morph(pmx.UVMorph, pmx.UVMorphOffset, type_index=4, index=5, offset=vec(4))
+        add_morph(pmx.MaterialMorph, pmx.MaterialMorphOffset, index=1, offset_type=1,
+                  diffuse_offset=vec(4), specular_offset=vec(3), shininess_offset=0.5, ambient_offset=vec(3),
+                  edge_color_offset=vec(4), edge_size_offset=0.5, texture_factor=vec(4),
+                  sphere_texture_factor=vec(4), toon_texture_factor=vec(4))
+
+        model.display[0].data = [(0, 0)]
+        model.display[1].data = [(1, 1), (1, 3)]
+
+        for i in range(2):
+            rigid = pmx.Rigid()
+            rigid.name, rigid.bone = 'rigid%d'%i, i
+            rigid.size, rigid.location, rigid.rotation = vec(3), vec(3), vec(3)
+            rigid.velocity_attenuation = rigid.rotation_attenuation = rigid.bounce = rigid.friction = 0.5
+            model.rigids.append(rigid)
+
+        joint = pmx.Joint()
+        joint.name, joint.src_rigid, joint.dest_rigid = 'joint', 0, 1
+        for k in ('location', 'rotation', 'maximum_location', 'minimum_location', 'maximum_rotation',
+                  'minimum_rotation', 'spring_constant', 'spring_rotation_constant'):
+            setattr(joint, k, vec(3))
+        model.joints.append(joint)
+        return model
+
+    def __object_key(self, obj):
+        if isinstance(obj, (list, tuple, pmx._LazyList)):
+            return [self.__object_key(x) for x in obj]
+        if hasattr(obj, '__dict__'):
+            return {k:self.__object_key(v) for k, v in vars(obj).items()}
+        return obj
+
+    def __vertex_key(self, v):
+        w = v.weight
+        if w.type == pmx.BoneWeight.SDEF:
+            weights = (w.weights.weight, tuple(w.weights.c), tuple(w.weights.r0), tuple(w.weights.r1))
+        else:
+            weights = tuple(w.weights)
+        return (tuple(v.co), tuple(v.normal), tuple(v.uv), [tuple(i) for i in v.additional_uvs],
+                w.type, list(w.bones), weights, v.edge_scale)
+
+    def __save_and_load(self, model, additional_uvs, use_mmap=False):
+        # mapped files can not be overwritten on some platforms
+        TestPmxIO.output_count += 1
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_%d.pmx'%TestPmxIO.output_count)
+        pmx.save(output_pmx, model, add_uv_count=additional_uvs)
+        return pmx.load(output_pmx, use_mmap=use_mmap)
+
+    #********************************************
+    # Vertices
+    #********************************************
+
+    def test_vertices(self):
+        all_types = [t for t, name in pmx.BoneWeight.TYPES]
+        for weight_types in [[t] for t in all_types] + [all_types]:
+            for additional_uvs, use_mmap in ((0, False), (3, False), (0, True), (3, True)):
+                source_model = self.__create_model(500, weight_types, additional_uvs)
+                result_model = self.__save_and_load(source_model, additional_uvs, use_mmap)
+                self.assertEqual(len(source_model.vertices), len(result_model.vertices))
+                for v0, v1 in zip(source_model.vertices, result_model.vertices):
+                    self.assertEqual(self.__vertex_key(v0), self.__vertex_key(v1))
+                self.assertEqual(source_model.faces, result_model.faces)
+                self.assertEqual([b.name for b in source_model.bones], [b.name for b in result_model.bones])
+
+    def test_vertex_arrays(self):
+        all_types = [t for t, name in pmx.BoneWeight.TYPES]
+        source_model = self.__create_model(100, all_types, 1)
+        result_model = self.__save_and_load(source_model, 1)
+
+        vertices = result_model.vertices
+        vertices[3].co = (1.0, 2.0, 3.0)
+        vertices[5] = source_model.vertices[7]
+        data = vertices.data()
+        self.assertEqual(len(data), 100)
+        self.assertEqual(data.co[3].tolist(), [1.0, 2.0, 3.0])
+        self.assertEqual(self.__vertex_key(data.item(5)), self.__vertex_key(source_model.vertices[7]))
+        self.assertEqual(self.__vertex_key(data.item(9)), self.__vertex_key(source_model.vertices[9]))
+
+        data = pmx.VertexArrays.fromVertices(source_model.vertices, 1)
+        for i, v in enumerate(source_model.vertices):
+            self.assertEqual(self.__vertex_key(data.item(i)), self.__vertex_key(v))
+
+        del vertices[10:]
+        self.assertEqual(len(vertices), 10)
+        self.assertIsNone(vertices.data())
+
+    def test_model_arrays(self):
+        source_model = self.__create_model(100, [pmx.BoneWeight.BDEF2], 0)
+        for morph_class, offset_class, size in ((pmx.VertexMorph, pmx.VertexMorphOffset, 3), (pmx.UVMorph, pmx.UVMorphOffset, 4)):
+            morph = morph_class(name=morph_class.__name__, name_e='', category=4)
+            for i in random.sample(range(100), 20):
+                offset = offset_class()
+                offset.index = i
+                offset.offset = self.__random_vector(size)
+                morph.offsets.append(offset)
+            source_model.morphs.append(morph)
+        result_model = self.__save_and_load(source_model, 0, use_mmap=True)
+
+        for arrays in (pmx.ModelArrays(source_model), pmx.ModelArrays(result_model)):
+            self.assertEqual(arrays.faces.tolist(), [list(f) for f in source_model.faces])
+            self.assertEqual(arrays.vertices.co.tolist(), [list(v.co) for v in source_model.vertices])
+            self.assertEqual(len(arrays.morphs), len(source_model.morphs))
+            for morph, offsets in zip(source_model.morphs, arrays.morphs):
+                self.assertEqual(offsets.index.tolist(), [x.index for x in morph.offsets])
+                self.assertEqual(offsets.offset.tolist(), [list(x.offset) for x in morph.offsets])
+
+        for m0, m1 in zip(source_model.morphs, result_model.morphs):
+            self.assertEqual([(x.index, tuple(x.offset)) for x in m0.offsets], [(x.index, x.offset) for x in m1.offsets])
+
+    def test_save(self):
+        source_model = self.__create_full_model()
+        all_types = [t for t, name in pmx.BoneWeight.TYPES]
+        source_model.vertices = self.__create_model(300, all_types, 1).vertices
+        source_model.faces = [(i, i+1, i+2) for i in range(0, 297, 3)]
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_save.pmx')
+        pmx.save(output_pmx, source_model, add_uv_count=1)
+        with open(output_pmx, 'rb') as f:
+            source_data = f.read()
+
+        for use_mmap in (False, True):
+            model = pmx.load(output_pmx, use_mmap=use_mmap)
+            model.vertices[7].co = (1.0, 2.0, 3.0)
+            model.faces[2] = (5, 6, 7)
+            for morph in model.morphs:
+                if isinstance(morph, pmx.VertexMorph):
+                    morph.offsets[0].offset = (0.5, 0.5, 0.5)
+            TestPmxIO.output_count += 1
+            result_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_%d.pmx'%TestPmxIO.output_count)
+            pmx.save(result_pmx, model, add_uv_count=1)
+            del model
+
+            # unchanged sections are written byte by byte, the others are written like pmx objects
+            model = pmx.load(result_pmx)
+            self.assertEqual(model.vertices[7].co, (1.0, 2.0, 3.0))
+            self.assertEqual(model.faces[2], (5, 6, 7))
+            model.vertices[7] = source_model.vertices[7]
+            model.faces[2] = source_model.faces[2]
+            for morph, source_morph in zip(model.morphs, source_model.morphs):
+                if isinstance(morph, pmx.VertexMorph):
+                    self.assertEqual(morph.offsets[0].offset, (0.5, 0.5, 0.5))
+                    morph.offsets[0] = source_morph.offsets[0]
+            pmx.save(result_pmx, model, add_uv_count=1)
+            with open(result_pmx, 'rb') as f:
+                self.assertEqual(f.read(), source_data)
+
+    def test_writer(self):
+        source_model = self.__create_full_model()
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_writer.pmx')
+        pmx.save(output_pmx, source_model, add_uv_count=1)
+        with open(output_pmx, 'rb') as f:
+            source_data = f.read()
+
+        counts = {name:len(getattr(source_model, name)) for name in pmx.Header.INDEXED_SECTIONS}
+        result_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_writer_result.pmx')
+        with pmx.open_writer(result_pmx, counts, add_uv_count=1) as writer:
+            writer.writeInfo(source_model.name, source_model.name_e, source_model.comment, source_model.comment_e)
+            with self.assertRaises(ValueError):
+                writer.writeSection('faces', source_model.faces)
+            for name in pmx.Model.SECTIONS:
+                items = getattr(source_model, name)
+                writer.beginSection(name, len(items))
+                for i in range(0, len(items), 7): # written in parts
+                    writer.write(items[i:i+7])
+                writer.endSection()
+        with open(result_pmx, 'rb') as f:
+            self.assertEqual(f.read(), source_data)
+
+        # an incomplete file is removed
+        with self.assertRaises(ValueError):
+            with pmx.open_writer(result_pmx, counts, add_uv_count=1) as writer:
+                writer.writeInfo(source_model.name, source_model.name_e, source_model.comment, source_model.comment_e)
+                writer.writeSection('vertices', source_model.vertices)
+        self.assertFalse(os.path.exists(result_pmx))
+
+        counts['morphs'] = 100
+        with pmx.open_writer(result_pmx, counts, add_uv_count=1) as writer:
+            writer.writeInfo(source_model.name, source_model.name_e, source_model.comment, source_model.comment_e)
+            for name in ('vertices', 'faces', 'textures', 'materials', 'bones'):
+                writer.writeSection(name, getattr(source_model, name))
+            with self.assertRaises(ValueError): # over the index size of the counts
+                writer.beginSection('morphs', 200)
+            for name in pmx.Model.SECTIONS[5:]:
+                writer.writeSection(name, getattr(source_model, name))
+        self.assertEqual(self.__object_key(pmx.load(result_pmx).morphs), self.__object_key(pmx.load(output_pmx).morphs))
+
+    #********************************************
+    # Sections
+    #********************************************
+
+    def test_sections(self):
+        source_model = self.__create_full_model()
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_sections.pmx')
+        pmx.save(output_pmx, source_model, add_uv_count=1)
+        full_model = pmx.load(output_pmx)
+        self.assertEqual(sorted(full_model.section_offsets.keys()), sorted(pmx.Model.SECTIONS))
+        for name in ('bones', 'morphs', 'display', 'rigids', 'joints'):
+            self.assertEqual(len(getattr(full_model, name)), len(getattr(source_model, name)), name)
+
+        for sections in (set(), {'vertices'}, {'faces'}, {'textures', 'materials'}, {'bones'}, {'morphs'},
+                         {'display'}, {'rigids'}, {'joints'}, {'bones', 'rigids', 'joints'}, {'bones', 'morphs'}):
+            for use_mmap in (False, True):
+                model = pmx.load(output_pmx, use_mmap=use_mmap, sections=sections)
+                for name in pmx.Model.SECTIONS:
+                    if name in sections:
+                        self.assertEqual(self.__object_key(getattr(model, name)), self.__object_key(getattr(full_model, name)), name)
+                    else:
+                        self.assertEqual(getattr(model, name), [], name)
+                for name, offset in model.section_offsets.items():
+                    self.assertEqual(offset, full_model.section_offsets[name], name)
+
+        # the sections after the last requested one are counted without creating objects
+        with pmx.FileReadStream(output_pmx) as fs:
+            header = pmx.Header()
+            header.load(fs)
+            fs.setHeader(header)
+            model = pmx.Model()
+            model.load(fs, sections={'textures'}, count_all=True)
+        self.assertEqual((model.joints, model.rigids), ([], []))
+        for name in pmx.Model.SECTIONS:
+            self.assertEqual(model.section_counts[name], len(getattr(full_model, name)), name)
+
+        # the sections of an import of the armature and morphs without the mesh
+        model = pmx.load(output_pmx, sections={'bones', 'morphs'})
+        arrays = pmx.ModelArrays(model)
+        self.assertEqual((len(arrays.vertices), len(arrays.faces)), (0, 0))
+        self.assertEqual(len(arrays.morphs), len(full_model.morphs))
+        for morph, offsets in zip(full_model.morphs, arrays.morphs):
+            if isinstance(morph, (pmx.VertexMorph, pmx.UVMorph)):
+                self.assertEqual(offsets.index.tolist(), [x.index for x in morph.offsets], morph.name)
+            else:
+                self.assertIsNone(offsets, morph.name)
+
+    def test_probe(self):
+        source_model = self.__create_full_model()
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_probe.pmx')
+        pmx.save(output_pmx, source_model, add_uv_count=1)
+        full_model = pmx.load(output_pmx)
+
+        info = pmx.probe(output_pmx)
+        self.assertEqual(info['format'], 'pmx')
+        self.assertEqual(info['name'], source_model.name)
+        self.assertEqual(info['textures'], [t.path for t in full_model.textures])
+        for name in pmx.Model.SECTIONS:
+            self.assertEqual(info['num_'+name], len(getattr(full_model, name)), name)
+
+    #********************************************
+    # Records
+    #********************************************
+
+    def test_records(self):
+        source_model = self.__create_full_model()
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_records.pmx')
+        pmx.save(output_pmx, source_model, add_uv_count=1)
+        with open(output_pmx, 'rb') as f:
+            data = f.read()
+        pmx.save(output_pmx, pmx.load(output_pmx), add_uv_count=1)
+        with open(output_pmx, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        # the values before truncated joint data are kept
+        with open(output_pmx, 'wb') as f:
+            f.write(data[:-30])
+        for use_mmap in (False, True):
+            model = pmx.load(output_pmx, use_mmap=use_mmap)
+            joint, source_joint = model.joints[-1], source_model.joints[-1]
+            self.assertEqual(joint.location, source_joint.location)
+            self.assertEqual(joint.spring_rotation_constant, (0, 0, 0))
+
+    def test_pickle(self):
+        output_pmx = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_pickle.pmx')
+        pmx.save(output_pmx, self.__create_full_model(), add_uv_count=1)
+
+        for use_mmap in (False, True):
+            model = pmx.load(output_pmx, use_mmap=use_mmap)
+            model.vertices[0].co = [1.0, 2.0, 3.0]
+            del model.faces[-1:]
+            loaded_model = pickle.loads(pickle.dumps(model))
+            self.assertIsNotNone(loaded_model.vertices.data())
+            self.assertIsNone(loaded_model.faces.data())
+            self.assertEqual(self.__vertex_key(loaded_model.vertices[0]), self.__vertex_key(model.vertices[0]))
+            self.assertEqual(loaded_model.faces, model.faces)
+
+            data = []
+            for i, m in enumerate((model, loaded_model)):
+                filepath = os.path.join(TESTS_DIR, 'output', 'test_pmx_io_pickle_%d.pmx'%i)
+                pmx.save(filepath, m, add_uv_count=1)
+                with open(filepath, 'rb') as f:
+                    data.append(f.read())
+            self.assertEqual(data[1], data[0])
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()
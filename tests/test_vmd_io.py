@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import unittest
+
+from mmd_tools.core import vmd
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class TestVmdIO(unittest.TestCase):
+
+    def setUp(self):
+        '''
+        '''
+        import logging
+        logger = logging.getLogger()
+        logger.setLevel('ERROR')
+        random.seed(0)
+
+    #********************************************
+    # Utils
+    #********************************************
+
+    def __random_vector(self, size):
+        return [random.uniform(-10, 10) for i in range(size)]
+
+    def __create_file(self, bone_count=20, morph_count=10, key_count=2000):
+        vmd_file = vmd.File()
+        vmd_file.header = vmd.Header()
+        vmd_file.header.model_name = 'モデル'
+
+        vmd_file.boneAnimation = vmd.BoneAnimation()
+        bone_names = ['ボーン%d'%i for i in range(bone_count)]
+        for i in range(key_count):
+            key = vmd.BoneFrameKey()
+            key.frame_number = random.randrange(1000)
+            key.location = self.__random_vector(3)
+            key.rotation = self.__random_vector(4)
+            key.interp = [random.randrange(128) for i in range(64)]
+            vmd_file.boneAnimation[random.choice(bone_names)].append(key)
+
+        vmd_file.shapeKeyAnimation = vmd.ShapeKeyAnimation()
+        morph_names = ['モーフ%d'%i for i in range(morph_count)]
+        for i in range(key_count//4):
+            key = vmd.ShapeKeyFrameKey()
+            key.frame_number = random.randrange(1000)
+            key.weight = random.random()
+            vmd_file.shapeKeyAnimation[random.choice(morph_names)].append(key)
+
+        vmd_file.cameraAnimation = vmd.CameraAnimation()
+        for i in range(10):
+            key = vmd.CameraKeyFrameKey()
+            key.frame_number = i * 100
+            key.distance = random.random()
+            key.location = self.__random_vector(3)
+            key.rotation = self.__random_vector(3)
+            key.interp = [20] * 24
+            key.angle = 30
+            vmd_file.cameraAnimation.append(key)
+        return vmd_file
+
+    @staticmethod
+    def __frame_key(key):
+        return {k:(list(v) if isinstance(v, (list, tuple)) else v) for k, v in vars(key).items()}
+
+    def __save_file(self, vmd_file, name):
+        output_vmd = os.path.join(TESTS_DIR, 'output', 'test_vmd_io_%s.vmd'%name)
+        vmd_file.save(filepath=output_vmd)
+        return output_vmd
+
+    def __load_file(self, filepath):
+        vmd_file = vmd.File()
+        vmd_file.load(filepath=filepath)
+        return vmd_file
+
+    #********************************************
+    # Stream Reader
+    #********************************************
+
+    def test_stream_reader(self):
+        output_vmd = self.__save_file(self.__create_file(), 'stream')
+        source = self.__load_file(output_vmd)
+
+        with vmd.StreamReader(output_vmd) as reader:
+            self.assertEqual(reader.header.model_name, source.header.model_name)
+            for anim, tracks in ((source.boneAnimation, reader.boneAnimation), (source.shapeKeyAnimation, reader.shapeKeyAnimation)):
+                self.assertEqual(list(tracks.keys()), list(anim.keys()))
+                for name, keys in anim.items():
+                    keys = sorted(keys, key=lambda x: x.frame_number)
+                    self.assertEqual(len(tracks[name]), len(keys))
+                    self.assertEqual([self.__frame_key(k) for k in tracks[name]], [self.__frame_key(k) for k in keys], name)
+            self.assertEqual([self.__frame_key(k) for k in reader.cameraAnimation], [self.__frame_key(k) for k in source.cameraAnimation])
+
+    def test_stream_reader_filters(self):
+        output_vmd = self.__save_file(self.__create_file(), 'stream_filters')
+        source = self.__load_file(output_vmd)
+
+        bone_names = {'ボーン1', 'ボーン3', 'unknown'}
+        with vmd.StreamReader(output_vmd, frame_range=(200, 500), bone_names=bone_names, morph_names=()) as reader:
+            self.assertEqual(set(reader.boneAnimation.keys()), {'ボーン1', 'ボーン3'})
+            self.assertEqual(len(reader.shapeKeyAnimation), 0)
+            for name, track in reader.boneAnimation.items():
+                keys = sorted((k for k in source.boneAnimation[name] if 200 <= k.frame_number <= 500), key=lambda x: x.frame_number)
+                self.assertEqual([self.__frame_key(k) for k in track], [self.__frame_key(k) for k in keys], name)
+            self.assertEqual([k.frame_number for k in reader.cameraAnimation], [200, 300, 400, 500])
+
+    #********************************************
+    # Track Arrays
+    #********************************************
+
+    def test_track_arrays(self):
+        output_vmd = self.__save_file(self.__create_file(), 'arrays')
+        source = self.__load_file(output_vmd)
+        with open(output_vmd, 'rb') as f:
+            source_data = f.read()
+
+        vmd_file = vmd.File()
+        vmd_file.load(filepath=output_vmd, use_arrays=True)
+        for anim, tracks in ((source.boneAnimation, vmd_file.boneAnimation), (source.shapeKeyAnimation, vmd_file.shapeKeyAnimation)):
+            self.assertEqual(list(tracks.keys()), list(anim.keys()))
+            for name, keys in anim.items():
+                self.assertEqual([self.__frame_key(k) for k in tracks[name]], [self.__frame_key(k) for k in keys], name)
+
+        output_vmd = os.path.join(TESTS_DIR, 'output', 'test_vmd_io_arrays_saved.vmd')
+        vmd_file.save(filepath=output_vmd)
+        with open(output_vmd, 'rb') as f:
+            self.assertEqual(f.read(), source_data)
+
+        track = vmd_file.boneAnimation['ボーン0']
+        frame_numbers = sorted(track.frame_number.tolist())
+        self.assertEqual(track.sorted().frame_number.tolist(), frame_numbers)
+        self.assertEqual(track.window(100, 300).frame_number.tolist(), [i for i in track.frame_number.tolist() if 100 <= i <= 300])
+
+        other = vmd.BoneTrackArrays(2)
+        other.frame_number[:] = (frame_numbers[0], 2000)
+        merged = track.merge(other)
+        self.assertEqual(merged.frame_number.tolist(), sorted(set(frame_numbers + [2000])))
+        self.assertEqual(merged.item(0).rotation, [0.0, 0.0, 0.0, 1.0])
+        self.assertEqual(len(track.merge(vmd.BoneTrackArrays())), len(set(frame_numbers)))
+
+    #********************************************
+    # Names
+    #********************************************
+
+    def test_name_cache(self):
+        output_vmd = self.__save_file(self.__create_file(), 'names')
+        vmd_file = self.__load_file(output_vmd)
+        with vmd.StreamReader(output_vmd) as reader:
+            for name in vmd_file.boneAnimation.keys():
+                self.assertIs(next(k for k in reader.boneAnimation.keys() if k == name), name)
+
+        raw_name = 'ボーン1'.encode('shift_jis') + b'\x00\xfd\xfd'
+        self.assertEqual(vmd._toShiftJisString(raw_name), 'ボーン1')
+        self.assertIs(vmd._toShiftJisString(raw_name), vmd._toShiftJisString(bytes(raw_name)))
+        self.assertEqual(vmd._toShiftJisBytes('ボーン1'), 'ボーン1'.encode('shift_jis'))
+
+        calls = []
+        cache = vmd.NameCache(lambda name: calls.append(name) or name.upper(), size_limit=2)
+        self.assertEqual([cache[i] for i in ('a', 'b', 'a', 'c', 'a')], ['A', 'B', 'A', 'C', 'A'])
+        self.assertEqual(calls, ['a', 'b', 'c', 'a'])
+
+if __name__ == '__main__':
+    import sys
+    sys.argv = [__file__] + (sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else [])
+    unittest.main()